@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from indexes import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ActivityLog:
+    """Append-only record of who changed what in each session, for attribution reports.
+
+    Requests only append events to an in-memory queue; a background task writes them in
+    unordered insert_many batches, so a slow or failing write never holds up a save. Events
+    expire after the retention period through a TTL index (a capped collection would also
+    drop the history of quiet sessions whenever busy ones fill it). Events still queued when
+    the process dies are lost, and the queue drops its oldest events if it overflows.
+    """
+
+    def __init__(self, db, retention_seconds: int, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0):
+        self.collection = db.session_activity
+        self.retention = retention_seconds
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: deque = deque(maxlen=max_queue)
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        await asyncio.gather(
+            self.collection.create_index([("session_id", 1), ("_id", -1)]),
+            ensure_ttl_index(self.collection, "created_at", self.retention),
+        )
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        # Let the flusher finish a batch it may be writing; cancelling it mid-insert loses the batch
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._queue:
+            if not await self.flush():
+                break
+
+    def record(self, user: dict, session_id: Optional[str], artifact: str, operation: str,
+               item_ids: Iterable[str] = ()):
+        if len(self._queue) == self._queue.maxlen:
+            self._dropped += 1
+        # The ObjectId is taken now so events sort in the order they happened, not were written
+        self._queue.append({
+            "_id": ObjectId(),
+            "session_id": session_id,
+            "user_id": user["id"],
+            "user_name": user.get("name"),
+            "artifact": artifact,
+            "operation": operation,
+            "item_ids": list(item_ids),
+            "created_at": utcnow(),
+        })
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> bool:
+        """Write one batch of queued events; False if the write failed and they were requeued."""
+        if self._dropped:
+            logger.warning(f"Activity queue overflowed; dropped {self._dropped} events")
+            self._dropped = 0
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        if not batch:
+            return True
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Typically duplicates from retrying a batch that was partly written; the rest are stored
+            logger.warning(f"Activity batch partly rejected: {len(e.details.get('writeErrors', []))} events")
+        except asyncio.CancelledError:
+            self._queue.extendleft(reversed(batch[:self._queue.maxlen - len(self._queue)]))
+            raise
+        except Exception as e:
+            logger.warning(f"Activity batch of {len(batch)} events failed, will retry: {e}")
+            self._queue.extendleft(reversed(batch[:self._queue.maxlen - len(self._queue)]))
+            return False
+        return True
+
+    async def _flush_periodically(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._queue:
+                if not await self.flush() or len(self._queue) < self.batch_size:
+                    break
+
+    async def for_session(self, session_id: str, limit: int, before: Optional[ObjectId] = None) -> List[dict]:
+        """The session's newest events (older than `before`), including ones not yet written."""
+        query: dict = {"session_id": session_id}
+        if before is not None:
+            query["_id"] = {"$lt": before}
+        stored = await self.collection.find(query).sort("_id", -1).to_list(limit)
+        written = {event["_id"] for event in stored}
+        pending = [
+            event for event in self._queue
+            if event["session_id"] == session_id and (before is None or event["_id"] < before)
+            and event["_id"] not in written
+        ]
+        return sorted(stored + pending, key=lambda event: event["_id"], reverse=True)[:limit]
+
+    async def forget(self, session_ids: List[str]):
+        forgotten = set(session_ids)
+        kept = [event for event in self._queue if event["session_id"] not in forgotten]
+        self._queue.clear()
+        self._queue.extend(kept)
+        await self.collection.delete_many({"session_id": {"$in": session_ids}})
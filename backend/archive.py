@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import zlib
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import bson
+from pymongo import ReplaceOne, UpdateOne
+
+from layouts import embed, tool_path
+
+logger = logging.getLogger(__name__)
+
+# BSON documents are capped at 16MB; leave room for the archive record's own fields
+MAX_ARCHIVE_BYTES = 15 * 1024 * 1024
+
+
+class SessionArchive:
+    """Moves the tool artifacts of idle sessions into one zlib-compressed BSON record per
+    session, and restores them the first time the session is opened again.
+
+    The session document itself stays in the hot collection, marked with `archived_at`, so
+    listings and access checks work unchanged and only archived sessions pay for a restore.
+    Records hold artifacts in the separate-layout shape either way, so they restore into
+    whichever storage layout is configured at the time.
+    """
+
+    def __init__(self, db, collections: List[str], compression_level: int = 6, embedded: bool = False):
+        self.db = db
+        self.embedded = embedded
+        self.records = db.session_archive
+        self.collections = collections
+        self.level = compression_level
+        self._restoring: Dict[str, asyncio.Future] = {}
+
+    async def ensure_indexes(self):
+        await self.db.sessions.create_index([("updated_at", 1)])
+
+    async def archive_idle(self, cutoff: str, batch_size: int = 200,
+                           progress: Optional[Callable[[float], Awaitable[None]]] = None) -> dict:
+        """Archive sessions with no session or artifact change since `cutoff` (ISO timestamp)."""
+        idle = {
+            "archived_at": None,
+            "updated_at": {"$lt": cutoff},
+            "$or": [{"rehydrated_at": None}, {"rehydrated_at": {"$lt": cutoff}}],
+        }
+        total = await self.db.sessions.count_documents(idle)
+        stats = {"sessions_scanned": 0, "sessions_archived": 0, "documents_moved": 0, "bytes_before": 0, "bytes_after": 0}
+        # Page on _id: under the compact encodings `id` holds binary or (while migrating) mixed
+        # values, which a range on the API's string ids cannot walk
+        query = idle
+        while True:
+            batch = await self.db.sessions.find(
+                query, {"_id": 1, "id": 1, "project_id": 1}
+            ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            query = {**idle, "_id": {"$gt": batch[-1]["_id"]}}
+            stats["sessions_scanned"] += len(batch)
+            await self._archive_batch(batch, cutoff, stats)
+            if progress:
+                await progress(stats["sessions_scanned"] / max(total, 1))
+        return stats
+
+    async def _archive_batch(self, sessions: List[dict], cutoff: str, stats: dict):
+        ids = [s["id"] for s in sessions]
+        bundles = {session_id: {} for session_id in ids}
+        embedded = {}
+        if self.embedded:
+            async for session in self.db.sessions.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "tools": 1}):
+                embedded[session["id"]] = session.get("tools")
+                for collection, doc in (session.get("tools") or {}).items():
+                    bundles[session["id"]][collection] = {**doc, "session_id": session["id"]}
+        else:
+            found = await asyncio.gather(*(
+                self.db[c].find({"session_id": {"$in": ids}}, {"_id": 0}).to_list(None) for c in self.collections
+            ))
+            for collection, docs in zip(self.collections, found):
+                for doc in docs:
+                    bundles[doc["session_id"]][collection] = doc
+        now = datetime.now(timezone.utc).isoformat()
+        records = []
+        for session in sessions:
+            artifacts = bundles[session["id"]]
+            if any(max(doc.get("updated_at") or "", doc.get("restored_at") or "") >= cutoff for doc in artifacts.values()):
+                continue  # a tool was edited (or restored) recently even though the session row was not
+            raw = bson.encode({"artifacts": artifacts})
+            data = zlib.compress(raw, self.level)
+            if len(data) > MAX_ARCHIVE_BYTES:
+                logger.warning(f"Session {session['id']} is too large to archive ({len(data)} bytes compressed)")
+                continue
+            records.append({
+                "_id": session["id"],
+                "project_id": session.get("project_id"),
+                "collections": sorted(artifacts),
+                "documents": len(artifacts),
+                "raw_bytes": len(raw),
+                "compressed_bytes": len(data),
+                "archived_at": now,
+                "data": bson.Binary(data),
+            })
+        if not records:
+            return
+        await self.records.bulk_write([ReplaceOne({"_id": r["_id"]}, r, upsert=True) for r in records], ordered=False)
+        archived = [r["_id"] for r in records]
+        if self.embedded:
+            # Marking and removing the embedded copies is one update per session, applied only
+            # while its tools are exactly what was archived
+            await self.db.sessions.bulk_write([
+                UpdateOne(
+                    {"id": session_id, "updated_at": {"$lt": cutoff}, "tools": embedded.get(session_id)},
+                    {"$set": {"archived_at": now}, "$unset": {"tools": ""}}
+                )
+                for session_id in archived
+            ], ordered=False)
+        else:
+            # Mark first, so readers restore from the archive while the hot copies are removed;
+            # anything written after the cutoff keeps its hot copy and wins on restore
+            await self.db.sessions.update_many(
+                {"id": {"$in": archived}, "updated_at": {"$lt": cutoff}}, {"$set": {"archived_at": now}}
+            )
+        marked = {s["id"] for s in await self.db.sessions.find(
+            {"id": {"$in": archived}, "archived_at": now}, {"_id": 0, "id": 1}
+        ).to_list(None)}
+        stale = [session_id for session_id in archived if session_id not in marked]
+        if stale:
+            await self.records.delete_many({"_id": {"$in": stale}})
+        moved = [session_id for session_id in archived if session_id in marked]
+        if not moved:
+            return
+        if not self.embedded:
+            # A restore racing with this delete stamps `restored_at` first, which keeps its copy
+            await asyncio.gather(*(
+                self.db[c].delete_many({
+                    "session_id": {"$in": moved},
+                    "updated_at": {"$not": {"$gte": cutoff}},
+                    "restored_at": {"$not": {"$gte": cutoff}},
+                })
+                for c in self.collections
+            ))
+        for record in records:
+            if record["_id"] in marked:
+                stats["sessions_archived"] += 1
+                stats["documents_moved"] += record["documents"]
+                stats["bytes_before"] += record["raw_bytes"]
+                stats["bytes_after"] += record["compressed_bytes"]
+
+    async def load(self, session_id: str) -> Optional[Dict[str, dict]]:
+        """Archived artifacts of a session by collection, without restoring them."""
+        record = await self.records.find_one({"_id": session_id}, {"data": 1})
+        if record is None:
+            return None
+        return bson.decode(zlib.decompress(record["data"]))["artifacts"]
+
+    async def restore(self, session_id: str) -> bool:
+        """Move an archived session's artifacts back into the hot collections."""
+        if session_id in self._restoring:
+            return await asyncio.shield(self._restoring[session_id])
+        future = asyncio.get_running_loop().create_future()
+        self._restoring[session_id] = future
+        try:
+            restored = await self._restore(session_id)
+            future.set_result(restored)
+            return restored
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._restoring.pop(session_id, None)
+
+    async def _restore(self, session_id: str) -> bool:
+        session = await self.db.sessions.find_one({"id": session_id}, {"_id": 0, "owner_id": 1, "member_ids": 1})
+        artifacts = await self.load(session_id)
+        if session is not None and artifacts is not None and self.embedded:
+            # Tools written since archiving are newer than the archived copies
+            await asyncio.gather(*(
+                self.db.sessions.update_one(
+                    {"id": session_id, tool_path(collection): {"$exists": False}},
+                    {"$set": {tool_path(collection): embed(doc)}}
+                )
+                for collection, doc in artifacts.items()
+            ))
+        elif session is not None and artifacts is not None:
+            # Membership may have changed while archived; the session row is authoritative.
+            # Documents that still have a hot copy (written after the cutoff) are left alone.
+            touched = {
+                "owner_id": session.get("owner_id"),
+                "member_ids": session.get("member_ids", []),
+                "restored_at": datetime.now(timezone.utc).isoformat(),
+            }
+            await asyncio.gather(*(
+                self.db[collection].update_one(
+                    {"session_id": session_id},
+                    {"$setOnInsert": {k: v for k, v in doc.items() if k not in touched}, "$set": touched},
+                    upsert=True
+                )
+                for collection, doc in artifacts.items()
+            ))
+        await self.db.sessions.update_one(
+            {"id": session_id},
+            {"$set": {"archived_at": None, "rehydrated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        await self.records.delete_one({"_id": session_id})
+        if artifacts is not None:
+            logger.info(f"Restored archived session {session_id} ({len(artifacts)} documents)")
+        return artifacts is not None
+
+    async def forget(self, session_ids: List[str]):
+        await self.records.delete_many({"_id": {"$in": session_ids}})
+
+    async def stats(self) -> dict:
+        totals = await self.records.aggregate([{"$group": {
+            "_id": None,
+            "sessions": {"$sum": 1},
+            "documents": {"$sum": "$documents"},
+            "raw_bytes": {"$sum": "$raw_bytes"},
+            "compressed_bytes": {"$sum": "$compressed_bytes"},
+        }}]).to_list(1)
+        result = totals[0] if totals else {"sessions": 0, "documents": 0, "raw_bytes": 0, "compressed_bytes": 0}
+        result.pop("_id", None)
+        return result
@@ -0,0 +1,249 @@
+import asyncio
+import contextvars
+import hashlib
+import io
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, List, Optional, Set, Tuple
+
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are skipped without Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Formats browsers render inline and Pillow can read; SVG is excluded since it can carry script
+IMAGE_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp")
+
+READ_CHUNK_BYTES = 256 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int]:
+    """First byte range of a `Range: bytes=...` header as inclusive (start, end).
+
+    Raises ValueError when the range cannot be satisfied for a file of `size` bytes.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes" or not ranges:
+        raise ValueError(header)
+    first, _, last = ranges.split(",")[0].strip().partition("-")
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length <= 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+def make_thumbnail(data: bytes, size: int) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        # Lets JPEG decode at a reduced scale instead of full resolution
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+        return out.getvalue()
+
+
+async def stream_range(stream, start: int, end: int) -> AsyncIterator[bytes]:
+    """Bytes start..end (inclusive) of an open GridFS download stream."""
+    stream.seek(start)
+    left = end + 1 - start
+    while left > 0:
+        chunk = await stream.read(min(READ_CHUNK_BYTES, left))
+        if not chunk:
+            break
+        left -= len(chunk)
+        yield chunk
+
+
+def utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class AttachmentStore:
+    """Image attachments of sessions, stored in GridFS once per distinct content.
+
+    Uploads stream into GridFS while their SHA-256 is computed; identical content then
+    shares one stored file (and thumbnail) through a reference-counted blob record, and
+    each upload gets its own attachment record pointing at it. Thumbnails are rendered by
+    a small thread pool after the upload returns.
+    """
+
+    def __init__(self, db, bucket, max_bytes: int, thumbnail_size: int = 320, workers: int = 2):
+        self.records = db.attachments
+        self.blobs = db.attachment_blobs
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails") if Image and workers else None
+        self._tasks: Set[asyncio.Task] = set()
+        if Image is None:
+            logger.warning("Pillow is not installed; attachment thumbnails are disabled")
+
+    async def ensure_indexes(self):
+        await asyncio.gather(
+            self.records.create_index("id", unique=True),
+            self.records.create_index([("session_id", 1), ("created_at", 1)]),
+        )
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    async def save(self, chunks: AsyncIterator[bytes], session_id: str, filename: str,
+                   content_type: str, user_id: str) -> dict:
+        digest = hashlib.sha256()
+        size = 0
+        upload = self.bucket.open_upload_stream(filename, metadata={"content_type": content_type})
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise AttachmentTooLarge()
+                digest.update(chunk)
+                await upload.write(chunk)
+        except BaseException:
+            await upload.abort()
+            raise
+        await upload.close()
+
+        blob = await self._claim(digest.hexdigest(), upload._id, size, content_type)
+        record = {
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "owner_id": user_id,
+            "filename": filename,
+            "content_type": blob["content_type"],
+            "size": size,
+            "sha256": blob["_id"],
+            "created_at": utcnow(),
+        }
+        await self.records.insert_one(record)
+        record.pop("_id", None)
+        record["has_thumbnail"] = blob.get("thumbnail_id") is not None
+        if not record["has_thumbnail"] and self._pool is not None:
+            # A fresh context, so the request's deadline and trace do not follow it
+            task = asyncio.create_task(self._thumbnail(blob), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return record
+
+    async def _claim(self, sha256: str, file_id, size: int, content_type: str) -> dict:
+        """Reference the stored copy of this content, keeping the new upload only if there is none."""
+        while True:
+            blob = await self.blobs.find_one_and_update(
+                {"_id": sha256}, {"$inc": {"refs": 1}}, return_document=ReturnDocument.AFTER
+            )
+            if blob is not None:
+                await self._delete_files(file_id)
+                return blob
+            blob = {"_id": sha256, "file_id": file_id, "size": size, "content_type": content_type,
+                    "thumbnail_id": None, "refs": 1, "created_at": utcnow()}
+            try:
+                await self.blobs.insert_one(blob)
+                return blob
+            except DuplicateKeyError:
+                continue  # the same content finished uploading concurrently
+
+    async def _thumbnail(self, blob: dict):
+        try:
+            stream = await self.bucket.open_download_stream(blob["file_id"])
+            data = await stream.read()
+            thumbnail = await asyncio.get_running_loop().run_in_executor(
+                self._pool, make_thumbnail, data, self.thumbnail_size
+            )
+            thumbnail_id = await self.bucket.upload_from_stream(
+                f"{blob['_id']}.thumbnail.jpg", thumbnail, metadata={"content_type": "image/jpeg"}
+            )
+            result = await self.blobs.update_one(
+                {"_id": blob["_id"], "thumbnail_id": None}, {"$set": {"thumbnail_id": thumbnail_id}}
+            )
+            if not result.matched_count:
+                await self._delete_files(thumbnail_id)
+        except Exception as e:
+            logger.warning(f"Thumbnail for attachment content {blob['_id']} failed: {e}")
+
+    async def get(self, attachment_id: str) -> Optional[dict]:
+        """The attachment record with its stored file ids."""
+        record = await self.records.find_one({"id": attachment_id}, {"_id": 0})
+        if record is None:
+            return None
+        blob = await self.blobs.find_one({"_id": record["sha256"]}) or {}
+        record["file_id"] = blob.get("file_id")
+        record["thumbnail_id"] = blob.get("thumbnail_id")
+        record["has_thumbnail"] = record["thumbnail_id"] is not None
+        return record
+
+    async def for_session(self, session_id: str) -> List[dict]:
+        records = await self.records.find({"session_id": session_id}, {"_id": 0}).sort("created_at", 1).to_list(None)
+        blobs = {b["_id"]: b for b in await self.blobs.find(
+            {"_id": {"$in": list({r["sha256"] for r in records})}}, {"thumbnail_id": 1}
+        ).to_list(None)}
+        for record in records:
+            record["has_thumbnail"] = blobs.get(record["sha256"], {}).get("thumbnail_id") is not None
+        return records
+
+    async def unknown(self, session_id: str, attachment_ids: Iterable[str]) -> List[str]:
+        """Those of `attachment_ids` that are not attachments of the session."""
+        attachment_ids = set(attachment_ids)
+        found = await self.records.distinct("id", {"session_id": session_id, "id": {"$in": list(attachment_ids)}})
+        return sorted(attachment_ids - set(found))
+
+    async def open(self, file_id):
+        return await self.bucket.open_download_stream(file_id)
+
+    async def delete(self, attachment_id: str) -> bool:
+        record = await self.records.find_one_and_delete({"id": attachment_id}, {"sha256": 1})
+        if record is None:
+            return False
+        await self._release(record["sha256"], 1)
+        return True
+
+    async def forget(self, session_ids: List[str]):
+        counts = await self.records.aggregate([
+            {"$match": {"session_id": {"$in": session_ids}}},
+            {"$group": {"_id": "$sha256", "count": {"$sum": 1}}},
+        ]).to_list(None)
+        await self.records.delete_many({"session_id": {"$in": session_ids}})
+        for row in counts:
+            await self._release(row["_id"], row["count"])
+
+    async def _release(self, sha256: str, count: int):
+        blob = await self.blobs.find_one_and_update(
+            {"_id": sha256}, {"$inc": {"refs": -count}}, return_document=ReturnDocument.AFTER
+        )
+        if blob is None or blob["refs"] > 0:
+            return
+        # Only the caller that removes the record deletes the files; a concurrent upload of the
+        # same content either re-referenced it first or stores its own copy afterwards
+        result = await self.blobs.delete_one({"_id": sha256, "refs": {"$lte": 0}})
+        if result.deleted_count:
+            await self._delete_files(blob["file_id"], blob.get("thumbnail_id"))
+
+    async def _delete_files(self, *file_ids):
+        for file_id in file_ids:
+            if file_id is None:
+                continue
+            try:
+                await self.bucket.delete(file_id)
+            except NoFile:
+                pass
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# "{{create_session.body.id}}" style references to the result of an earlier operation
+REFERENCE = re.compile(r"\{\{\s*([\w-]+)((?:\.[\w-]+)*)\s*\}\}")
+
+
+class BatchError(ValueError):
+    pass
+
+
+def references(value: Any) -> set:
+    if isinstance(value, str):
+        return {match.group(1) for match in REFERENCE.finditer(value)}
+    if isinstance(value, dict):
+        return set().union(*(references(v) for v in value.values())) if value else set()
+    if isinstance(value, list):
+        return set().union(*(references(v) for v in value)) if value else set()
+    return set()
+
+
+def lookup(results: Dict[str, dict], op_id: str, path: str) -> Any:
+    value: Any = results[op_id]
+    for key in filter(None, path.split(".")):
+        if isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        elif isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            raise BatchError(f"Reference {op_id}{path} not found")
+    return value
+
+
+def resolve(value: Any, results: Dict[str, dict]) -> Any:
+    if isinstance(value, str):
+        whole = REFERENCE.fullmatch(value)
+        if whole:
+            # A value that is only a reference keeps the referenced type
+            return lookup(results, whole.group(1), whole.group(2))
+        return REFERENCE.sub(lambda m: str(lookup(results, m.group(1), m.group(2))), value)
+    if isinstance(value, dict):
+        return {k: resolve(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, results) for v in value]
+    return value
+
+
+def targets_batch(path: str) -> bool:
+    """Whether an operation path calls the batch endpoint itself (extra or dot segments included)."""
+    path = path.split("?", 1)[0].split("#", 1)[0]
+    return [part for part in path.split("/") if part not in ("", ".")] == ["batch"]
+
+
+def plan(operations: List[dict]) -> Dict[str, List[str]]:
+    """Return the dependencies of each operation, rejecting unknown ids and cycles."""
+    ids = [op["id"] for op in operations]
+    if len(set(ids)) != len(ids):
+        raise BatchError("Operation ids must be unique")
+    deps = {
+        op["id"]: sorted(set(op.get("depends_on") or []) | references(op["path"]) | references(op.get("body")))
+        for op in operations
+    }
+    for op_id, needed in deps.items():
+        unknown = [d for d in needed if d not in deps]
+        if unknown:
+            raise BatchError(f"Operation {op_id} depends on unknown operations: {', '.join(unknown)}")
+
+    visiting, done = set(), set()
+
+    def visit(op_id: str):
+        if op_id in done:
+            return
+        if op_id in visiting:
+            raise BatchError(f"Dependency cycle through operation {op_id}")
+        visiting.add(op_id)
+        for dep in deps[op_id]:
+            visit(dep)
+        visiting.discard(op_id)
+        done.add(op_id)
+
+    for op_id in deps:
+        visit(op_id)
+    return deps
+
+
+async def call_app(app, base_scope: dict, method: str, path: str, body: Any, state: dict) -> dict:
+    """Run one request through the ASGI app in-process and capture its response."""
+    url = urlsplit(path)
+    payload = b"" if body is None else json.dumps(body).encode()
+    headers = [(k, v) for k, v in base_scope["headers"] if k in (b"authorization", b"user-agent", b"x-request-id")]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    scope = {
+        **base_scope,
+        "method": method,
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        "state": state,
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    response = {"status": 500, "headers": [], "body": b""}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(scope, receive, send)
+
+    content_type = dict(response["headers"]).get(b"content-type", b"")
+    result_body: Optional[Any] = response["body"].decode() or None
+    if content_type.startswith(b"application/json") and response["body"]:
+        result_body = json.loads(response["body"])
+    return {"status": response["status"], "body": result_body}
+
+
+async def run_batch(app, base_scope: dict, prefix: str, operations: List[dict], state: dict) -> List[dict]:
+    deps = plan(operations)
+    results: Dict[str, dict] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(op: dict) -> dict:
+        for dep in deps[op["id"]]:
+            await tasks[dep]
+        failed = [dep for dep in deps[op["id"]] if results[dep]["status"] >= 400]
+        if failed:
+            result = {"status": 424, "body": {"detail": f"Dependency failed: {', '.join(failed)}"}}
+        else:
+            try:
+                path = resolve(op["path"], results)
+                body = resolve(op.get("body"), results)
+                # Checked again once resolved: a reference can spell out the path
+                if targets_batch(path):
+                    raise BatchError("Batches cannot be nested")
+            except BatchError as e:
+                result = {"status": 400, "body": {"detail": str(e)}}
+            except Exception:
+                logger.exception(f"Batch operation {op['id']} could not be resolved")
+                result = {"status": 500, "body": {"detail": "Internal Server Error"}}
+            else:
+                try:
+                    result = await call_app(app, base_scope, op["method"], prefix + path, body, state)
+                except Exception:
+                    # One failing operation must not take down the results of the others
+                    logger.exception(f"Batch operation {op['id']} failed")
+                    result = {"status": 500, "body": {"detail": "Internal Server Error"}}
+        results[op["id"]] = result
+        return {"id": op["id"], **result}
+
+    # Independent operations start immediately; dependent ones wait on the tasks they reference
+    for op in operations:
+        tasks[op["id"]] = asyncio.ensure_future(run(op))
+    return list(await asyncio.gather(*tasks.values()))
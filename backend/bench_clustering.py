@@ -0,0 +1,67 @@
+"""Measures similar-card clustering on synthetic boards: first call, cached call and after edits.
+
+    python bench_clustering.py --cards 1000 --cards 3000 --cards 5000 --runs 5
+
+Runs in-process without MongoDB, timing the same CardClusters the clusters endpoints use.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+from clustering import CardClusters
+
+TOPICS = [
+    "faster checkout payment", "dark mode theme night", "offline sync mobile app", "export board pdf report",
+    "login password reset email", "invite teammate share link", "search filter tag", "notification reminder calendar",
+]
+WORDS = "customer onboarding sticky colour vote comment template workshop timer facilitator print zoom".split()
+
+
+def card_text() -> str:
+    words = random.sample(random.choice(TOPICS).split(), 2) + random.sample(WORDS, 3)
+    random.shuffle(words)
+    return " ".join(words)
+
+
+def timed(call) -> float:
+    started = time.perf_counter()
+    call()
+    return (time.perf_counter() - started) * 1000
+
+
+def bench(count: int, args):
+    cold, warm, edited = [], [], []
+    for run in range(args.runs):
+        clusters = CardClusters()
+        items = [{"id": str(uuid.uuid4()), "text": card_text()} for _ in range(count)]
+
+        def call():
+            return clusters.cluster("ideas_boards", "bench", items, args.threshold)
+
+        cold.append(timed(call))
+        warm.append(timed(call))
+        # A round of edits between two autosaves: a few cards rewritten, added and removed
+        for i in random.sample(range(count), 5):
+            items[i] = {**items[i], "text": card_text()}
+        items[:5] = [{"id": str(uuid.uuid4()), "text": card_text()} for _ in range(5)]
+        edited.append(timed(call))
+    found, alone = clusters.cluster("ideas_boards", "bench", items, args.threshold)
+    print(f"{count} cards: {len(found)} clusters, {len(alone)} unclustered")
+    for label, samples in (("first call", cold), ("unchanged board", warm), ("after 10 edits", edited)):
+        print(f"  {label:<16} median {statistics.median(samples):7.1f}ms  max {max(samples):7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, action="append")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=0.35)
+    args = parser.parse_args()
+    for count in args.cards or [1000, 3000, 5000]:
+        bench(count, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Compares the "separate" and "embedded" storage layouts: read/write latency and document sizes.
+
+    python bench_layout.py --sessions 200 --items 50 --runs 200
+
+Needs the same environment as the server (MONGO_URL, DB_NAME). Each layout is seeded into
+its own scratch database (DB_NAME suffixed with _bench_<layout>), which is dropped afterwards.
+The measurements go through the same helpers the API routes use. "embedded" stays in
+layouts.EXPERIMENTAL_LAYOUTS until this has been run against a production-like deployment.
+
+To reproduce the numbers behind a change of default layout, run it against a MongoDB of the
+production version and topology (a replica set, not a standalone), from a host with the
+production network latency to it, with the default arguments plus --items 200 for large
+workshops. Compare the medians and p95s per operation across at least three runs, and record
+the MongoDB version, topology and results with the change.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import server
+from archive import SessionArchive
+from layouts import LAYOUTS, MAX_DOCUMENT_BYTES
+
+TOOL = "ideas_boards"
+
+
+def tool_contents(items: int) -> dict:
+    def item(**fields):
+        return {"id": str(uuid.uuid4()), "text": "x" * 60, **fields}
+
+    contents = {
+        "problem_trees": {"core_problem": "Core problem", "items": [item(type="cause", parent_id=None) for _ in range(items)]},
+        "empathy_maps": {"persona_name": "User", **{k: ["y" * 40] * (items // 4) for k in ("says", "thinks", "does", "feels")}},
+        "story_maps": {"title": "User Journey", "items": [item(type="story", column=i % 8, row=i // 8) for i in range(items)]},
+        "ideas_boards": {"ideas": [item(category="idea", votes=i % 5) for i in range(items)]},
+        "feedback": {"items": [item(type="like") for _ in range(items)]},
+        "expectations": {"items": [item(type="goal", priority=1) for _ in range(items)]},
+    }
+    # Validated as bulk workshop seeds, so the benchmark stores what the API would accept
+    seeds = server.WorkshopCreate(project_id="bench", **contents)
+    return {collection: getattr(seeds, collection).model_dump() for collection in contents}
+
+
+async def timed(samples: list, call):
+    started = time.perf_counter()
+    await call
+    samples.append(time.perf_counter() - started)
+
+
+def summarize(label: str, samples):
+    ms = sorted(s * 1000 for s in samples)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"  {label:<28} median {statistics.median(ms):7.2f}ms  p95 {p95:7.2f}ms  max {ms[-1]:7.2f}ms")
+
+
+async def largest_document(db, session_id: str) -> int:
+    docs = await asyncio.gather(
+        db.sessions.find_one({"id": session_id}),
+        *(db[c].find_one({"session_id": session_id}) for c in server.ARTIFACT_COLLECTIONS)
+    )
+    return max(len(bson.encode(doc)) for doc in docs if doc)
+
+
+async def bench_layout(base: server.Settings, layout: str, args):
+    settings = base.model_copy(update={"storage_layout": layout, "db_name": f"{base.db_name}_bench_{layout}"})
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.db_name]
+    # The helpers read these module globals, which the app lifespan normally sets
+    server.settings, server.db, server.coalescer, server.change_log = settings, db, None, None
+    server.session_archive = SessionArchive(db, server.ARTIFACT_COLLECTIONS, embedded=layout == "embedded")
+    user = {"id": str(uuid.uuid4())}
+    try:
+        await client.drop_database(settings.db_name)
+        await server.ensure_indexes(db)
+        source = {"description": "Benchmark session"}
+        sessions = []
+        for start in range(0, args.sessions, 100):
+            names = [f"Session {i}" for i in range(start, min(start + 100, args.sessions))]
+            sessions += await server.create_sessions_from(source, tool_contents(args.items), "bench", names, user)
+        ids = [s["id"] for s in sessions]
+
+        print(f"{layout} ({args.sessions} sessions, {args.items} items per tool)")
+        reads, tool_reads, writes, all_writes, listings = [], [], [], [], []
+        ideas = tool_contents(args.items)[TOOL]["ideas"]
+        for _ in range(args.runs):
+            session_id = random.choice(ids)
+            await timed(reads, server.load_session_artifacts(session_id, user))
+            await timed(tool_reads, server.load_artifact(TOOL, random.choice(ids), user))
+            await timed(writes, server.save_artifact(TOOL, random.choice(ids), {"ideas": ideas}, user))
+            # Autosaves from several tools of one session at once contend for the same document when embedded
+            await timed(all_writes, asyncio.gather(*(
+                server.save_artifact(c, session_id, {}, user) for c in server.ARTIFACT_COLLECTIONS
+            )))
+            await timed(listings, db.sessions.find({"member_ids": user["id"]}, server.SESSION_PROJECTION).to_list(100))
+        summarize("read whole session", reads)
+        summarize(f"read one tool ({TOOL})", tool_reads)
+        summarize(f"save one tool ({TOOL})", writes)
+        summarize("save all six tools at once", all_writes)
+        summarize("list 100 sessions", listings)
+
+        largest = await largest_document(db, ids[0])
+        print(f"  largest document per session: {largest} bytes ({100 * largest / MAX_DOCUMENT_BYTES:.3f}% of the 16MB limit)")
+    finally:
+        await client.drop_database(settings.db_name)
+        client.close()
+
+
+def capacity(items: int):
+    # Bytes each tool item adds to an embedded session, from two encodings of the same session
+    empty = len(bson.encode({"tools": tool_contents(0)}))
+    full = len(bson.encode({"tools": tool_contents(items)}))
+    per_item = (full - empty) / (items * len(server.ARTIFACT_COLLECTIONS))
+    limit = int((MAX_DOCUMENT_BYTES - empty) / per_item)
+    print(f"embedded capacity: ~{per_item:.0f} bytes per item, so one session holds at most ~{limit} items "
+          f"across its six tools (~{limit // len(server.ARTIFACT_COLLECTIONS)} per tool) before hitting 16MB; "
+          f"the separate layout allows that much per tool")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--layout", choices=LAYOUTS, action="append", help="Only benchmark this layout")
+    args = parser.parse_args()
+
+    base = server.Settings.from_env()
+    for layout in args.layout or LAYOUTS:
+        await bench_layout(base, layout, args)
+    capacity(args.items)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
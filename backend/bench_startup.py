@@ -0,0 +1,75 @@
+"""Measures API cold start: module import time and time-to-first-request.
+
+    python bench_startup.py --runs 5
+
+Needs the same environment as the server (MONGO_URL, DB_NAME).
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import server; print(time.perf_counter() - t)"
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:create_app", "--factory", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=os.environ.copy(),
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/api/health"
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Server exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError(f"Server did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summarize(label: str, samples):
+    ms = [s * 1000 for s in samples]
+    print(f"{label:<24} median {statistics.median(ms):8.1f}ms  min {min(ms):8.1f}ms  max {max(ms):8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    summarize("import server", [measure_import() for _ in range(args.runs)])
+    summarize("time to first request", [measure_first_request(args.timeout) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
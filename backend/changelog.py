@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+def is_item_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, dict) and "id" in item for item in value)
+
+
+def diff_artifact(before: Optional[dict], after: dict, ignore: Iterable[str] = ()) -> List[dict]:
+    """Item-level changes that turn `before` into `after`.
+
+    Lists of items with ids produce per-item "upsert"/"remove" ops (plus an "order" op when
+    surviving items moved); every other field produces a "set" op when its value changed.
+    """
+    before = before or {}
+    ignored = set(ignore)
+    changes = []
+    for field in sorted(set(before) | set(after)):
+        if field in ignored:
+            continue
+        old, new = before.get(field), after.get(field)
+        if old == new:
+            continue
+        if is_item_list(new) and (old is None or is_item_list(old)):
+            old_items = {item["id"]: item for item in old or []}
+            new_ids = [item["id"] for item in new]
+            for index, item in enumerate(new):
+                if old_items.get(item["id"]) != item:
+                    changes.append({"op": "upsert", "field": field, "index": index, "item": item})
+            kept = set(new_ids)
+            for item_id in old_items:
+                if item_id not in kept:
+                    changes.append({"op": "remove", "field": field, "id": item_id})
+            surviving = [item_id for item_id in old_items if item_id in kept]
+            if surviving != [item_id for item_id in new_ids if item_id in old_items]:
+                changes.append({"op": "order", "field": field, "ids": new_ids})
+        else:
+            changes.append({"op": "set", "field": field, "value": new})
+    return changes
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ChangeLog:
+    """Per-session sequence of artifact changes for clients that sync deltas.
+
+    Every recorded change gets the session's next sequence number. Entries older than the
+    retention window, or beyond the newest `max_entries` of a session, are compacted away:
+    the live artifacts are the snapshot they fold into, and clients whose cursor predates
+    the compaction point are told to reload that snapshot.
+    """
+
+    def __init__(self, db, retention_seconds: int, max_entries: int, compact_interval: float = 300.0,
+                 gap_grace_seconds: float = 10.0, poll_interval: float = 1.0):
+        self.entries = db.session_changes
+        self.counters = db.session_change_counters
+        self.retention = retention_seconds
+        self.max_entries = max_entries
+        self.compact_interval = compact_interval
+        self.gap_grace = gap_grace_seconds
+        self.poll_interval = poll_interval
+        self._events: "weakref.WeakValueDictionary[str, asyncio.Event]" = weakref.WeakValueDictionary()
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        await asyncio.gather(
+            self.entries.create_index([("session_id", 1), ("seq", 1)], unique=True),
+            self.entries.create_index("created_at"),
+            self.counters.create_index("session_id"),
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._compact_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def record(self, session_id: str, collection: str, artifact_id: Optional[str],
+                     revision: Optional[int], changes: List[dict], user_id: str) -> Optional[int]:
+        if not changes:
+            return None
+        counter = await self.counters.find_one_and_update(
+            {"_id": session_id},
+            # ISO string like the session's own updated_at, so the two compare as last activity;
+            # session_id repeats the _id in a field the storage encoding can store compactly
+            {"$inc": {"seq": 1}, "$set": {"updated_at": utcnow().isoformat(), "session_id": session_id}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        entry = {
+            "session_id": session_id,
+            "seq": counter["seq"],
+            "collection": collection,
+            "artifact_id": artifact_id,
+            "revision": revision,
+            "user_id": user_id,
+            "changes": changes,
+            "created_at": utcnow(),
+        }
+        await self.entries.insert_one(entry)
+        # Wake long-polls waiting in this worker; other workers notice on their next poll
+        event = self._events.pop(session_id, None)
+        if event is not None:
+            event.set()
+        return entry["seq"]
+
+    async def since(self, session_id: str, since: int, limit: int, wait: float = 0.0) -> dict:
+        """Changes after `since`, waiting up to `wait` seconds for the first one to arrive."""
+        deadline = time.monotonic() + wait
+        while True:
+            result = await self._read(session_id, since, limit)
+            remaining = deadline - time.monotonic()
+            if result["changes"] or result["reset"] or remaining <= 0:
+                return result
+            event = self._events.get(session_id)
+            if event is None:
+                event = self._events[session_id] = asyncio.Event()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(self.poll_interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _read(self, session_id: str, since: int, limit: int) -> dict:
+        counter = await self.counters.find_one({"_id": session_id}) or {}
+        latest = counter.get("seq", 0)
+        if since < counter.get("compacted_seq", 0) or since > latest:
+            return {"seq": latest, "reset": True, "more": False, "changes": []}
+        entries = await self.entries.find(
+            {"session_id": session_id, "seq": {"$gt": since}}, {"_id": 0, "session_id": 0}
+        ).sort("seq", 1).limit(limit).to_list(limit)
+        changes = []
+        for entry in entries:
+            if entry["seq"] != since + len(changes) + 1:
+                # An earlier sequence number is still being written; give up on it once it
+                # is clearly lost, since the client would otherwise miss that change
+                if (utcnow() - entry["created_at"].replace(tzinfo=timezone.utc)).total_seconds() > self.gap_grace:
+                    return {"seq": latest, "reset": True, "more": False, "changes": []}
+                break
+            entry["created_at"] = entry["created_at"].replace(tzinfo=timezone.utc).isoformat()
+            changes.append(entry)
+        return {
+            "seq": changes[-1]["seq"] if changes else since,
+            "reset": False,
+            "more": len(changes) == limit,
+            "changes": changes,
+        }
+
+    async def compact(self) -> int:
+        cutoff = utcnow() - timedelta(seconds=self.retention)
+        compacted = 0
+        sessions = self.entries.aggregate([
+            {"$group": {"_id": "$session_id", "count": {"$sum": 1}, "max_seq": {"$max": "$seq"},
+                        "oldest": {"$min": "$created_at"}}},
+            {"$match": {"$or": [{"count": {"$gt": self.max_entries}}, {"oldest": {"$lt": cutoff}}]}},
+        ])
+        async for row in sessions:
+            expired = await self.entries.find_one(
+                {"session_id": row["_id"], "created_at": {"$lt": cutoff}}, {"seq": 1}, sort=[("seq", -1)]
+            )
+            upto = max(expired["seq"] if expired else 0, row["max_seq"] - self.max_entries)
+            # Move the compaction point first so readers never see a silent gap
+            await self.counters.update_one({"_id": row["_id"]}, {"$max": {"compacted_seq": upto}})
+            result = await self.entries.delete_many({"session_id": row["_id"], "seq": {"$lte": upto}})
+            compacted += result.deleted_count
+        return compacted
+
+    async def forget(self, session_ids: List[str]):
+        await asyncio.gather(
+            self.entries.delete_many({"session_id": {"$in": session_ids}}),
+            self.counters.delete_many({"_id": {"$in": session_ids}}),
+        )
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                compacted = await self.compact()
+                if compacted:
+                    logger.info(f"Compacted {compacted} change log entries")
+            except Exception as e:
+                logger.warning(f"Change log compaction failed: {e}")
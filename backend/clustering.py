@@ -0,0 +1,198 @@
+import math
+import re
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Terms are hashed into a fixed number of columns, so a board never needs a vocabulary and a
+# card's vector does not change when other cards do; signed hashing keeps collisions unbiased
+DIMENSIONS = 1024
+# Rows of the similarity matrix computed per matrix product, bounding the float scratch space
+BLOCK_ROWS = 1024
+LABEL_TERMS = 3
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOP_WORDS = frozenset("""
+    a about after all also am an and any are as at be because been but by can could did do does
+    for from get got had has have he her him his how i if in into is it its just let like me more
+    most my no not of on or our out over she so some than that the their them then there these
+    they this to too up us very was we were what when where which while who why will wish with
+    would you your
+""".split())
+
+
+def stem(word: str) -> str:
+    # Plural folding only; enough for short card texts without a stemming dependency
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    """Words and adjacent word pairs of a card, lower-cased, without stop words."""
+    words = [stem(w) for w in TOKEN.findall(text.lower()) if w not in STOP_WORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def term_vector(card_terms: List[str]) -> np.ndarray:
+    row = np.zeros(DIMENSIONS, dtype=np.float32)
+    for term, count in Counter(card_terms).items():
+        h = zlib.crc32(term.encode())
+        row[h % DIMENSIONS] += (1 + math.log(count)) * (-1 if h >> 31 else 1)
+    return row
+
+
+class BoardVectors:
+    """Term vectors of one board's cards, recomputed only for cards whose text changed."""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.texts: List[str] = []
+        self.terms: List[List[str]] = []
+        self.matrix = np.zeros((0, DIMENSIONS), dtype=np.float32)
+        # Number of cards each term appears in, for labels
+        self.df: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def update(self, items: Iterable[dict]):
+        current = {item["id"]: item.get("text") or "" for item in items if item.get("id")}
+        removed = [i for i, card_id in enumerate(self.ids) if card_id not in current]
+        if removed:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[removed] = False
+            for i in removed:
+                self.df.subtract(set(self.terms[i]))
+            self.matrix = self.matrix[keep]
+            self.ids = [card_id for card_id, k in zip(self.ids, keep) if k]
+            self.texts = [text for text, k in zip(self.texts, keep) if k]
+            self.terms = [card_terms for card_terms, k in zip(self.terms, keep) if k]
+            self.index = {card_id: i for i, card_id in enumerate(self.ids)}
+
+        added = []
+        for card_id, text in current.items():
+            i = self.index.get(card_id)
+            if i is None:
+                added.append((card_id, text, terms(text)))
+            elif self.texts[i] != text:
+                self.df.subtract(set(self.terms[i]))
+                self.texts[i], self.terms[i] = text, terms(text)
+                self.df.update(set(self.terms[i]))
+                self.matrix[i] = term_vector(self.terms[i])
+        if added:
+            for card_id, text, card_terms in added:
+                self.index[card_id] = len(self.ids)
+                self.ids.append(card_id)
+                self.texts.append(text)
+                self.terms.append(card_terms)
+                self.df.update(set(card_terms))
+            self.matrix = np.vstack([self.matrix, np.stack([term_vector(t) for _, _, t in added])])
+        self.df += Counter()  # drops terms no card has any more
+
+    def label(self, rows: np.ndarray) -> List[str]:
+        """The terms that best set these cards apart from the rest of the board."""
+        counts = Counter(term for i in rows for term in set(self.terms[i]))
+        n = len(self.ids)
+        # On a tie, a word pair reads better than its words on their own
+        scored = sorted(
+            ((count * math.log((1 + n) / (1 + self.df[term])), " " in term, term) for term, count in counts.items()
+             if count > 1 or len(rows) == 1),
+            reverse=True,
+        )
+        chosen: List[str] = []
+        for _, _, term in scored:
+            # Skip a word already shown as part of a chosen pair, and the other way round
+            if any(term in c.split() or c in term.split() for c in chosen):
+                continue
+            chosen.append(term)
+            if len(chosen) == LABEL_TERMS:
+                break
+        return chosen
+
+
+def neighbours(matrix: np.ndarray, threshold: float) -> np.ndarray:
+    """Boolean matrix of card pairs whose TF-IDF cosine similarity reaches the threshold."""
+    n = len(matrix)
+    idf = np.log((1 + n) / (1 + np.count_nonzero(matrix, axis=0))).astype(np.float32) + 1
+    vectors = matrix * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    close = np.empty((n, n), dtype=bool)
+    # Similarity is symmetric: compute each block row from the diagonal on, and mirror it
+    for start in range(0, n, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, n)
+        np.greater_equal(vectors[start:stop] @ vectors[start:].T, threshold, out=close[start:stop, start:])
+        close[stop:, start:stop] = close[start:stop, stop:].T
+    np.fill_diagonal(close, True)
+    return close
+
+
+def leader_clusters(close: np.ndarray, min_size: int = 2) -> List[Tuple[int, np.ndarray]]:
+    """Greedy clustering: the best connected card left leads a cluster of its unclustered neighbours.
+
+    With `min_size` 1 every card ends up in a cluster, cards with no close neighbour on their own.
+    """
+    degree = close.sum(axis=1)
+    free = np.ones(len(close), dtype=bool)
+    clusters = []
+    for leader in np.argsort(-degree, kind="stable"):
+        if degree[leader] < min_size:
+            break  # no remaining card can lead a cluster that large
+        if not free[leader]:
+            continue
+        members = np.flatnonzero(close[leader] & free)
+        free[members] = False
+        clusters.append((int(leader), members))
+    return clusters
+
+
+class CardClusters:
+    """Similar-card clustering for ideas boards and feedback, with term vectors cached per board."""
+
+    def __init__(self, max_boards: int = 256):
+        self.max_boards = max_boards
+        self._boards: "OrderedDict[Tuple[str, str], BoardVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def board(self, collection: str, session_id: str) -> BoardVectors:
+        key = (collection, session_id)
+        with self._lock:
+            board = self._boards.pop(key, None) or BoardVectors()
+            self._boards[key] = board
+            while len(self._boards) > self.max_boards:
+                self._boards.popitem(last=False)
+            return board
+
+    def cluster(self, collection: str, session_id: str, items: List[dict], threshold: float,
+                min_size: int = 2, only: Optional[List[str]] = None) -> Tuple[List[dict], List[str]]:
+        """Clusters of the board's cards (or just the `only` ids) and the ids left unclustered.
+
+        CPU bound; callers on the event loop should run it in a thread.
+        """
+        board = self.board(collection, session_id)
+        with board.lock:
+            board.update(items)
+            rows = np.arange(len(board.ids)) if only is None else np.array(
+                [board.index[i] for i in dict.fromkeys(only) if i in board.index], dtype=np.intp
+            )
+            if not len(rows):
+                return [], []
+            clusters, unclustered = [], np.ones(len(rows), dtype=bool)
+            for leader, members in leader_clusters(neighbours(board.matrix[rows], threshold), min_size):
+                if len(members) < min_size:
+                    continue
+                unclustered[members] = False
+                label_terms = board.label(rows[members])
+                clusters.append({
+                    "label": ", ".join(label_terms) or board.texts[rows[leader]],
+                    "terms": label_terms,
+                    "representative_id": board.ids[rows[leader]],
+                    "item_ids": [board.ids[i] for i in rows[members]],
+                    "size": len(members),
+                })
+            return clusters, [board.ids[i] for i in rows[unclustered]]
@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+import pymongo
+from pymongo.errors import PyMongoError, WaitQueueTimeoutError
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# Absolute (monotonic) deadline of the request being handled; nested in-process requests inherit it
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None outside a request."""
+    deadline = _deadline.get()
+    return None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+
+def parse_route_timeouts(value: str) -> Dict[Tuple[str, str], float]:
+    """Parse "GET /api/jobs/{job_id}/result=300000,POST /api/batch=20000" into milliseconds per route."""
+    timeouts = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        route, _, ms = entry.rpartition("=")
+        method, _, path = route.strip().partition(" ")
+        timeouts[(method.upper(), path.strip())] = float(ms)
+    return timeouts
+
+
+class LoadMonitor:
+    """In-flight request count, event loop lag and the counters behind load shedding."""
+
+    def __init__(self, max_in_flight: int = 0, max_loop_lag_ms: float = 0.0, sample_interval: float = 0.1):
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag_ms = max_loop_lag_ms
+        self.sample_interval = sample_interval
+        self.in_flight = 0
+        self.loop_lag_ms = 0.0
+        self.counters: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.max_loop_lag_ms > 0 and self._task is None:
+            self._task = asyncio.create_task(self._measure_lag())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def shed_reason(self) -> Optional[str]:
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return "in_flight"
+        if self.max_loop_lag_ms and self.loop_lag_ms > self.max_loop_lag_ms:
+            return "loop_lag"
+        return None
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "loop_lag_ms": round(self.loop_lag_ms, 3),
+            "max_loop_lag_ms": self.max_loop_lag_ms,
+            "counters": dict(self.counters),
+        }
+
+    async def _measure_lag(self):
+        # How late a short sleep wakes up is how long ready callbacks are queueing on the loop
+        while True:
+            expected = time.monotonic() + self.sample_interval
+            await asyncio.sleep(self.sample_interval)
+            lag = max(time.monotonic() - expected, 0.0) * 1000
+            # Smoothed, so one slow callback does not shed load but a sustained backlog does
+            self.loop_lag_ms = self.loop_lag_ms * 0.8 + lag * 0.2
+
+
+class DeadlineMiddleware:
+    """Bounds each request by its route's deadline.
+
+    The deadline is applied through `pymongo.timeout`, so every Mongo call made for the request
+    carries the remaining time as maxTimeMS; the handler is cancelled when the deadline passes or
+    the client disconnects, and requests are rejected with 503 while the worker is overloaded.
+    """
+
+    def __init__(self, app, monitor: LoadMonitor, default_ms: float, routes: Iterable = (),
+                 route_timeouts: Optional[Dict[Tuple[str, str], float]] = None):
+        self.app = app
+        self.monitor = monitor
+        self.default = default_ms / 1000
+        self.overrides = [
+            (route, method, ms / 1000)
+            for (method, path), ms in (route_timeouts or {}).items()
+            for route in routes if getattr(route, "path", None) == path
+        ]
+
+    def timeout_for(self, scope) -> float:
+        for route, method, timeout in self.overrides:
+            if scope["method"] == method and route.matches(scope)[0] == Match.FULL:
+                return timeout
+        return self.default
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _deadline.get() is not None:
+            return await self.app(scope, receive, send)
+        monitor = self.monitor
+        reason = monitor.shed_reason()
+        if reason:
+            monitor.counters[f"shed_{reason}"] += 1
+            return await self._error(send, 503, "Server is overloaded, please retry", retry_after=True)
+
+        timeout = self.timeout_for(scope)
+        response_started = False
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        # Read the client's messages ourselves so a disconnect is noticed while the handler runs
+        messages: asyncio.Queue = asyncio.Queue(maxsize=1)
+        disconnected = asyncio.Event()
+
+        async def pump():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    await messages.put(message)
+                    return
+                await messages.put(message)
+
+        monitor.in_flight += 1
+        token = _deadline.set(time.monotonic() + timeout)
+        try:
+            with pymongo.timeout(timeout):
+                handler = asyncio.ensure_future(self.app(scope, messages.get, tracking_send))
+            reader = asyncio.ensure_future(pump())
+            watcher = asyncio.ensure_future(disconnected.wait())
+            try:
+                done, _ = await asyncio.wait({handler, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                reader.cancel()
+                watcher.cancel()
+            if handler not in done:
+                handler.cancel()
+                await asyncio.gather(handler, return_exceptions=True)
+                if disconnected.is_set():
+                    monitor.counters["cancelled_disconnect"] += 1
+                    return
+                monitor.counters["deadline_exceeded"] += 1
+                logger.warning(json.dumps({
+                    "event": "deadline_exceeded", "method": scope["method"], "path": scope["path"],
+                    "timeout_ms": timeout * 1000
+                }))
+                if not response_started:
+                    await self._error(send, 504, "Request deadline exceeded")
+                return
+            try:
+                handler.result()
+            except PyMongoError as e:
+                if response_started or not e.timeout:
+                    raise
+                if isinstance(e, WaitQueueTimeoutError):
+                    # Every pooled connection stayed busy: the database is the bottleneck
+                    monitor.counters["shed_mongo_pool"] += 1
+                    await self._error(send, 503, "Database is overloaded, please retry", retry_after=True)
+                else:
+                    monitor.counters["mongo_timeout"] += 1
+                    await self._error(send, 504, "Database deadline exceeded")
+        finally:
+            _deadline.reset(token)
+            monitor.in_flight -= 1
+
+    async def _error(self, send, status: int, detail: str, retry_after: bool = False):
+        body = json.dumps({"detail": detail}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if retry_after:
+            headers.append((b"retry-after", b"1"))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,347 @@
+import copy
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from bson.binary import UUID_SUBTYPE, Binary, UuidRepresentation
+from bson.codec_options import CodecOptions
+
+from layouts import EMBEDDED_FIELD
+
+# "strings": ids and timestamps are stored as the API returns them (uuid4 strings, ISO strings).
+# "compact": uuid4 ids are stored as BSON binary (16 bytes instead of 37) and timestamps as
+# BSON dates (8 bytes instead of 33). "dual" writes compactly but also matches documents still
+# stored as strings, so the API can serve while migrations/compact_encoding.py converts them.
+ENCODINGS = ("strings", "dual", "compact")
+
+# Top-level fields (and fields of embedded artifacts) holding uuid4 strings or lists of them
+ID_FIELDS = frozenset({"id", "session_id", "project_id", "owner_id", "member_ids", "user_id"})
+DATE_FIELDS = frozenset({"created_at", "updated_at", "archived_at", "restored_at", "rehydrated_at"})
+
+# Binary values are created explicitly, so any collection can store them; reading them back as
+# uuid.UUID (and dates as aware datetimes) needs these options
+CODEC_OPTIONS = CodecOptions(tz_aware=True, tzinfo=timezone.utc, uuid_representation=UuidRepresentation.STANDARD)
+
+# Operators whose operand is a list of values
+LIST_OPERATORS = frozenset({"$in", "$nin", "$all"})
+RANGE_OPERATORS = frozenset({"$lt", "$lte", "$gt", "$gte"})
+# Update operators whose values are stored as given
+VALUE_UPDATES = frozenset({"$set", "$setOnInsert", "$min", "$max"})
+ARRAY_UPDATES = frozenset({"$addToSet", "$push", "$pull", "$pullAll"})
+
+
+def encode_id(value):
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            parsed = uuid.UUID(value)
+        except ValueError:
+            return value
+        # Only canonical strings, so decoding gives back exactly what was stored
+        if str(parsed) == value:
+            return Binary.from_uuid(parsed)
+    return value
+
+
+def encode_date(value):
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        if parsed.utcoffset() is not None and not parsed.utcoffset():
+            # BSON dates keep milliseconds
+            return parsed.replace(microsecond=parsed.microsecond // 1000 * 1000)
+    return value
+
+
+def encode_field(field: str, value):
+    if field in ID_FIELDS:
+        return [encode_id(v) for v in value] if isinstance(value, list) else encode_id(value)
+    if field in DATE_FIELDS:
+        return encode_date(value)
+    if field == EMBEDDED_FIELD and isinstance(value, dict):
+        return {collection: encode_document(doc) for collection, doc in value.items()}
+    return value
+
+
+def encode_path(path: str, value):
+    """`value` as stored at a (dotted) path of a document."""
+    parts = path.split(".")
+    if len(parts) == 1:
+        return encode_field(path, value)
+    if parts[0] == EMBEDDED_FIELD:
+        if len(parts) == 2:
+            return encode_document(value)
+        if len(parts) == 3:
+            return encode_field(parts[2], value)
+    return value
+
+
+def encode_document(doc):
+    if not isinstance(doc, dict):
+        return doc
+    return {key: encode_path(key, value) for key, value in doc.items()}
+
+
+def decode(value):
+    """A stored value with its ids and timestamps turned back into the API's strings."""
+    kind = type(value)
+    if kind is dict:
+        return {key: decode(v) for key, v in value.items()}
+    if kind is list:
+        return [decode(v) for v in value]
+    if kind is uuid.UUID:
+        return str(value)
+    if kind is Binary and value.subtype == UUID_SUBTYPE:
+        return str(value.as_uuid())
+    if kind is datetime:
+        return value.isoformat()
+    return value
+
+
+def encode_condition(path: str, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        encoded = {}
+        for op, operand in condition.items():
+            if op in LIST_OPERATORS:
+                encoded[op] = [encode_path(path, v) for v in operand]
+            elif op == "$not":
+                encoded[op] = encode_condition(path, operand)
+            elif op in ("$exists", "$type", "$size", "$elemMatch", "$regex", "$options"):
+                encoded[op] = operand
+            else:
+                encoded[op] = encode_path(path, operand)
+        return encoded
+    return encode_path(path, condition)
+
+
+def either_condition(path: str, condition, encoded) -> List[dict]:
+    """Clauses matching the condition against both encodings of a field (for "dual")."""
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return [{path: {"$in": [encoded, condition]}}]
+    merged, ranges, clauses = {}, set(), []
+    for op, operand in condition.items():
+        if op == "$eq":
+            merged["$in"] = [encoded[op], operand]
+        elif op == "$ne":
+            merged["$nin"] = [encoded[op], operand]
+        elif op in LIST_OPERATORS and op != "$all":
+            merged[op] = list(encoded[op]) + [v for v in operand if v not in encoded[op]]
+        elif op in RANGE_OPERATORS:
+            ranges.add(op)
+        elif op == "$not":
+            # Neither encoding may match
+            clauses.append({"$and": [{path: {"$not": encoded[op]}}, {path: {"$not": operand}}]})
+        else:
+            merged[op] = encoded[op]
+    if ranges:
+        clauses.append({"$or": [
+            {path: {op: encoded[op] for op in ranges}},
+            {path: {op: condition[op] for op in ranges}},
+        ]})
+    if merged:
+        clauses.append({path: merged})
+    return clauses
+
+
+def encode_filter(query: Optional[dict], dual: bool = False) -> Optional[dict]:
+    if not query:
+        return query
+    encoded, clauses = {}, []
+    for key, condition in query.items():
+        if key in ("$or", "$and", "$nor"):
+            encoded[key] = [encode_filter(q, dual) for q in condition]
+        elif key.startswith("$"):
+            encoded[key] = condition  # $expr, $text, ...: left as written
+        else:
+            value = encode_condition(key, condition)
+            if dual and value != condition:
+                clauses += either_condition(key, condition, value)
+            else:
+                encoded[key] = value
+    if clauses:
+        encoded["$and"] = encoded.get("$and", []) + clauses
+    return encoded
+
+
+def encode_update(update, dual: bool = False, upsert_filter: Optional[dict] = None):
+    if isinstance(update, list):
+        return update  # aggregation pipeline updates are left as written
+    if not any(key.startswith("$") for key in update):
+        return encode_document(update)
+    encoded = {}
+    for op, fields in update.items():
+        if op in VALUE_UPDATES:
+            encoded[op] = {path: encode_path(path, v) for path, v in fields.items()}
+        elif op in ARRAY_UPDATES:
+            encoded[op] = {path: encode_array_update(path, v) for path, v in fields.items()}
+        else:
+            encoded[op] = fields
+    if dual and upsert_filter:
+        # An upsert only copies plain equality fields from its filter, and "dual" turns those
+        # into $in matches: set them on insert instead
+        paths = [path for fields in encoded.values() for path in fields]
+        inserted = {
+            key: encode_path(key, value) for key, value in upsert_filter.items()
+            if not key.startswith("$") and not isinstance(value, dict) and encode_path(key, value) != value
+            and not any(p == key or p.startswith(key + ".") or key.startswith(p + ".") for p in paths)
+        }
+        if inserted:
+            encoded["$setOnInsert"] = {**encoded.get("$setOnInsert", {}), **inserted}
+    return encoded
+
+
+def encode_array_update(path: str, value):
+    if isinstance(value, dict) and "$each" in value:
+        return {**value, "$each": [encode_path(path, v) for v in value["$each"]]}
+    if isinstance(value, dict) and value and all(key.startswith("$") for key in value):
+        return encode_condition(path, value)  # $pull by condition
+    return encode_path(path, value)
+
+
+def encode_pipeline(pipeline: List[dict], dual: bool = False) -> List[dict]:
+    stages = []
+    for stage in pipeline:
+        if "$match" in stage:
+            stage = {"$match": encode_filter(stage["$match"], dual)}
+        elif "$lookup" in stage and "pipeline" in stage["$lookup"]:
+            stage = {"$lookup": {**stage["$lookup"], "pipeline": encode_pipeline(stage["$lookup"]["pipeline"], dual)}}
+        stages.append(stage)
+    return stages
+
+
+def encode_operation(op, dual: bool = False):
+    """A copy of a bulk_write request (InsertOne, UpdateOne, ReplaceOne, ...) with encoded values."""
+    op = copy.copy(op)
+    name = type(op).__name__
+    if name == "InsertOne":
+        op._doc = encode_document(op._doc)
+        return op
+    original = op._filter
+    op._filter = encode_filter(original, dual)
+    if name in ("UpdateOne", "UpdateMany"):
+        op._doc = encode_update(op._doc, dual, original if op._upsert else None)
+    elif name == "ReplaceOne":
+        op._doc = encode_document(op._doc)
+    return op
+
+
+class EncodedCursor:
+    """Wraps a find or aggregate cursor so the documents it yields are decoded."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # Keep chained calls (sort, limit, skip, ...) wrapped
+            return self if result is self._cursor else result
+        return call
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return [decode(doc) for doc in await self._cursor.to_list(length)]
+
+    async def __aiter__(self):
+        async for doc in self._cursor:
+            yield decode(doc)
+
+
+class EncodedCollection:
+    """A collection whose ids and timestamps are stored compactly while callers use strings."""
+
+    def __init__(self, collection, dual: bool = False):
+        self.delegate = collection.with_options(codec_options=CODEC_OPTIONS)
+        self.dual = dual
+
+    def __getattr__(self, name):
+        # Index management, name, options, ...
+        return getattr(self.delegate, name)
+
+    def _filter(self, query):
+        return encode_filter(query, self.dual)
+
+    def find(self, filter=None, *args, **kwargs):
+        return EncodedCursor(self.delegate.find(self._filter(filter), *args, **kwargs))
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        return decode(await self.delegate.find_one(self._filter(filter), *args, **kwargs))
+
+    async def find_one_and_update(self, filter, update, *args, **kwargs):
+        update = encode_update(update, self.dual, filter if kwargs.get("upsert") else None)
+        return decode(await self.delegate.find_one_and_update(self._filter(filter), update, *args, **kwargs))
+
+    async def find_one_and_replace(self, filter, replacement, *args, **kwargs):
+        return decode(await self.delegate.find_one_and_replace(
+            self._filter(filter), encode_document(replacement), *args, **kwargs
+        ))
+
+    async def find_one_and_delete(self, filter, *args, **kwargs):
+        return decode(await self.delegate.find_one_and_delete(self._filter(filter), *args, **kwargs))
+
+    async def insert_one(self, document, *args, **kwargs):
+        return await self.delegate.insert_one(encode_document(document), *args, **kwargs)
+
+    async def insert_many(self, documents: Iterable[dict], *args, **kwargs):
+        return await self.delegate.insert_many([encode_document(d) for d in documents], *args, **kwargs)
+
+    async def update_one(self, filter, update, *args, **kwargs):
+        update = encode_update(update, self.dual, filter if kwargs.get("upsert") else None)
+        return await self.delegate.update_one(self._filter(filter), update, *args, **kwargs)
+
+    async def update_many(self, filter, update, *args, **kwargs):
+        update = encode_update(update, self.dual, filter if kwargs.get("upsert") else None)
+        return await self.delegate.update_many(self._filter(filter), update, *args, **kwargs)
+
+    async def replace_one(self, filter, replacement, *args, **kwargs):
+        return await self.delegate.replace_one(self._filter(filter), encode_document(replacement), *args, **kwargs)
+
+    async def delete_one(self, filter, *args, **kwargs):
+        return await self.delegate.delete_one(self._filter(filter), *args, **kwargs)
+
+    async def delete_many(self, filter, *args, **kwargs):
+        return await self.delegate.delete_many(self._filter(filter), *args, **kwargs)
+
+    async def count_documents(self, filter, *args, **kwargs):
+        return await self.delegate.count_documents(self._filter(filter), *args, **kwargs)
+
+    async def distinct(self, key, filter=None, *args, **kwargs):
+        return decode(await self.delegate.distinct(key, self._filter(filter), *args, **kwargs))
+
+    def aggregate(self, pipeline, *args, **kwargs):
+        return EncodedCursor(self.delegate.aggregate(encode_pipeline(pipeline, self.dual), *args, **kwargs))
+
+    async def bulk_write(self, requests, *args, **kwargs):
+        return await self.delegate.bulk_write([encode_operation(r, self.dual) for r in requests], *args, **kwargs)
+
+
+class EncodedDatabase:
+    """A database whose listed collections are EncodedCollections; the rest pass through."""
+
+    def __init__(self, db, collections: Iterable[str], dual: bool = False):
+        self.delegate = db
+        self._collections = {name: EncodedCollection(db[name], dual) for name in collections}
+
+    def __getitem__(self, name: str):
+        return self._collections.get(name) or self.delegate[name]
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name] if name in self._collections else getattr(self.delegate, name)
+
+
+def encoded_database(db, encoding: str, collections: Iterable[str]):
+    """`db` as the API should use it under the given storage encoding."""
+    if encoding == "strings":
+        return db
+    return EncodedDatabase(db, collections, dual=encoding == "dual")
+
+
+def raw_database(db):
+    """The underlying Motor database, for APIs (GridFS) that need the real thing."""
+    return db.delegate if isinstance(db, EncodedDatabase) else db
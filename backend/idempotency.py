@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from deadlines import remaining
+from indexes import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+HEADER = b"idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+IN_PROGRESS = "A request with this Idempotency-Key is still in progress; retry later"
+
+
+class IdempotencyStore:
+    """Stored responses for Idempotency-Key requests: a bounded in-memory cache in front
+    of a Mongo collection whose TTL index expires old keys.
+
+    A pending claim holds a lease that the executing request keeps renewing; if its worker
+    dies, the lease runs out and the next request with the key takes the claim over.
+    """
+
+    def __init__(self, collection, ttl_seconds: int, cache_size: int = 10000, wait_seconds: float = 30.0,
+                 lease_seconds: float = 10.0):
+        self.collection = collection
+        self.ttl = ttl_seconds
+        self.cache_size = cache_size
+        self.wait_seconds = wait_seconds
+        self.lease = lease_seconds
+        self._cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.in_flight: Dict[str, asyncio.Future] = {}
+
+    async def ensure_indexes(self):
+        await ensure_ttl_index(self.collection, "created_at", self.ttl)
+
+    def cached(self, key: str) -> Optional[dict]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires, record = entry
+        if expires < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return record
+
+    def remember(self, key: str, record: dict):
+        self._cache[key] = (time.monotonic() + self.ttl, record)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def locked_until(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease)
+
+    async def claim(self, key: str, request_hash: str, wait: Optional[float] = None) -> Optional[dict]:
+        """Claim a key for execution; returns the stored record instead if one exists.
+
+        A claim held elsewhere is waited on for up to `wait` seconds (default `wait_seconds`).
+        """
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "state": "pending",
+                "request_hash": request_hash,
+                "created_at": datetime.now(timezone.utc),
+                "locked_until": self.locked_until(),
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+        # Another worker owns the key: wait for it to finish, or take over its expired lease
+        deadline = time.monotonic() + (self.wait_seconds if wait is None else wait)
+        record = None
+        while time.monotonic() < deadline:
+            record = await self.collection.find_one({"_id": key})
+            if record is None:
+                return await self.claim(key, request_hash, deadline - time.monotonic())
+            if record["state"] == "done":
+                self.remember(key, record)
+                return record
+            if await self.take_over(key, request_hash):
+                return None
+            await asyncio.sleep(0.05)
+        return {"state": "pending", "request_hash": record["request_hash"] if record else request_hash}
+
+    async def take_over(self, key: str, request_hash: str) -> bool:
+        now = datetime.now(timezone.utc)
+        taken = await self.collection.find_one_and_update(
+            # Claims stored before leases existed have no locked_until and are left to the TTL
+            {"_id": key, "state": "pending", "locked_until": {"$lt": now}},
+            {"$set": {"request_hash": request_hash, "created_at": now, "locked_until": self.locked_until()}},
+            projection={"_id": 1},
+        )
+        if taken:
+            logger.warning("Took over an idempotency key whose request stopped renewing its lease")
+        return taken is not None
+
+    async def renew(self, key: str):
+        """Keep extending the claim's lease while its request runs."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.collection.update_one(
+                    {"_id": key, "state": "pending"}, {"$set": {"locked_until": self.locked_until()}}
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew idempotency key lease: {e}")
+
+    async def complete(self, key: str, record: dict):
+        self.remember(key, record)
+        await self.collection.update_one({"_id": key}, {"$set": record})
+
+    async def release(self, key: str):
+        await self.collection.delete_one({"_id": key, "state": "pending"})
+
+
+class IdempotencyMiddleware:
+    """Replays the stored response for repeated Idempotency-Key requests on the given routes.
+
+    Keys are scoped per user, method and path. Reusing a key with a different body is
+    rejected, and concurrent duplicates wait for the first request, within their own
+    deadline. 5xx responses are not stored so the client can retry them; a duplicate
+    waiting on one runs the request itself instead of replaying the error.
+    """
+
+    def __init__(self, app, routes: Iterable[Tuple[str, str]], store: Callable[[], Optional[IdempotencyStore]],
+                 user_of: Callable[[Optional[str]], Optional[str]]):
+        self.app = app
+        self.routes = set(routes)
+        self.store = store
+        self.user_of = user_of
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"].rstrip("/")) not in self.routes:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        store = self.store()
+        user_id = self.user_of(headers.get(b"authorization", b"").decode())
+        if HEADER not in headers or store is None or user_id is None:
+            return await self.app(scope, receive, send)
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        key = hashlib.sha256(
+            f"{user_id}:{scope['method']}:{scope['path']}:{headers[HEADER].decode()}".encode()
+        ).hexdigest()
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        record = store.cached(key)
+        if record is None and key in store.in_flight:
+            first = store.in_flight[key]
+            try:
+                # None means the first request stored nothing, so this one runs it again
+                record = await asyncio.wait_for(asyncio.shield(first), self._wait(store))
+            except asyncio.TimeoutError:
+                return await self._error(send, 409, IN_PROGRESS)
+            except asyncio.CancelledError:
+                if not first.cancelled():
+                    raise
+                return await self._error(send, 409, IN_PROGRESS)
+        if record is None:
+            record = await self._execute(store, key, request_hash, scope, body, send)
+            if record is None:
+                return
+        await self._replay(record, request_hash, send)
+
+    @staticmethod
+    def _wait(store: IdempotencyStore) -> float:
+        """How long a duplicate may wait for the first request: never past its own deadline."""
+        left = remaining()
+        return store.wait_seconds if left is None else min(store.wait_seconds, left)
+
+    async def _execute(self, store: IdempotencyStore, key: str, request_hash: str, scope, body: bytes, send):
+        future = asyncio.get_running_loop().create_future()
+        store.in_flight[key] = future
+        try:
+            record = await store.claim(key, request_hash, self._wait(store))
+            if record is not None:
+                future.set_result(record)
+                return record
+
+            sent = False
+
+            async def receive():
+                nonlocal sent
+                if not sent:
+                    sent = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                return {"type": "http.disconnect"}
+
+            response = {"status": 500, "headers": [], "body": b""}
+
+            async def capture(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = [
+                        [k.decode("latin-1"), v.decode("latin-1")] for k, v in message.get("headers", [])
+                    ]
+                elif message["type"] == "http.response.body":
+                    response["body"] += message.get("body", b"")
+
+            renewal = asyncio.create_task(store.renew(key))
+            try:
+                await self.app(scope, receive, capture)
+            except BaseException:
+                await store.release(key)
+                raise
+            finally:
+                renewal.cancel()
+
+            record = {
+                "state": "done",
+                "request_hash": request_hash,
+                "status": response["status"],
+                "headers": response["headers"],
+                "body": response["body"].decode("utf-8"),
+            }
+            if response["status"] >= 500:
+                await store.release(key)
+                future.set_result(None)
+            else:
+                await store.complete(key, record)
+                future.set_result(record)
+
+            # The original caller gets the response as produced, without the replay marker
+            await send({"type": "http.response.start", "status": response["status"],
+                        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in response["headers"]]})
+            await send({"type": "http.response.body", "body": response["body"]})
+            return None
+        except BaseException as e:
+            if not future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    # Nothing was stored: duplicates run the request themselves
+                    future.set_result(None)
+            raise
+        finally:
+            if store.in_flight.get(key) is future:
+                del store.in_flight[key]
+
+    async def _replay(self, record: dict, request_hash: str, send):
+        if record["request_hash"] != request_hash:
+            return await self._error(send, 422, "Idempotency-Key was already used with a different request body")
+        if record["state"] != "done":
+            return await self._error(send, 409, IN_PROGRESS)
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]]
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers + [REPLAYED_HEADER]})
+        await send({"type": "http.response.body", "body": record["body"].encode("utf-8")})
+
+    async def _error(self, send, status: int, detail: str):
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
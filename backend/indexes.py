@@ -0,0 +1,24 @@
+import logging
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS_CONFLICT = 85
+
+
+async def ensure_ttl_index(collection, field: str, seconds: int):
+    """Expire documents `seconds` after their `field`, retuning an index created with another lifetime.
+
+    create_index refuses to change the options of an existing index, so without collMod a new
+    retention setting would leave the old one in force.
+    """
+    try:
+        await collection.create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        await collection.database.command(
+            "collMod", collection.name, index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds}
+        )
+        logger.info(f"Updated TTL index on {collection.name}.{field} to {seconds}s")
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+Progress = Callable[[float], Awaitable[None]]
+JobHandler = Callable[[dict, Progress], Awaitable[dict]]
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobRunner:
+    """In-process asyncio job queue with a bounded worker pool and persisted job records.
+
+    Each runner keeps a heartbeat on the jobs it owns; on startup it takes over queued
+    or running jobs whose owner stopped heartbeating (e.g. a crashed or restarted worker).
+    """
+
+    def __init__(self, collection, workers: int = 2, queue_size: int = 100, lease_seconds: int = 60):
+        self.collection = collection
+        self.workers = workers
+        self.lease = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, JobHandler] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._running: Dict[str, asyncio.Task] = {}
+        self._tasks = []
+        self._stopping = False
+
+    def register(self, kind: str, handler: JobHandler):
+        self.handlers[kind] = handler
+
+    async def ensure_indexes(self):
+        await asyncio.gather(
+            self.collection.create_index("id", unique=True),
+            self.collection.create_index([("owner_id", 1), ("created_at", -1)]),
+            self.collection.create_index([("status", 1), ("heartbeat_at", 1)]),
+        )
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        await self.recover()
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Hand unfinished work back so the next runner picks it up without waiting out the lease
+        await self.collection.update_many(
+            {"worker_id": self.worker_id, "status": {"$in": ["queued", "running"]}},
+            {"$set": {"status": "queued", "worker_id": None, "heartbeat_at": None, "updated_at": utcnow()}}
+        )
+
+    async def recover(self):
+        stale = (datetime.now(timezone.utc) - timedelta(seconds=self.lease)).isoformat()
+        recovered = 0
+        while not self._queue.full():
+            job = await self.collection.find_one_and_update(
+                {
+                    "status": {"$in": ["queued", "running"]},
+                    "$or": [{"heartbeat_at": None}, {"heartbeat_at": {"$lt": stale}}],
+                },
+                {"$set": {"status": "queued", "worker_id": self.worker_id, "heartbeat_at": utcnow(), "updated_at": utcnow()}},
+                projection={"_id": 0, "id": 1},
+                sort=[("created_at", 1)],
+            )
+            if job is None:
+                break
+            self._queue.put_nowait(job["id"])
+            recovered += 1
+        if recovered:
+            logger.info(f"Recovered {recovered} interrupted jobs")
+
+    async def submit(self, kind: str, owner_id: str, params: dict) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue.full():
+            raise JobQueueFull()
+        now = utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "owner_id": owner_id,
+            "params": params,
+            "status": "queued",
+            "progress": 0.0,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "worker_id": self.worker_id,
+            "heartbeat_at": now,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+        }
+        await self.collection.insert_one(job)
+        job.pop("_id", None)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def get(self, job_id: str, owner_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": job_id, "owner_id": owner_id}, {"_id": 0})
+
+    async def cancel(self, job_id: str, owner_id: str) -> Optional[dict]:
+        now = utcnow()
+        job = await self.collection.find_one_and_update(
+            {"id": job_id, "owner_id": owner_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "finished_at": now, "updated_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job:
+            return job
+        # Running jobs stop at their next progress report (or right away if they run here)
+        job = await self.collection.find_one_and_update(
+            {"id": job_id, "owner_id": owner_id, "status": "running"},
+            {"$set": {"cancel_requested": True, "updated_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job and job_id in self._running:
+            self._running[job_id].cancel()
+        return job or await self.get(job_id, owner_id)
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception(f"Job {job_id} crashed the worker loop")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        now = utcnow()
+        job = await self.collection.find_one_and_update(
+            {"id": job_id, "status": "queued", "worker_id": self.worker_id},
+            {
+                "$set": {"status": "running", "worker_id": self.worker_id, "heartbeat_at": now,
+                         "started_at": now, "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return  # cancelled (or taken over) while waiting in the queue
+
+        async def progress(fraction: float):
+            updated = await self.collection.find_one_and_update(
+                {"id": job_id},
+                {"$set": {"progress": round(min(max(fraction, 0.0), 1.0), 4), "heartbeat_at": utcnow(), "updated_at": utcnow()}},
+                projection={"_id": 0, "cancel_requested": 1},
+            )
+            if updated and updated.get("cancel_requested"):
+                raise JobCancelled()
+
+        task = asyncio.create_task(self.handlers[job["kind"]](job, progress))
+        self._running[job_id] = task
+        try:
+            result = await task
+            update = {"status": "done", "progress": 1.0, "result": result}
+        except (asyncio.CancelledError, JobCancelled):
+            if self._stopping:
+                raise  # the runner itself is shutting down; stop() requeues the job
+            update = {"status": "cancelled"}
+        except Exception as e:
+            logger.exception(f"Job {job_id} ({job['kind']}) failed")
+            update = {"status": "failed", "error": str(e)}
+        finally:
+            self._running.pop(job_id, None)
+        now = utcnow()
+        await self.collection.update_one(
+            {"id": job_id},
+            {"$set": {**update, "finished_at": now, "updated_at": now, "heartbeat_at": None}}
+        )
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.collection.update_many(
+                    {"worker_id": self.worker_id, "status": {"$in": ["queued", "running"]}},
+                    {"$set": {"heartbeat_at": utcnow()}}
+                )
+                await self.recover()
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {e}")
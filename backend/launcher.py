@@ -0,0 +1,31 @@
+"""Multi-worker launcher for the API.
+
+    python launcher.py
+
+Each worker process builds its own app (and Mongo client) through the create_app
+factory, so nothing is shared across forks. Workers see the resolved WEB_CONCURRENCY,
+which keeps per-process write coalescing off unless STICKY_SESSIONS is set.
+"""
+import os
+
+import uvicorn
+
+
+def main():
+    workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "server:create_app",
+        factory=True,
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8001")),
+        workers=workers,
+        backlog=int(os.environ.get("BACKLOG", "2048")),
+        timeout_keep_alive=int(os.environ.get("KEEP_ALIVE_SECONDS", "5")),
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+from typing import List
+
+# "separate": one collection per tool, each artifact a document carrying a copy of its
+# session's membership. "embedded": every artifact lives inside its session document under
+# `tools.<collection>` and takes its membership from the session.
+LAYOUTS = ("separate", "embedded")
+
+# Layouts not yet compared against the default on a real deployment; the server only starts
+# with one of them when STORAGE_LAYOUT_EXPERIMENTAL is set. Leaving this list (or becoming the
+# default) takes the bench_layout.py results described in its docstring.
+EXPERIMENTAL_LAYOUTS = ("embedded",)
+
+EMBEDDED_FIELD = "tools"
+
+# Fields an embedded artifact does not store, because the session document provides them
+SESSION_FIELDS = ("_id", "session_id", "owner_id", "member_ids")
+
+# MongoDB rejects documents larger than this, which caps how much an embedded session can hold
+MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+
+
+def tool_path(collection: str) -> str:
+    return f"{EMBEDDED_FIELD}.{collection}"
+
+
+def embed(doc: dict) -> dict:
+    """An artifact as stored inside its session document."""
+    return {k: v for k, v in doc.items() if k not in SESSION_FIELDS}
+
+
+def unembed(session: dict, doc: dict) -> dict:
+    """An embedded artifact shaped like its separate-layout document."""
+    return {
+        **doc,
+        "session_id": session["id"],
+        "owner_id": session.get("owner_id"),
+        "member_ids": session.get("member_ids", []),
+    }
+
+
+def embedded_view(collection: str, match: dict) -> List[dict]:
+    """Aggregation stages that turn matching sessions into their (unembedded) `collection` artifact."""
+    return [
+        {"$match": {**match, tool_path(collection): {"$exists": True}}},
+        {"$replaceWith": {"$mergeObjects": [
+            f"${tool_path(collection)}",
+            {"session_id": "$id", "owner_id": "$owner_id", "member_ids": "$member_ids"},
+        ]}},
+    ]
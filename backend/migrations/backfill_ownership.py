@@ -0,0 +1,93 @@
+"""Copies project ownership onto sessions and their tool artifacts.
+
+    python -m migrations.backfill_ownership [--batch-size 500] [--dry-run]
+
+Run from the backend directory. Safe to re-run: sessions that already have an
+owner keep their member list, and artifacts are always resynced from their session.
+"""
+import argparse
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateMany, UpdateOne
+
+from encoding import encoded_database
+from server import ARTIFACT_COLLECTIONS, ENCODED_COLLECTIONS, Settings, ensure_indexes
+
+logger = logging.getLogger("migrations.backfill_ownership")
+
+
+async def backfill_sessions(db, batch_size: int, dry_run: bool) -> int:
+    updated = 0
+    ops = []
+    async for project in db.projects.find({}, {"_id": 0, "id": 1, "owner_id": 1}):
+        ops.append(UpdateMany(
+            {"project_id": project["id"], "owner_id": {"$exists": False}},
+            {"$set": {"owner_id": project["owner_id"]}, "$addToSet": {"member_ids": project["owner_id"]}},
+        ))
+        if len(ops) >= batch_size:
+            updated += await apply(db.sessions, ops, dry_run)
+            ops = []
+    updated += await apply(db.sessions, ops, dry_run)
+    return updated
+
+
+async def backfill_artifacts(db, batch_size: int, dry_run: bool) -> dict:
+    counts = {collection: 0 for collection in ARTIFACT_COLLECTIONS}
+    ops = []
+
+    async def flush():
+        results = await asyncio.gather(*(apply(db[c], ops, dry_run) for c in ARTIFACT_COLLECTIONS))
+        for collection, count in zip(ARTIFACT_COLLECTIONS, results):
+            counts[collection] += count
+
+    sessions = db.sessions.find(
+        {"owner_id": {"$exists": True}},
+        {"_id": 0, "id": 1, "owner_id": 1, "member_ids": 1},
+    )
+    async for session in sessions:
+        ops.append(UpdateOne(
+            {"session_id": session["id"]},
+            {"$set": {"owner_id": session["owner_id"], "member_ids": session.get("member_ids", [])}},
+        ))
+        if len(ops) >= batch_size:
+            await flush()
+            ops = []
+    if ops:
+        await flush()
+    return counts
+
+
+async def apply(collection, ops, dry_run: bool) -> int:
+    if not ops:
+        return 0
+    if dry_run:
+        return len(ops)
+    result = await collection.bulk_write(ops, ordered=False)
+    return result.modified_count
+
+
+async def main(batch_size: int, dry_run: bool):
+    settings = Settings.from_env()
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = encoded_database(client[settings.db_name], settings.storage_encoding, ENCODED_COLLECTIONS)
+    try:
+        await ensure_indexes(db)
+        sessions = await backfill_sessions(db, batch_size, dry_run)
+        logger.info(f"Sessions updated: {sessions}")
+        for collection, count in (await backfill_artifacts(db, batch_size, dry_run)).items():
+            logger.info(f"{collection} updated: {count}")
+        orphans = await db.sessions.count_documents({"owner_id": {"$exists": False}})
+        if orphans:
+            logger.warning(f"{orphans} sessions have no owning project and remain inaccessible")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill session and artifact ownership")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Count the operations without writing")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
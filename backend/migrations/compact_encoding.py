@@ -0,0 +1,175 @@
+"""Converts stored ids and timestamps between the "strings" and "compact" storage encodings.
+
+    python -m migrations.compact_encoding --to compact [--batch-size 500] [--dry-run]
+    python -m migrations.compact_encoding --to strings [--batch-size 500] [--dry-run]
+    python -m migrations.compact_encoding --report
+
+Runs online, from the backend directory: restart the API with STORAGE_ENCODING=dual (which
+reads both encodings), run the migration, then restart it with STORAGE_ENCODING set to the
+target. Each batch only sets the converted fields, and only where they still hold the values
+read, so concurrent saves are never overwritten; documents changed in between are counted as
+"retry" and converted by running the migration again. While it runs, the dashboard can miss
+sessions or activity whose project or session has not been converted yet.
+
+Document and index sizes of the converted collections are printed before and after. WiredTiger
+keeps freed space for reuse, so storage and index sizes only shrink fully once the collection
+is compacted or its indexes are rebuilt.
+"""
+import argparse
+import asyncio
+import logging
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from encoding import CODEC_OPTIONS, DATE_FIELDS, ID_FIELDS, decode, encode_field
+from layouts import EMBEDDED_FIELD
+from server import ENCODED_COLLECTIONS, Settings, ensure_indexes
+
+logger = logging.getLogger("migrations.compact_encoding")
+
+
+def converted(field: str, value, target: str):
+    if field not in ID_FIELDS and field not in DATE_FIELDS:
+        return value
+    return encode_field(field, value) if target == "compact" else decode(value)
+
+
+def conversions(collection: str, doc: dict, target: str) -> dict:
+    """Paths of the document whose stored values change under the target encoding."""
+    changes = {}
+    for field, value in doc.items():
+        if field == EMBEDDED_FIELD and isinstance(value, dict):
+            for tool, artifact in value.items():
+                for name, item in (artifact or {}).items():
+                    new = converted(name, item, target)
+                    if new != item:
+                        changes[f"{EMBEDDED_FIELD}.{tool}.{name}"] = new
+        elif field != "_id":
+            new = converted(field, value, target)
+            if new != value:
+                changes[field] = new
+    if collection == "session_change_counters" and "session_id" not in doc:
+        # The dashboard joins on this copy of the (always string) _id
+        changes["session_id"] = converted("session_id", doc["_id"], target)
+    return changes
+
+
+def current(doc: dict, path: str):
+    for part in path.split("."):
+        doc = (doc or {}).get(part)
+    return doc
+
+
+def with_changes(doc: dict, changes: dict) -> dict:
+    doc = {**doc, EMBEDDED_FIELD: {k: dict(v) for k, v in doc[EMBEDDED_FIELD].items()}} if EMBEDDED_FIELD in doc else dict(doc)
+    for path, value in changes.items():
+        *parents, name = path.split(".")
+        target = doc
+        for part in parents:
+            target = target[part]
+        target[name] = value
+    return doc
+
+
+async def convert_collection(collection, target: str, batch_size: int, dry_run: bool) -> dict:
+    counts = {"documents": 0, "converted": 0, "retry": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = None
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        batch = await collection.find(query).sort("_id", 1).to_list(batch_size)
+        if not batch:
+            return counts
+        last_id = batch[-1]["_id"]
+        ops = []
+        for doc in batch:
+            changes = conversions(collection.name, doc, target)
+            counts["documents"] += 1
+            counts["bytes_before"] += len(bson.encode(doc, codec_options=CODEC_OPTIONS))
+            counts["bytes_after"] += len(bson.encode(with_changes(doc, changes), codec_options=CODEC_OPTIONS))
+            if changes:
+                # Matches only while the fields still hold what was read
+                guard = {path: current(doc, path) for path in changes}
+                ops.append(UpdateOne({"_id": doc["_id"], **guard}, {"$set": changes}))
+        if dry_run or not ops:
+            counts["converted"] += len(ops)
+            continue
+        result = await collection.bulk_write(ops, ordered=False)
+        counts["converted"] += result.matched_count
+        counts["retry"] += len(ops) - result.matched_count
+
+
+async def sizes(db) -> dict:
+    stats = {}
+    for name in ENCODED_COLLECTIONS:
+        rows = await db[name].aggregate([{"$collStats": {"storageStats": {}}}]).to_list(None)
+        storage = rows[0]["storageStats"] if rows else {}
+        stats[name] = {
+            "count": storage.get("count", 0),
+            "size": storage.get("size", 0),
+            "index": storage.get("totalIndexSize", 0),
+            "indexes": storage.get("indexSizes", {}),
+        }
+    return stats
+
+
+def report(title: str, stats: dict, before: dict = None):
+    logger.info(title)
+    logger.info(f"  {'collection':<26}{'documents':>10}{'data bytes':>14}{'avg doc':>9}{'index bytes':>14}")
+    totals = {"count": 0, "size": 0, "index": 0}
+    for name, s in stats.items():
+        line = f"  {name:<26}{s['count']:>10}{s['size']:>14}{s['size'] // max(s['count'], 1):>9}{s['index']:>14}"
+        if before:
+            b = before[name]
+            line += f"   data {change(b['size'], s['size'])}, indexes {change(b['index'], s['index'])}"
+        logger.info(line)
+        for key in totals:
+            totals[key] += s[key]
+    line = f"  {'total':<26}{totals['count']:>10}{totals['size']:>14}{'':>9}{totals['index']:>14}"
+    if before:
+        line += (f"   data {change(sum(b['size'] for b in before.values()), totals['size'])}, "
+                 f"indexes {change(sum(b['index'] for b in before.values()), totals['index'])}")
+    logger.info(line)
+
+
+def change(before: int, after: int) -> str:
+    return f"{(after - before) * 100 / before:+.1f}%" if before else "n/a"
+
+
+async def main(target: str, batch_size: int, dry_run: bool, report_only: bool):
+    settings = Settings.from_env()
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.db_name]
+    try:
+        await ensure_indexes(db)
+        before = await sizes(db)
+        report("Sizes before", before)
+        if report_only:
+            return
+        if settings.storage_encoding != "dual" and not dry_run:
+            logger.warning(f"The API is configured with STORAGE_ENCODING={settings.storage_encoding}; "
+                           f"run it with STORAGE_ENCODING=dual while migrating")
+        for name in ENCODED_COLLECTIONS:
+            collection = db[name].with_options(codec_options=CODEC_OPTIONS)
+            counts = await convert_collection(collection, target, batch_size, dry_run)
+            logger.info(f"{name}: {counts['converted']} of {counts['documents']} documents converted"
+                        f"{' (dry run)' if dry_run else ''}, {counts['retry']} to retry; document bytes "
+                        f"{counts['bytes_before']} -> {counts['bytes_after']} ({change(counts['bytes_before'], counts['bytes_after'])})")
+        if not dry_run:
+            report("Sizes after", await sizes(db), before)
+            logger.info(f"Set STORAGE_ENCODING={target} and restart the API once no documents are left to retry")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored ids and timestamps between storage encodings")
+    parser.add_argument("--to", dest="target", choices=["compact", "strings"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Count documents and projected bytes without writing")
+    parser.add_argument("--report", action="store_true", help="Only print collection and index sizes")
+    args = parser.parse_args()
+    if not args.target and not args.report:
+        parser.error("--to is required unless --report is given")
+    asyncio.run(main(args.target, args.batch_size, args.dry_run, args.report))
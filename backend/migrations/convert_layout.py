@@ -0,0 +1,121 @@
+"""Moves tool artifacts between the "separate" and "embedded" storage layouts.
+
+    python -m migrations.convert_layout --to embedded [--batch-size 200] [--dry-run]
+    python -m migrations.convert_layout --to separate [--batch-size 200] [--dry-run]
+
+Run from the backend directory with the API stopped, then restart it with STORAGE_LAYOUT
+set to the new layout. Safe to re-run: each batch is copied before its source is removed.
+Sessions whose embedded document would exceed MongoDB's 16MB limit are reported and left
+in the tool collections, which the embedded layout does not read: trim them, or stay on the
+separate layout. Archived sessions need no conversion; their archive records restore into
+either layout.
+"""
+import argparse
+import asyncio
+import logging
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
+
+from encoding import encoded_database
+from layouts import EXPERIMENTAL_LAYOUTS, MAX_DOCUMENT_BYTES, embed, tool_path, unembed
+from server import ARTIFACT_COLLECTIONS, ENCODED_COLLECTIONS, Settings, ensure_indexes
+
+logger = logging.getLogger("migrations.convert_layout")
+
+
+async def session_batches(db, query: dict, projection: dict, batch_size: int):
+    last_id = None
+    while True:
+        page = query if last_id is None else {**query, "id": {"$gt": last_id}}
+        batch = await db.sessions.find(page, projection).sort("id", 1).to_list(batch_size)
+        if not batch:
+            return
+        last_id = batch[-1]["id"]
+        yield batch
+
+
+async def to_embedded(db, batch_size: int, dry_run: bool) -> dict:
+    counts = {"sessions": 0, "too_large": 0, **{collection: 0 for collection in ARTIFACT_COLLECTIONS}}
+    async for sessions in session_batches(db, {}, {"_id": 0}, batch_size):
+        ids = [s["id"] for s in sessions]
+        found = await asyncio.gather(*(
+            db[c].find({"session_id": {"$in": ids}}, {"_id": 0}).to_list(None) for c in ARTIFACT_COLLECTIONS
+        ))
+        tools = {session_id: {} for session_id in ids}
+        for collection, docs in zip(ARTIFACT_COLLECTIONS, found):
+            for doc in docs:
+                tools[doc["session_id"]][collection] = embed(doc)
+
+        ops = []
+        moved = []
+        for session in sessions:
+            embedding = tools[session["id"]]
+            if not embedding:
+                continue
+            size = len(bson.encode({**session, "tools": {**(session.get("tools") or {}), **embedding}}))
+            if size > MAX_DOCUMENT_BYTES:
+                logger.warning(f"Session {session['id']} would be {size} bytes embedded; left in the separate layout")
+                counts["too_large"] += 1
+                continue
+            ops.append(UpdateOne(
+                {"id": session["id"]},
+                {"$set": {tool_path(collection): doc for collection, doc in embedding.items()}}
+            ))
+            moved.append(session["id"])
+            for collection in embedding:
+                counts[collection] += 1
+        counts["sessions"] += len(moved)
+        if dry_run or not ops:
+            continue
+        await db.sessions.bulk_write(ops, ordered=False)
+        await asyncio.gather(*(
+            db[c].delete_many({"session_id": {"$in": moved}}) for c in ARTIFACT_COLLECTIONS
+        ))
+    return counts
+
+
+async def to_separate(db, batch_size: int, dry_run: bool) -> dict:
+    counts = {"sessions": 0, **{collection: 0 for collection in ARTIFACT_COLLECTIONS}}
+    query = {"tools": {"$exists": True}}
+    projection = {"_id": 0, "id": 1, "owner_id": 1, "member_ids": 1, "tools": 1}
+    async for sessions in session_batches(db, query, projection, batch_size):
+        ops = {collection: [] for collection in ARTIFACT_COLLECTIONS}
+        for session in sessions:
+            for collection, doc in (session.get("tools") or {}).items():
+                ops[collection].append(ReplaceOne({"session_id": session["id"]}, unembed(session, doc), upsert=True))
+                counts[collection] += 1
+        counts["sessions"] += len(sessions)
+        if dry_run:
+            continue
+        await asyncio.gather(*(db[c].bulk_write(o, ordered=False) for c, o in ops.items() if o))
+        await db.sessions.update_many(
+            {"id": {"$in": [s["id"] for s in sessions]}}, {"$unset": {"tools": ""}}
+        )
+    return counts
+
+
+async def main(layout: str, batch_size: int, dry_run: bool):
+    settings = Settings.from_env()
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = encoded_database(client[settings.db_name], settings.storage_encoding, ENCODED_COLLECTIONS)
+    try:
+        await ensure_indexes(db)
+        convert = to_embedded if layout == "embedded" else to_separate
+        for name, count in (await convert(db, batch_size, dry_run)).items():
+            logger.info(f"{name}: {count}")
+        if settings.storage_layout != layout:
+            extra = " and STORAGE_LAYOUT_EXPERIMENTAL=true" if layout in EXPERIMENTAL_LAYOUTS else ""
+            logger.warning(f"Set STORAGE_LAYOUT={layout}{extra} before restarting the API")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert tool artifacts between storage layouts")
+    parser.add_argument("--to", dest="layout", choices=["embedded", "separate"], required=True)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="Count the sessions and artifacts without writing")
+    args = parser.parse_args()
+    asyncio.run(main(args.layout, args.batch_size, args.dry_run))
@@ -0,0 +1,190 @@
+import asyncio
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from starlette.routing import Match
+
+# Hard limits so a profile can be taken on a production worker without hurting it
+MAX_SECONDS = 60.0
+MAX_REQUESTS = 1000
+MIN_INTERVAL_MS = 5.0
+MAX_STACK_DEPTH = 128
+MAX_DISTINCT_STACKS = 20000
+TOP_FUNCTIONS = 30
+
+# Leaf frames of threads that are blocked waiting for work rather than running it
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.basename(code.co_filename)
+    name = getattr(code, "co_qualname", code.co_name)
+    # Collapsed-stack format uses ";" between frames and a space before the count
+    return f"{module}.{name}:{frame.f_lineno}".replace(";", ",").replace(" ", "_")
+
+
+def is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_LEAVES
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of every thread in this process.
+
+    Only one profile runs at a time per worker. A profile covers either a fixed number of
+    seconds, or the next N requests to one route; in route mode samples are only kept while
+    at least one matching request is in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Optional[dict] = None
+
+    @property
+    def active(self) -> bool:
+        return self._active is not None
+
+    async def run(self, seconds: Optional[float] = None, route=None, method: str = "GET",
+                  requests: Optional[int] = None, interval_ms: float = 10.0,
+                  include_idle: bool = False) -> dict:
+        timeout = min(seconds or MAX_SECONDS, MAX_SECONDS)
+        profile = {
+            "route": route,
+            "method": method.upper(),
+            "requests": min(requests, MAX_REQUESTS) if requests else None,
+            "in_flight": 0,
+            "completed": 0,
+            "interval": max(interval_ms, MIN_INTERVAL_MS) / 1000,
+            "include_idle": include_idle,
+            "stop": threading.Event(),
+            "result": concurrent.futures.Future(),
+        }
+        with self._lock:
+            if self._active is not None:
+                raise ProfilerBusy()
+            self._active = profile
+        thread = threading.Thread(target=self._sample, args=(profile, timeout), name="sampling-profiler", daemon=True)
+        thread.start()
+        try:
+            return await asyncio.wrap_future(profile["result"])
+        finally:
+            profile["stop"].set()
+            with self._lock:
+                self._active = None
+
+    def request_started(self, scope) -> Optional[dict]:
+        """Called for each HTTP request; returns the profile if the request is being profiled."""
+        profile = self._active
+        if profile is None or profile["route"] is None or scope.get("method") != profile["method"]:
+            return None
+        match, _ = profile["route"].matches(scope)
+        if match != Match.FULL:
+            return None
+        profile["in_flight"] += 1
+        return profile
+
+    @staticmethod
+    def request_finished(profile: dict):
+        profile["in_flight"] -= 1
+        profile["completed"] += 1
+        if profile["requests"] and profile["completed"] >= profile["requests"]:
+            profile["stop"].set()
+
+    def _sample(self, profile: dict, timeout: float):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: Counter = Counter()
+        samples = idle = 0
+        started = time.monotonic()
+        deadline = started + timeout
+        try:
+            while not profile["stop"].wait(profile["interval"]) and time.monotonic() < deadline:
+                if profile["route"] is not None and profile["in_flight"] <= 0:
+                    continue
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    if not profile["include_idle"] and is_idle(frame):
+                        idle += 1
+                        continue
+                    labels = []
+                    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                        labels.append(frame_label(frame))
+                        frame = frame.f_back
+                    if ident not in names:
+                        names.update({t.ident: t.name for t in threading.enumerate()})
+                    labels.append(names.get(ident, f"thread-{ident}").replace(";", ",").replace(" ", "_"))
+                    stack = ";".join(reversed(labels))
+                    if stack not in stacks and len(stacks) >= MAX_DISTINCT_STACKS:
+                        stack = f"{labels[-1]};[truncated]"
+                    stacks[stack] += 1
+                    samples += 1
+            profile["result"].set_result(self._report(profile, stacks, samples, idle, time.monotonic() - started))
+        except Exception as e:
+            profile["result"].set_exception(e)
+
+    def _report(self, profile: dict, stacks: Counter, samples: int, idle: int, elapsed: float) -> dict:
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")[1:]  # drop the thread name
+            if not frames:
+                continue
+            # Aggregate by function; the collapsed stacks keep line numbers
+            functions = [label.rsplit(":", 1)[0] for label in frames]
+            self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+
+        def pct(count: int) -> float:
+            return round(100.0 * count / samples, 2) if samples else 0.0
+
+        top = [
+            {"function": function, "self_samples": count, "self_pct": pct(count),
+             "total_samples": total_counts[function], "total_pct": pct(total_counts[function])}
+            for function, count in self_counts.most_common(TOP_FUNCTIONS)
+        ]
+        return {
+            "mode": "requests" if profile["route"] is not None else "seconds",
+            "route": profile["route"].path if profile["route"] is not None else None,
+            "elapsed_seconds": round(elapsed, 3),
+            "interval_ms": profile["interval"] * 1000,
+            "samples": samples,
+            "idle_samples": idle,
+            "requests_profiled": profile["completed"],
+            "top_functions": top,
+            "collapsed": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        }
+
+
+class ProfilerMiddleware:
+    """Lets a running route profile see which requests match its route; free when idle."""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profile = self.profiler.request_started(scope) if scope["type"] == "http" and self.profiler.active else None
+        if profile is None:
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_finished(profile)
+
@@ -1,34 +1,188 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from fastapi.responses import StreamingResponse
+from bson import ObjectId
+from pymongo import ReturnDocument
 import os
+import asyncio
+import base64
+import json
 import logging
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter, create_model
+from typing import Any, Dict, List, Optional, Tuple, Type
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
+from write_coalescer import WriteCoalescer
+from batch import BatchError, run_batch, targets_batch
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from jobs import JobQueueFull, JobRunner, Progress
+from tracing import FileExporter, MongoCommandListener, TracedRoute, TracingMiddleware, span
+from changelog import ChangeLog, diff_artifact
+from archive import SessionArchive
+from attachments import IMAGE_TYPES, AttachmentStore, AttachmentTooLarge, parse_range, stream_range
+from clustering import CardClusters
+from activity import ActivityLog
+from layouts import EXPERIMENTAL_LAYOUTS, LAYOUTS, embed, embedded_view, tool_path, unembed
+from encoding import ENCODINGS, encoded_database
+from deadlines import DeadlineMiddleware, LoadMonitor, parse_route_timeouts, remaining
+from profiler import MAX_REQUESTS, MAX_SECONDS, MIN_INTERVAL_MS, ProfilerBusy, ProfilerMiddleware, SamplingProfiler
 
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# JWT Configuration
-JWT_SECRET = os.environ.get('JWT_SECRET', 'codesign-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
-# Create the main app
-app = FastAPI(title="Co-Design Connect API")
-api_router = APIRouter(prefix="/api")
+class Settings(BaseModel):
+    mongo_url: str
+    db_name: str
+    jwt_secret: str = "codesign-secret-key-change-in-production"
+    cors_origins: List[str] = ["*"]
+    mongo_min_pool_size: int = 0
+    mongo_max_pool_size: int = 100
+    # Write coalescing for tool autosaves (opt-in, disabled when the window is 0). Buffers are per
+    # process, so with several workers it stays off unless a session's requests always reach the
+    # same worker (sticky routing on the session id)
+    write_coalesce_window_ms: int = 0
+    write_coalesce_durability: str = "ack"
+    web_concurrency: int = 1
+    sticky_sessions: bool = False
+    idempotency_ttl_hours: int = 24
+    job_workers: int = 2
+    job_queue_size: int = 100
+    # Request tracing: sampled traces (and all slow ones) go to the OTLP/JSON file when set
+    trace_sample_rate: float = 0.0
+    trace_slow_ms: float = 500.0
+    trace_export_path: Optional[str] = None
+    # Delta sync change log: entries older than this, or beyond the newest N per session, are compacted
+    change_log_retention_hours: int = 24
+    change_log_max_entries: int = 1000
+    # Sessions untouched for this long can be moved to the compressed archive
+    archive_idle_days: int = 90
+    archive_batch_size: int = 200
+    # Per-request deadlines (also sent to Mongo as maxTimeMS) and load shedding; 0 disables a limit
+    request_timeout_ms: float = 10000
+    route_timeouts_ms: str = ""
+    max_in_flight: int = 0
+    max_loop_lag_ms: float = 0
+    mongo_wait_queue_timeout_ms: int = 0
+    # Users allowed to call the /api/admin endpoints
+    admin_emails: List[str] = []
+    # "separate" collections per tool, or tools "embedded" in their session document (see layouts.py)
+    storage_layout: str = "separate"
+    storage_layout_experimental: bool = False
+    # How ids and timestamps are stored: "strings", "compact" or "dual" while migrating (see encoding.py)
+    storage_encoding: str = "strings"
+    # Image attachments on idea cards and story items; thumbnails need Pillow
+    attachment_max_mb: int = 20
+    thumbnail_workers: int = 2
+    thumbnail_size: int = 320
+    # Boards whose card term vectors stay cached for the similar-card clustering endpoints
+    cluster_cache_boards: int = 256
+    # Who changed what in each session, kept for attribution reports
+    activity_retention_days: int = 365
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        load_dotenv(ROOT_DIR / '.env')
+        return cls(
+            mongo_url=os.environ['MONGO_URL'],
+            db_name=os.environ['DB_NAME'],
+            jwt_secret=os.environ.get('JWT_SECRET', cls.model_fields["jwt_secret"].default),
+            cors_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+            mongo_min_pool_size=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+            mongo_max_pool_size=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+            write_coalesce_window_ms=int(os.environ.get('WRITE_COALESCE_WINDOW_MS', '0')),
+            write_coalesce_durability=os.environ.get('WRITE_COALESCE_DURABILITY', 'ack'),
+            web_concurrency=int(os.environ.get('WEB_CONCURRENCY', '1')),
+            sticky_sessions=os.environ.get('STICKY_SESSIONS', '').lower() in ('1', 'true', 'yes'),
+            idempotency_ttl_hours=int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24')),
+            job_workers=int(os.environ.get('JOB_WORKERS', '2')),
+            job_queue_size=int(os.environ.get('JOB_QUEUE_SIZE', '100')),
+            trace_sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', '0')),
+            trace_slow_ms=float(os.environ.get('TRACE_SLOW_MS', '500')),
+            trace_export_path=os.environ.get('TRACE_EXPORT_PATH') or None,
+            change_log_retention_hours=int(os.environ.get('CHANGE_LOG_RETENTION_HOURS', '24')),
+            change_log_max_entries=int(os.environ.get('CHANGE_LOG_MAX_ENTRIES', '1000')),
+            archive_idle_days=int(os.environ.get('ARCHIVE_IDLE_DAYS', '90')),
+            archive_batch_size=int(os.environ.get('ARCHIVE_BATCH_SIZE', '200')),
+            request_timeout_ms=float(os.environ.get('REQUEST_TIMEOUT_MS', '10000')),
+            route_timeouts_ms=os.environ.get('ROUTE_TIMEOUTS_MS', ''),
+            max_in_flight=int(os.environ.get('MAX_IN_FLIGHT', '0')),
+            max_loop_lag_ms=float(os.environ.get('MAX_LOOP_LAG_MS', '0')),
+            mongo_wait_queue_timeout_ms=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0')),
+            admin_emails=[e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()],
+            storage_layout=os.environ.get('STORAGE_LAYOUT', 'separate'),
+            storage_layout_experimental=os.environ.get('STORAGE_LAYOUT_EXPERIMENTAL', '').lower() in ('1', 'true', 'yes'),
+            storage_encoding=os.environ.get('STORAGE_ENCODING', 'strings'),
+            attachment_max_mb=int(os.environ.get('ATTACHMENT_MAX_MB', '20')),
+            thumbnail_workers=int(os.environ.get('THUMBNAIL_WORKERS', '2')),
+            thumbnail_size=int(os.environ.get('THUMBNAIL_SIZE', '320')),
+            cluster_cache_boards=int(os.environ.get('CLUSTER_CACHE_BOARDS', '256')),
+            activity_retention_days=int(os.environ.get('ACTIVITY_RETENTION_DAYS', '365')),
+        )
+
+# Collections holding the six per-session tool artifacts
+ARTIFACT_COLLECTIONS = ["problem_trees", "empathy_maps", "story_maps", "ideas_boards", "feedback", "expectations"]
+
+# Collections whose ids and timestamps the storage encoding applies to; the others hold
+# operational data (jobs, change entries, archives, ...) with their own formats
+ENCODED_COLLECTIONS = [
+    "users", "projects", "sessions", *ARTIFACT_COLLECTIONS, "session_templates", "attachments", "session_change_counters"
+]
+
+# Session documents without embedded tools, for listings and access checks
+SESSION_PROJECTION = {"_id": 0, "tools": 0}
+
+# Populated by the app lifespan (see create_app) so importing this module stays cheap. The
+# routes read them directly, so one process runs one app at a time.
+settings: Optional[Settings] = None
+client: Optional[AsyncIOMotorClient] = None
+db = None
+coalescer: Optional[WriteCoalescer] = None
+idempotency_store: Optional[IdempotencyStore] = None
+job_runner: Optional[JobRunner] = None
+job_results: Optional[AsyncIOMotorGridFSBucket] = None
+change_log: Optional[ChangeLog] = None
+session_archive: Optional[SessionArchive] = None
+load_monitor: Optional[LoadMonitor] = None
+attachment_store: Optional[AttachmentStore] = None
+card_clusters: Optional[CardClusters] = None
+activity_log: Optional[ActivityLog] = None
+# Per-process, so a profile only ever covers the worker that served the admin request
+profiler = SamplingProfiler()
+# The app whose lifespan currently owns the globals above
+_running_app: Optional[FastAPI] = None
+
+# Routes that legitimately outlive the default request deadline (ROUTE_TIMEOUTS_MS can override)
+ROUTE_TIMEOUTS_MS = {
+    ("GET", "/api/sessions/{session_id}/changes"): 35000,
+    ("POST", "/api/admin/profile"): (MAX_SECONDS + 5) * 1000,
+    ("GET", "/api/jobs/{job_id}/result"): 300000,
+    ("POST", "/api/sessions/{session_id}/attachments"): 120000,
+    ("GET", "/api/attachments/{attachment_id}"): 300000,
+}
+
+# Create endpoints that honour the Idempotency-Key header
+IDEMPOTENT_ROUTES = [
+    ("POST", "/api/projects"),
+    ("POST", "/api/sessions"),
+    ("POST", "/api/problem-trees"),
+    ("POST", "/api/empathy-maps"),
+    ("POST", "/api/story-maps"),
+    ("POST", "/api/ideas-boards"),
+    ("POST", "/api/feedback"),
+    ("POST", "/api/expectations"),
+]
+
+api_router = APIRouter(prefix="/api", route_class=TracedRoute)
 security = HTTPBearer()
 
 # ==================== MODELS ====================
@@ -81,12 +235,23 @@ class SessionCreate(BaseModel):
     name: str
     description: Optional[str] = ""
 
+class SessionMemberAdd(BaseModel):
+    email: EmailStr
+
+class SessionClone(BaseModel):
+    project_id: Optional[str] = None
+    name: Optional[str] = None
+    count: int = Field(default=1, ge=1, le=100)
+    strip_content: bool = False
+
 class SessionResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
     project_id: str
     name: str
     description: str
+    owner_id: Optional[str] = None
+    member_ids: List[str] = []
     current_step: int = 0
     created_at: str
     updated_at: str
@@ -111,6 +276,7 @@ class ProblemTreeResponse(BaseModel):
     items: List[dict]
     created_at: str
     updated_at: str
+    revision: int = 0
 
 # Empathy Map Models
 class EmpathyMapCreate(BaseModel):
@@ -132,6 +298,7 @@ class EmpathyMapResponse(BaseModel):
     feels: List[str]
     created_at: str
     updated_at: str
+    revision: int = 0
 
 # Story Map Models
 class StoryItem(BaseModel):
@@ -140,6 +307,7 @@ class StoryItem(BaseModel):
     type: str = Field(pattern="^(activity|task|story)$")
     column: int = 0
     row: int = 0
+    attachment_ids: List[str] = []
 
 class StoryMapCreate(BaseModel):
     session_id: str
@@ -154,6 +322,7 @@ class StoryMapResponse(BaseModel):
     items: List[dict]
     created_at: str
     updated_at: str
+    revision: int = 0
 
 # Ideas Board Models
 class IdeaCard(BaseModel):
@@ -162,6 +331,7 @@ class IdeaCard(BaseModel):
     category: Optional[str] = "general"
     votes: int = 0
     color: Optional[str] = "#FFFFFF"
+    attachment_ids: List[str] = []
 
 class IdeasBoardCreate(BaseModel):
     session_id: str
@@ -174,6 +344,7 @@ class IdeasBoardResponse(BaseModel):
     ideas: List[dict]
     created_at: str
     updated_at: str
+    revision: int = 0
 
 # I Like I Wish What If Models
 class FeedbackItem(BaseModel):
@@ -192,6 +363,7 @@ class FeedbackResponse(BaseModel):
     items: List[dict]
     created_at: str
     updated_at: str
+    revision: int = 0
 
 # Manage Expectations Models
 class ExpectationItem(BaseModel):
@@ -211,6 +383,232 @@ class ExpectationsResponse(BaseModel):
     items: List[dict]
     created_at: str
     updated_at: str
+    revision: int = 0
+
+# Sparse fieldset variants: every field optional, plus `<list>_count` fields for list fields
+def partial_model(model: Type[BaseModel], counted: Tuple[str, ...] = ()) -> Type[BaseModel]:
+    fields = {name: (Optional[field.annotation], None) for name, field in model.model_fields.items()}
+    fields.update({f"{name}_count": (Optional[int], None) for name in counted})
+    return create_model(f"Partial{model.__name__}", __config__=ConfigDict(extra="ignore"), **fields)
+
+PartialProjectResponse = partial_model(ProjectResponse)
+PartialSessionResponse = partial_model(SessionResponse, ("member_ids",))
+PartialProblemTreeResponse = partial_model(ProblemTreeResponse, ("items",))
+PartialEmpathyMapResponse = partial_model(EmpathyMapResponse, ("says", "thinks", "does", "feels"))
+PartialStoryMapResponse = partial_model(StoryMapResponse, ("items",))
+PartialIdeasBoardResponse = partial_model(IdeasBoardResponse, ("ideas",))
+PartialFeedbackResponse = partial_model(FeedbackResponse, ("items",))
+PartialExpectationsResponse = partial_model(ExpectationsResponse, ("items",))
+
+# Windowed item reads add the filtered item total and a cursor for the next window
+def window_model(partial: Type[BaseModel]) -> Type[BaseModel]:
+    return create_model(
+        partial.__name__.replace("Partial", "Windowed"),
+        __base__=partial,
+        total=(Optional[int], None),
+        next_cursor=(Optional[str], None)
+    )
+
+WindowedStoryMapResponse = window_model(PartialStoryMapResponse)
+WindowedIdeasBoardResponse = window_model(PartialIdeasBoardResponse)
+WindowedFeedbackResponse = window_model(PartialFeedbackResponse)
+WindowedExpectationsResponse = window_model(PartialExpectationsResponse)
+
+# Workshop Provisioning Models
+# Seeds are the tools' create models without the session they attach to
+def seed_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    fields = {name: (field.annotation, field) for name, field in model.model_fields.items() if name != "session_id"}
+    return create_model(model.__name__.replace("Create", "Seed"), **fields)
+
+ProblemTreeSeed = seed_model(ProblemTreeCreate)
+EmpathyMapSeed = seed_model(EmpathyMapCreate)
+StoryMapSeed = seed_model(StoryMapCreate)
+IdeasBoardSeed = seed_model(IdeasBoardCreate)
+FeedbackSeed = seed_model(FeedbackCreate)
+ExpectationsSeed = seed_model(ExpectationsCreate)
+
+class WorkshopCreate(BaseModel):
+    project_id: str
+    name: str = "Group"
+    names: Optional[List[str]] = Field(default=None, min_length=1, max_length=100)
+    count: int = Field(default=1, ge=1, le=100)
+    description: Optional[str] = ""
+    problem_trees: Optional[ProblemTreeSeed] = None
+    empathy_maps: Optional[EmpathyMapSeed] = None
+    story_maps: Optional[StoryMapSeed] = None
+    ideas_boards: Optional[IdeasBoardSeed] = None
+    feedback: Optional[FeedbackSeed] = None
+    expectations: Optional[ExpectationsSeed] = None
+
+class WorkshopSessionResponse(SessionResponse):
+    artifact_ids: Dict[str, str] = {}
+
+# Attachment Models
+class AttachmentResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    session_id: str
+    owner_id: str
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    has_thumbnail: bool = False
+    url: str
+    thumbnail_url: Optional[str] = None
+    created_at: str
+
+# Card Clustering Models
+class CardCluster(BaseModel):
+    label: str
+    terms: List[str]
+    representative_id: str
+    item_ids: List[str]
+    size: int
+
+class ClustersResponse(BaseModel):
+    session_id: str
+    threshold: float
+    clusters: List[CardCluster]
+    unclustered_ids: List[str]
+
+# Session Template Models
+class SessionTemplateCreate(BaseModel):
+    session_id: str
+    name: str
+    description: Optional[str] = ""
+    strip_content: bool = True
+
+class SessionTemplateInstantiate(BaseModel):
+    project_id: str
+    name: Optional[str] = None
+    count: int = Field(default=1, ge=1, le=100)
+
+class DashboardSession(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    current_step: int = 0
+    last_activity_at: Optional[str] = None
+    archived_at: Optional[str] = None
+
+class DashboardProject(ProjectResponse):
+    session_count: int = 0
+    last_activity_at: Optional[str] = None
+    sessions: List[DashboardSession] = []
+
+class DashboardResponse(BaseModel):
+    projects: List[DashboardProject]
+    next_cursor: Optional[str] = None
+
+class SessionTemplateResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    description: str
+    owner_id: str
+    tools: List[str]
+    created_at: str
+    updated_at: str
+
+# Job Models
+class JobResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    kind: str
+    status: str
+    progress: float
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+# Change Feed Models
+class SessionChangesResponse(BaseModel):
+    seq: int
+    reset: bool
+    more: bool
+    changes: List[dict]
+    # Current session and artifacts, sent instead of changes when the client must reload
+    snapshot: Optional[dict] = None
+
+# Activity Log Models
+class ActivityEvent(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    user_id: str
+    user_name: Optional[str] = None
+    artifact: str
+    operation: str
+    item_ids: List[str] = []
+    created_at: str
+
+class ActivityResponse(BaseModel):
+    events: List[ActivityEvent]
+    next_cursor: Optional[str] = None
+
+# Archive Models
+class ArchiveRequest(BaseModel):
+    idle_days: Optional[int] = Field(default=None, ge=1)
+
+class ArchiveStatsResponse(BaseModel):
+    sessions: int
+    documents: int
+    raw_bytes: int
+    compressed_bytes: int
+
+# Load Models
+class LoadResponse(BaseModel):
+    in_flight: int
+    max_in_flight: int
+    loop_lag_ms: float
+    max_loop_lag_ms: float
+    counters: dict
+
+# Profiler Models
+class ProfileRequest(BaseModel):
+    seconds: Optional[float] = Field(default=None, gt=0, le=MAX_SECONDS)
+    route: Optional[str] = None
+    method: str = "GET"
+    requests: Optional[int] = Field(default=None, ge=1, le=MAX_REQUESTS)
+    interval_ms: float = Field(default=10.0, ge=MIN_INTERVAL_MS, le=1000)
+    include_idle: bool = False
+
+class ProfileFunction(BaseModel):
+    function: str
+    self_samples: int
+    self_pct: float
+    total_samples: int
+    total_pct: float
+
+class ProfileResponse(BaseModel):
+    mode: str
+    route: Optional[str] = None
+    elapsed_seconds: float
+    interval_ms: float
+    samples: int
+    idle_samples: int
+    requests_profiled: int
+    top_functions: List[ProfileFunction]
+    collapsed: str
+
+# Batch Models
+class BatchOperation(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    method: str = Field(pattern="^(GET|POST|PUT|DELETE)$")
+    path: str = Field(pattern="^/")
+    body: Optional[Any] = None
+    depends_on: List[str] = []
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(min_length=1, max_length=50)
+
+class BatchResult(BaseModel):
+    id: str
+    status: int
+    body: Optional[Any] = None
 
 # ==================== HELPER FUNCTIONS ====================
 
@@ -226,15 +624,31 @@ def create_token(user_id: str) -> str:
         "exp": datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS),
         "iat": datetime.now(timezone.utc)
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return jwt.encode(payload, settings.jwt_secret, algorithm=JWT_ALGORITHM)
+
+def token_subject(authorization: Optional[str]) -> Optional[str]:
+    """User id from a "Bearer <jwt>" header value, or None if it is missing or invalid."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, settings.jwt_secret, algorithms=[JWT_ALGORITHM]).get("sub")
+    except jwt.InvalidTokenError:
+        return None
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Sub-requests of a batch reuse the user authenticated for the batch itself
+    batch_user = request.scope.get("state", {}).get("batch_user")
+    if batch_user:
+        return batch_user
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        with span("auth.jwt_decode"):
+            payload = jwt.decode(credentials.credentials, settings.jwt_secret, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        with span("auth.user_lookup"):
+            user = await db.users.find_one({"id": user_id}, {"_id": 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         return user
@@ -243,6 +657,522 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    if current_user.get("email", "").lower() not in settings.admin_emails:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def fields_projection(fields: Optional[str], partial: Type[BaseModel]) -> Optional[dict]:
+    """Translate a comma separated `fields` query parameter into a Mongo projection."""
+    if not fields:
+        return None
+    requested = {"id"} | {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = sorted(requested - set(partial.model_fields))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {"_id": 0}
+    for name in requested:
+        if name.endswith("_count") and name not in projection and name[:-6] in partial.model_fields:
+            projection[name] = {"$size": {"$ifNull": [f"${name[:-6]}", []]}}
+        else:
+            projection[name] = 1
+    return projection
+
+def apply_projection(doc: dict, projection: Optional[dict]) -> dict:
+    """Project an in-memory document the same way Mongo would."""
+    if not projection:
+        return doc
+    projected = {}
+    for name, spec in projection.items():
+        if isinstance(spec, dict):
+            projected[name] = len(doc.get(name[:-6]) or [])
+        elif spec and name in doc:
+            projected[name] = doc[name]
+    return projected
+
+def sparse_response(partial: Type[BaseModel], content) -> Response:
+    # Bypasses the full response_model so only the requested fields are serialized
+    if isinstance(content, list):
+        body = TypeAdapter(List[partial]).dump_json([partial(**doc) for doc in content], exclude_unset=True)
+    else:
+        body = partial(**content).model_dump_json(exclude_unset=True)
+    return Response(content=body, media_type="application/json")
+
+# Item list, filterable field and orderings of the tools whose GET supports windows. Each
+# ordering is a list of (field, direction, default) sort keys, where a list default ranks the
+# field's values in that order instead. Ties keep the board's own item order.
+ITEM_WINDOWS = {
+    "story_maps": {"list": "items", "filter": "type", "orders": {"position": [("column", 1, 0), ("row", 1, 0)]}},
+    "ideas_boards": {"list": "ideas", "filter": "category", "orders": {"votes": [("votes", -1, 0)]}},
+    "feedback": {"list": "items", "filter": "type", "orders": {"type": [("type", 1, ["like", "wish", "whatif"])]}},
+    "expectations": {"list": "items", "filter": "type", "orders": {"priority": [("priority", 1, 2)]}},
+}
+MAX_WINDOW = 500
+
+def item_window(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_WINDOW),
+    cursor: Optional[str] = None,
+    order: Optional[str] = None
+) -> dict:
+    window = {"offset": offset, "limit": limit, "after": None, "order": order, "match": None}
+    if cursor:
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            window["after"], window["offset"] = str(position["id"]), int(position["offset"])
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    return window
+
+def windowed(window: dict, match: Optional[str]) -> bool:
+    window["match"] = match
+    return bool(window["limit"] or window["after"] or window["offset"] or window["order"] or match is not None)
+
+def window_pipeline(collection: str, session_id: str, user: dict, window: dict, projection: Optional[dict]) -> list:
+    """Aggregation that filters, orders and slices an artifact's items inside MongoDB (5.2+)."""
+    spec = ITEM_WINDOWS[collection]
+    items: Any = {"$ifNull": [f"${spec['list']}", []]}
+    if window["match"] is not None:
+        items = {"$filter": {"input": items, "as": "item", "cond": {"$eq": [f"$$item.{spec['filter']}", window["match"]]}}}
+    if window["order"]:
+        keys = {}
+        sort_by = {}
+        for n, (field, direction, default) in enumerate(spec["orders"][window["order"]]):
+            if isinstance(default, list):
+                keys[f"k{n}"] = {"$indexOfArray": [default, f"$$item.{field}"]}
+            else:
+                keys[f"k{n}"] = {"$ifNull": [f"$$item.{field}", default]}
+            sort_by[f"k{n}"] = direction
+        # Sort (keys, position, item) entries so computed keys and the original order can be used
+        entries = {"$map": {
+            "input": {"$range": [0, {"$size": "$$all"}]},
+            "as": "p",
+            "in": {"$let": {
+                "vars": {"item": {"$arrayElemAt": ["$$all", "$$p"]}},
+                "in": {**keys, "p": "$$p", "item": "$$item"}
+            }}
+        }}
+        items = {"$let": {"vars": {"all": items}, "in": {"$map": {
+            "input": {"$sortArray": {"input": entries, "sortBy": {**sort_by, "p": 1}}},
+            "as": "entry",
+            "in": "$$entry.item"
+        }}}}
+    start: Any = window["offset"]
+    if window["after"]:
+        # Resume after the cursor's item; fall back to its offset if that item is gone
+        at = {"$indexOfArray": ["$$items.id", window["after"]]}
+        start = {"$let": {"vars": {"at": at}, "in": {
+            "$cond": [{"$gte": ["$$at", 0]}, {"$add": ["$$at", 1]}, window["offset"]]
+        }}}
+    count = window["limit"] or {"$max": [{"$size": "$$items"}, 1]}
+    window_expr = {"$let": {"vars": {"items": items}, "in": {"$let": {"vars": {"start": start}, "in": {
+        "items": {"$slice": ["$$items", "$$start", count]},
+        "total": {"$size": "$$items"},
+        "start": "$$start",
+    }}}}}
+    pipeline = [*artifact_match(collection, session_id, user), {"$set": {"_window": window_expr}}]
+    # Only the window leaves the server; the full list is dropped once it has been sliced
+    if projection:
+        fields = {name: value for name, value in projection.items() if name != spec["list"]}
+        pipeline.append({"$project": {**fields, "_window": 1}})
+    else:
+        pipeline.append({"$project": {"_id": 0, spec["list"]: 0}})
+    pipeline.append({"$limit": 1})
+    return pipeline
+
+def window_in_memory(collection: str, doc: dict, window: dict) -> dict:
+    """Same window as window_pipeline, for an artifact still buffered by the write coalescer."""
+    spec = ITEM_WINDOWS[collection]
+    items = list(doc.get(spec["list"]) or [])
+    if window["match"] is not None:
+        items = [item for item in items if item.get(spec["filter"]) == window["match"]]
+    if window["order"]:
+        def sort_key(item: dict) -> tuple:
+            key = []
+            for field, direction, default in spec["orders"][window["order"]]:
+                value = item.get(field)
+                if isinstance(default, list):
+                    value = default.index(value) if value in default else -1
+                elif value is None:
+                    value = default
+                key.append(value * direction)
+            return tuple(key)
+        items.sort(key=sort_key)
+    start = window["offset"]
+    if window["after"]:
+        ids = [item.get("id") for item in items]
+        start = ids.index(window["after"]) + 1 if window["after"] in ids else window["offset"]
+    return {"items": items[start:start + window["limit"]] if window["limit"] else items[start:],
+            "total": len(items), "start": start}
+
+async def load_window(collection: str, session_id: str, user: dict, window: dict, projection: Optional[dict]) -> Optional[dict]:
+    if window["order"] and window["order"] not in ITEM_WINDOWS[collection]["orders"]:
+        orders = ", ".join(ITEM_WINDOWS[collection]["orders"])
+        raise HTTPException(status_code=400, detail=f"Unknown order: {window['order']} (expected {orders})")
+    pending = coalescer.peek(collection, session_id) if coalescer else None
+    if pending and user["id"] in pending.get("member_ids", []):
+        doc = {**apply_projection(pending, projection), "_window": window_in_memory(collection, pending, window)}
+    else:
+        pipeline = window_pipeline(collection, session_id, user, window, projection)
+        docs = await artifact_source(collection).aggregate(pipeline).to_list(1)
+        if not docs and await restore_if_archived(session_id, user):
+            docs = await artifact_source(collection).aggregate(pipeline).to_list(1)
+        if not docs:
+            return None
+        doc = docs[0]
+    result = doc.pop("_window")
+    name = ITEM_WINDOWS[collection]["list"]
+    if not projection or name in projection:
+        doc[name] = result["items"]
+    doc["total"] = result["total"]
+    end = result["start"] + len(result["items"])
+    if result["items"] and end < result["total"]:
+        position = {"id": result["items"][-1].get("id"), "offset": end}
+        doc["next_cursor"] = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+    return doc
+
+def session_scope(session_id: str, user: dict) -> dict:
+    """Filter matching a session the user can access (uses the member_ids/id index)."""
+    return {"id": session_id, "member_ids": user["id"]}
+
+def artifact_scope(session_id: str, user: dict) -> dict:
+    return {"session_id": session_id, "member_ids": user["id"]}
+
+def embedded() -> bool:
+    return settings.storage_layout == "embedded"
+
+def artifact_source(collection: str):
+    return db.sessions if embedded() else db[collection]
+
+def artifact_match(collection: str, session_id: str, user: dict) -> list:
+    """Pipeline stages yielding the user's artifact of a session, shaped alike in both storage layouts."""
+    if embedded():
+        return embedded_view(collection, session_scope(session_id, user))
+    return [{"$match": artifact_scope(session_id, user)}]
+
+async def find_artifact(collection: str, session_id: str, user: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    if not embedded():
+        return await db[collection].find_one(artifact_scope(session_id, user), projection or {"_id": 0})
+    docs = await db.sessions.aggregate([
+        *artifact_match(collection, session_id, user),
+        {"$project": projection or {"_id": 0}},
+        {"$limit": 1}
+    ]).to_list(1)
+    return docs[0] if docs else None
+
+async def find_session(session_id: str, user: dict, projection: Optional[dict] = None) -> dict:
+    projection = {**projection, "archived_at": 1} if projection else SESSION_PROJECTION
+    session = await db.sessions.find_one(session_scope(session_id, user), projection)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if session.get("archived_at"):
+        await session_archive.restore(session_id)
+        session["archived_at"] = None
+    return session
+
+async def restore_if_archived(session_id: str, user: dict) -> bool:
+    """Restore an archived session's artifacts; False if the session is not archived."""
+    archived = await db.sessions.find_one(
+        {**session_scope(session_id, user), "archived_at": {"$ne": None}}, {"_id": 0, "id": 1}
+    )
+    return bool(archived) and await session_archive.restore(session_id)
+
+def ownership_fields(session: dict) -> dict:
+    return {"owner_id": session["owner_id"], "member_ids": session["member_ids"]}
+
+async def load_artifact(collection: str, session_id: str, user: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    if coalescer:
+        pending = coalescer.peek(collection, session_id)
+        if pending and user["id"] in pending.get("member_ids", []):
+            return apply_projection(pending, projection)
+    doc = await find_artifact(collection, session_id, user, projection)
+    if doc is None and await restore_if_archived(session_id, user):
+        doc = await find_artifact(collection, session_id, user, projection)
+    return doc
+
+async def cluster_cards(collection: str, field: str, session_id: str, user: dict, threshold: float,
+                        min_size: int, key: str, value: Optional[str]) -> Optional[ClustersResponse]:
+    """Groups the artifact's cards (those whose `key` is `value`, when given) by similar text."""
+    artifact = await load_artifact(collection, session_id, user, {"_id": 0, field: 1})
+    if artifact is None:
+        return None
+    items = artifact.get(field) or []
+    only = [item["id"] for item in items if item.get(key) == value] if value else None
+    # Off the event loop: the similarity matrix of a large board takes a noticeable fraction of a second
+    clusters, unclustered = await asyncio.to_thread(
+        card_clusters.cluster, collection, session_id, items, threshold, min_size, only
+    )
+    return ClustersResponse(session_id=session_id, threshold=threshold, clusters=clusters, unclustered_ids=unclustered)
+
+async def check_attachments(session_id: str, content: dict):
+    """Reject list items referencing attachments that were not uploaded to the session."""
+    attachment_ids = {
+        attachment_id
+        for value in content.values() if isinstance(value, list)
+        for item in value if isinstance(item, dict)
+        for attachment_id in item.get("attachment_ids") or []
+    }
+    if not attachment_ids:
+        return
+    unknown = await attachment_store.unknown(session_id, attachment_ids)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown attachments for this session: {', '.join(unknown)}")
+
+async def save_artifact(collection: str, session_id: str, fields: dict, user: dict) -> dict:
+    """Upsert the tool artifact for a session the user can access, returning the saved document."""
+    await check_attachments(session_id, fields)
+    now = datetime.now(timezone.utc).isoformat()
+    fields = {**fields, "updated_at": now}
+
+    if coalescer:
+        base = coalescer.peek(collection, session_id)
+        if base is None or user["id"] not in base.get("member_ids", []):
+            base = await find_artifact(collection, session_id, user)
+        if base is None:
+            # find_session restores an archived session, so look for its artifact again
+            session = await find_session(session_id, user, {"_id": 0, "owner_id": 1, "member_ids": 1})
+            base = await find_artifact(collection, session_id, user) or ownership_fields(session)
+        saved = await coalescer.save(collection, session_id, fields, base=base)
+        await log_change(collection, session_id, base, saved, user)
+        return saved
+    if embedded():
+        return await save_embedded_artifact(collection, session_id, fields, user)
+
+    # Common case: the artifact exists and already carries the caller's membership
+    before = await db[collection].find_one_and_update(
+        artifact_scope(session_id, user),
+        {"$set": fields, "$inc": {"revision": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        saved = {**before, **fields, "revision": before.get("revision", 0) + 1}
+        await log_change(collection, session_id, before, saved, user)
+        return saved
+
+    # First save (or a document written before ownership was denormalized)
+    session = await find_session(session_id, user, {"_id": 0, "owner_id": 1, "member_ids": 1})
+    saved = await db[collection].find_one_and_update(
+        {"session_id": session_id},
+        {
+            "$set": {**fields, **ownership_fields(session)},
+            "$inc": {"revision": 1},
+            "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}
+        },
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    await log_change(collection, session_id, None, saved, user)
+    return saved
+
+async def save_embedded_artifact(collection: str, session_id: str, fields: dict, user: dict) -> dict:
+    path = tool_path(collection)
+    before = await db.sessions.find_one_and_update(
+        {**session_scope(session_id, user), path: {"$exists": True}},
+        {"$set": {f"{path}.{k}": v for k, v in fields.items()}, "$inc": {f"{path}.revision": 1}},
+        projection={"_id": 0, "id": 1, "owner_id": 1, "member_ids": 1, path: 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before:
+        before = unembed(before, before["tools"][collection])
+        saved = {**before, **fields, "revision": before.get("revision", 0) + 1}
+        await log_change(collection, session_id, before, saved, user)
+        return saved
+
+    # First save: only succeeds if no concurrent request embedded the tool first
+    session = await find_session(session_id, user, {"_id": 0, "id": 1, "owner_id": 1, "member_ids": 1})
+    doc = {**fields, "id": str(uuid.uuid4()), "revision": 1, "created_at": fields["updated_at"]}
+    result = await db.sessions.update_one(
+        {"id": session_id, path: {"$exists": False}}, {"$set": {path: doc}}
+    )
+    if not result.modified_count:
+        return await save_embedded_artifact(collection, session_id, fields, user)
+    saved = unembed(session, doc)
+    await log_change(collection, session_id, None, saved, user)
+    return saved
+
+async def insert_artifact(collection: str, doc: dict, user: dict) -> dict:
+    session = await find_session(doc["session_id"], user, {"_id": 0, "owner_id": 1, "member_ids": 1})
+    await check_attachments(doc["session_id"], doc)
+    doc.update(ownership_fields(session))
+    if embedded():
+        await db.sessions.update_one({"id": doc["session_id"]}, {"$set": {tool_path(collection): embed(doc)}})
+    else:
+        await db[collection].insert_one(doc)
+        doc.pop("_id", None)
+    await log_change(collection, doc["session_id"], None, doc, user)
+    return doc
+
+async def log_change(collection: str, session_id: str, before: Optional[dict], after: dict, user: dict):
+    """Append the item-level diff of a write to the session's change log and activity log."""
+    changes = diff_artifact(before, after, ARTIFACT_META_FIELDS)
+    record_activity(user, session_id, collection, "create" if before is None else "update", changed_item_ids(changes))
+    if change_log is None:
+        return
+    try:
+        await change_log.record(
+            session_id,
+            collection,
+            after.get("id"),
+            after.get("revision", 0),
+            changes,
+            user["id"]
+        )
+    except Exception as e:
+        # The write itself succeeded; a lost entry shows up to clients as a gap and forces a reload
+        logger.warning(f"Change log write failed for session {session_id}: {e}")
+
+def record_activity(user: dict, session_id: Optional[str], artifact: str, operation: str,
+                    item_ids: Optional[List[str]] = None):
+    # Queued in memory and written in the background, so it costs a save nothing
+    if activity_log is not None:
+        activity_log.record(user, session_id, artifact, operation, item_ids or [])
+
+def changed_item_ids(changes: List[dict]) -> List[str]:
+    return list(dict.fromkeys(
+        c["item"]["id"] if c["op"] == "upsert" else c["id"] for c in changes if c["op"] in ("upsert", "remove")
+    ))
+
+# Artifact fields that belong to the stored copy rather than its content
+ARTIFACT_META_FIELDS = {
+    "_id", "id", "session_id", "owner_id", "member_ids", "created_at", "updated_at", "revision", "restored_at"
+}
+
+def artifact_content(doc: dict) -> dict:
+    return {k: v for k, v in doc.items() if k not in ARTIFACT_META_FIELDS}
+
+def strip_participant_content(collection: str, content: dict) -> dict:
+    """Keep the facilitator's framing of a tool and drop what participants added."""
+    content = dict(content)
+    if collection == "problem_trees":
+        content["items"] = []
+    elif collection == "empathy_maps":
+        content.update(says=[], thinks=[], does=[], feels=[])
+    elif collection == "story_maps":
+        # The activity backbone is the journey outline; tasks and stories come from the session
+        content["items"] = [item for item in content.get("items", []) if item.get("type") == "activity"]
+    elif collection == "ideas_boards":
+        content["ideas"] = []
+    else:
+        content["items"] = []
+    return content
+
+def with_new_item_ids(content: dict) -> dict:
+    """Copy list items with fresh ids, keeping problem tree parent links intact.
+
+    Attachments belong to the source session, so the copies drop their references.
+    """
+    content = dict(content)
+    for field in ("items", "ideas"):
+        if field not in content:
+            continue
+        id_map = {item["id"]: str(uuid.uuid4()) for item in content[field] if "id" in item}
+        copied = []
+        for item in content[field]:
+            item = {**item, "id": id_map.get(item.get("id"), str(uuid.uuid4()))}
+            if item.get("attachment_ids"):
+                item["attachment_ids"] = []
+            if item.get("parent_id"):
+                item["parent_id"] = id_map.get(item["parent_id"], item["parent_id"])
+            copied.append(item)
+        content[field] = copied
+    return content
+
+async def load_session_artifacts(session_id: str, user: dict) -> dict:
+    if not embedded():
+        docs = await asyncio.gather(*(load_artifact(c, session_id, user) for c in ARTIFACT_COLLECTIONS))
+        return {c: artifact_content(doc) for c, doc in zip(ARTIFACT_COLLECTIONS, docs) if doc}
+    # Every tool comes back with the one session document; read again if that restored it from the archive
+    session = await find_session(session_id, user, {"_id": 0, "id": 1, "tools": 1})
+    if "tools" not in session:
+        session = await find_session(session_id, user, {"_id": 0, "id": 1, "tools": 1})
+    tools = session.get("tools") or {}
+    if coalescer:
+        for collection in ARTIFACT_COLLECTIONS:
+            pending = coalescer.peek(collection, session_id)
+            if pending:
+                tools[collection] = pending
+    return {c: artifact_content(tools[c]) for c in ARTIFACT_COLLECTIONS if c in tools}
+
+async def create_sessions_from(source: dict, artifacts: dict, project_id: str, names: List[str], user: dict) -> List[dict]:
+    """Create one session per name with copies of the given artifact contents, written in bulk."""
+    now = datetime.now(timezone.utc).isoformat()
+    sessions = []
+    artifact_docs = {c: [] for c in artifacts}
+    artifact_ids = []
+    for name in names:
+        session_doc = {
+            "id": str(uuid.uuid4()),
+            "project_id": project_id,
+            "name": name,
+            "description": source.get("description", ""),
+            "owner_id": user["id"],
+            "member_ids": [user["id"]],
+            "current_step": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        sessions.append(session_doc)
+        copies = {
+            collection: {
+                **with_new_item_ids(content),
+                "id": str(uuid.uuid4()),
+                "session_id": session_doc["id"],
+                **ownership_fields(session_doc),
+                "revision": 0,
+                "created_at": now,
+                "updated_at": now
+            }
+            for collection, content in artifacts.items()
+        }
+        artifact_ids.append({collection: doc["id"] for collection, doc in copies.items()})
+        if embedded():
+            if copies:
+                session_doc["tools"] = {collection: embed(doc) for collection, doc in copies.items()}
+            continue
+        for collection, doc in copies.items():
+            artifact_docs[collection].append(doc)
+
+    await asyncio.gather(
+        db.sessions.insert_many(sessions, ordered=False),
+        *(db[collection].insert_many(docs, ordered=False) for collection, docs in artifact_docs.items() if docs)
+    )
+    for doc, ids in zip(sessions, artifact_ids):
+        doc.pop("_id", None)
+        doc.pop("tools", None)
+        doc["artifact_ids"] = ids
+        record_activity(user, doc["id"], "sessions", "create")
+    return sessions
+
+def copy_names(base: str, count: int) -> List[str]:
+    return [base] if count == 1 else [f"{base} {i}" for i in range(1, count + 1)]
+
+async def find_owned_project(project_id: str, user: dict) -> dict:
+    project = await db.projects.find_one({"id": project_id, "owner_id": user["id"]}, {"_id": 0, "id": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project
+
+async def ensure_indexes(database):
+    results = await asyncio.gather(
+        database.users.create_index("email", unique=True),
+        database.users.create_index("id", unique=True),
+        database.projects.create_index([("owner_id", 1), ("id", 1)]),
+        database.projects.create_index([("owner_id", 1), ("created_at", -1), ("id", -1)]),
+        database.sessions.create_index("id", unique=True),
+        database.sessions.create_index([("member_ids", 1), ("id", 1)]),
+        database.sessions.create_index([("member_ids", 1), ("project_id", 1)]),
+        database.session_templates.create_index([("owner_id", 1), ("id", 1)]),
+        *(database[collection].create_index([("session_id", 1), ("member_ids", 1)])
+          for collection in ARTIFACT_COLLECTIONS),
+        return_exceptions=True
+    )
+    # Every index is attempted; the errors name the ones that could not be built
+    failures = [str(result) for result in results if isinstance(result, Exception)]
+    if failures:
+        raise RuntimeError("; ".join(failures))
+
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/register", response_model=TokenResponse)
@@ -320,18 +1250,25 @@ async def create_project(project: ProjectCreate, current_user: dict = Depends(ge
     }
     
     await db.projects.insert_one(project_doc)
+    record_activity(current_user, None, "projects", "create", [project_id])
     return ProjectResponse(**project_doc)
 
 @api_router.get("/projects", response_model=List[ProjectResponse])
-async def get_projects(current_user: dict = Depends(get_current_user)):
-    projects = await db.projects.find({"owner_id": current_user["id"]}, {"_id": 0}).to_list(100)
+async def get_projects(fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    projection = fields_projection(fields, PartialProjectResponse)
+    projects = await db.projects.find({"owner_id": current_user["id"]}, projection or {"_id": 0}).to_list(100)
+    if projection:
+        return sparse_response(PartialProjectResponse, projects)
     return [ProjectResponse(**p) for p in projects]
 
 @api_router.get("/projects/{project_id}", response_model=ProjectResponse)
-async def get_project(project_id: str, current_user: dict = Depends(get_current_user)):
-    project = await db.projects.find_one({"id": project_id, "owner_id": current_user["id"]}, {"_id": 0})
+async def get_project(project_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    projection = fields_projection(fields, PartialProjectResponse)
+    project = await db.projects.find_one({"id": project_id, "owner_id": current_user["id"]}, projection or {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    if projection:
+        return sparse_response(PartialProjectResponse, project)
     return ProjectResponse(**project)
 
 @api_router.put("/projects/{project_id}", response_model=ProjectResponse)
@@ -344,6 +1281,7 @@ async def update_project(project_id: str, update: ProjectUpdate, current_user: d
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     await db.projects.update_one({"id": project_id}, {"$set": update_data})
+    record_activity(current_user, None, "projects", "update", [project_id])
     updated = await db.projects.find_one({"id": project_id}, {"_id": 0})
     return ProjectResponse(**updated)
 
@@ -352,9 +1290,114 @@ async def delete_project(project_id: str, current_user: dict = Depends(get_curre
     result = await db.projects.delete_one({"id": project_id, "owner_id": current_user["id"]})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
-    # Also delete related sessions and their data
-    await db.sessions.delete_many({"project_id": project_id})
-    return {"message": "Project deleted"}
+    record_activity(current_user, None, "projects", "delete", [project_id])
+    # Related sessions and their tool data are removed in the background, or right away when the
+    # queue is full: the project is already gone, so a failed request would orphan them for good
+    params = {"project_id": project_id}
+    try:
+        job = await job_runner.submit("delete_project_data", current_user["id"], params)
+    except JobQueueFull:
+        result = await delete_project_data_job({"params": params}, no_progress)
+        return {"message": "Project deleted", "job_id": None, **result}
+    return {"message": "Project deleted", "job_id": job["id"]}
+
+# ==================== DASHBOARD ROUTES ====================
+
+# Sessions listed per project on the dashboard (session_count still counts them all)
+DASHBOARD_SESSIONS = 100
+
+def dashboard_pipeline(user: dict, limit: int, after: Optional[dict]) -> list:
+    """One page of the user's projects, newest first, each with its sessions joined in."""
+    match: dict = {"owner_id": user["id"]}
+    order: list = [{"$sort": {"created_at": -1, "id": -1}}]
+    if settings.storage_encoding == "dual":
+        # While migrating, created_at and id hold strings and BSON values, which sort as separate
+        # groups; page on created_at as a date instead, with the ObjectId breaking ties
+        order = [{"$set": {"_created": {"$toDate": "$created_at"}}}]
+        if after:
+            created = datetime.fromisoformat(after["created_at"])
+            created = created.replace(microsecond=created.microsecond // 1000 * 1000)
+            position: list = [{"_created": {"$lt": created}}]
+            if after.get("oid"):
+                position.append({"_created": created, "_id": {"$lt": ObjectId(after["oid"])}})
+            order.append({"$match": {"$or": position}})
+        order.append({"$sort": {"_created": -1, "_id": -1}})
+    elif after:
+        match["$or"] = [
+            {"created_at": {"$lt": after["created_at"]}},
+            {"created_at": after["created_at"], "id": {"$lt": after["id"]}}
+        ]
+    sessions = [
+        {"$match": {"member_ids": user["id"]}},
+        # The change log counter is stamped on every artifact or step change. Its _id stays a
+        # string in every storage encoding, so compactly stored ids join on its session_id copy
+        {"$lookup": {
+            "from": "session_change_counters",
+            "localField": "id",
+            "foreignField": "_id" if settings.storage_encoding == "strings" else "session_id",
+            "as": "changes"
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "name": 1,
+            "current_step": 1,
+            "archived_at": 1,
+            "last_activity_at": {"$max": ["$updated_at", {"$first": "$changes.updated_at"}]}
+        }},
+        {"$sort": {"last_activity_at": -1}},
+        {"$group": {
+            "_id": None,
+            "session_count": {"$sum": 1},
+            "last_activity_at": {"$max": "$last_activity_at"},
+            "sessions": {"$push": "$$ROOT"}
+        }}
+    ]
+    return [
+        {"$match": match},
+        *order,
+        {"$limit": limit + 1},
+        {"$lookup": {"from": "sessions", "localField": "id", "foreignField": "project_id", "pipeline": sessions, "as": "summary"}},
+        {"$set": {"summary": {"$ifNull": [{"$first": "$summary"}, {}]}}},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "name": 1,
+            "description": 1,
+            "owner_id": 1,
+            "created_at": 1,
+            "updated_at": 1,
+            "session_count": {"$ifNull": ["$summary.session_count", 0]},
+            "last_activity_at": {"$max": ["$updated_at", "$summary.last_activity_at"]},
+            "sessions": {"$slice": [{"$ifNull": ["$summary.sessions", []]}, DASHBOARD_SESSIONS]},
+            "oid": "$_id"
+        }}
+    ]
+
+@api_router.get("/dashboard", response_model=DashboardResponse)
+async def get_dashboard(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    # Projects with their session counts, last activity and session steps in one round trip
+    after = None
+    if cursor:
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            after = {"created_at": str(position["created_at"]), "id": str(position["id"]), "oid": position.get("oid")}
+            datetime.fromisoformat(after["created_at"])
+            if after["oid"] is not None and not ObjectId.is_valid(after["oid"]):
+                raise ValueError("Invalid ObjectId")
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    projects = await db.projects.aggregate(dashboard_pipeline(current_user, limit, after)).to_list(limit + 1)
+    next_cursor = None
+    if len(projects) > limit:
+        projects = projects[:limit]
+        position = {"created_at": projects[-1]["created_at"], "id": projects[-1]["id"], "oid": str(projects[-1]["oid"])}
+        next_cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+    return DashboardResponse(projects=[DashboardProject(**p) for p in projects], next_cursor=next_cursor)
 
 # ==================== SESSION ROUTES ====================
 
@@ -373,39 +1416,209 @@ async def create_session(session: SessionCreate, current_user: dict = Depends(ge
         "project_id": session.project_id,
         "name": session.name,
         "description": session.description or "",
+        "owner_id": current_user["id"],
+        "member_ids": [current_user["id"]],
         "current_step": 0,
         "created_at": now,
         "updated_at": now
     }
     
     await db.sessions.insert_one(session_doc)
+    record_activity(current_user, session_id, "sessions", "create")
     return SessionResponse(**session_doc)
 
 @api_router.get("/sessions", response_model=List[SessionResponse])
-async def get_sessions(project_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    query = {}
+async def get_sessions(project_id: Optional[str] = None, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    projection = fields_projection(fields, PartialSessionResponse)
+    query = {"member_ids": current_user["id"]}
     if project_id:
         query["project_id"] = project_id
-    sessions = await db.sessions.find(query, {"_id": 0}).to_list(100)
+    sessions = await db.sessions.find(query, projection or SESSION_PROJECTION).to_list(100)
+    if projection:
+        return sparse_response(PartialSessionResponse, sessions)
     return [SessionResponse(**s) for s in sessions]
 
 @api_router.get("/sessions/{session_id}", response_model=SessionResponse)
-async def get_session(session_id: str, current_user: dict = Depends(get_current_user)):
-    session = await db.sessions.find_one({"id": session_id}, {"_id": 0})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def get_session(session_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    projection = fields_projection(fields, PartialSessionResponse)
+    session = await find_session(session_id, current_user, projection)
+    if projection:
+        return sparse_response(PartialSessionResponse, session)
     return SessionResponse(**session)
 
 @api_router.put("/sessions/{session_id}/step")
 async def update_session_step(session_id: str, step: int, current_user: dict = Depends(get_current_user)):
-    result = await db.sessions.update_one(
-        {"id": session_id},
-        {"$set": {"current_step": step, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    before = await db.sessions.find_one_and_update(
+        session_scope(session_id, current_user),
+        {"$set": {"current_step": step, "updated_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0, "id": 1, "current_step": 1}
     )
-    if result.matched_count == 0:
+    if not before:
         raise HTTPException(status_code=404, detail="Session not found")
+    await log_change("sessions", session_id, before, {**before, "current_step": step}, current_user)
     return {"message": "Step updated"}
 
+@api_router.get("/sessions/{session_id}/changes", response_model=SessionChangesResponse)
+async def get_session_changes(
+    session_id: str,
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=30),
+    current_user: dict = Depends(get_current_user)
+):
+    # Long-polls for up to `wait` seconds when nothing changed after `since`
+    await find_session(session_id, current_user, {"_id": 0, "id": 1})
+    budget = remaining()
+    if budget is not None:
+        # Answer (empty) before the request deadline rather than time out
+        wait = min(wait, max(budget - 1.0, 0.0))
+    result = await change_log.since(session_id, since, limit, wait)
+    if result["reset"]:
+        # The client's cursor was compacted away: send the current state to resync from
+        session = await find_session(session_id, current_user)
+        artifacts = await asyncio.gather(*(load_artifact(c, session_id, current_user) for c in ARTIFACT_COLLECTIONS))
+        result["snapshot"] = {
+            "session": SessionResponse(**session).model_dump(),
+            **{c: doc for c, doc in zip(ARTIFACT_COLLECTIONS, artifacts) if doc}
+        }
+    return SessionChangesResponse(**result)
+
+@api_router.get("/sessions/{session_id}/activity", response_model=ActivityResponse)
+async def get_session_activity(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    # Newest first; next_cursor continues with older events
+    if cursor is not None and not ObjectId.is_valid(cursor):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    await find_session(session_id, current_user, {"_id": 0, "id": 1})
+    events = await activity_log.for_session(session_id, limit, ObjectId(cursor) if cursor else None)
+    return ActivityResponse(
+        events=[
+            ActivityEvent(**{**e, "id": str(e["_id"]), "created_at": e["created_at"].replace(tzinfo=timezone.utc).isoformat()})
+            for e in events
+        ],
+        next_cursor=str(events[-1]["_id"]) if len(events) == limit else None
+    )
+
+@api_router.post("/sessions/{session_id}/members", response_model=SessionResponse)
+async def add_session_member(session_id: str, member: SessionMemberAdd, current_user: dict = Depends(get_current_user)):
+    user = await db.users.find_one({"email": member.email}, {"_id": 0, "id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await set_session_membership(session_id, {"$addToSet": {"member_ids": user["id"]}}, current_user, "add_member", user["id"])
+
+@api_router.delete("/sessions/{session_id}/members/{user_id}", response_model=SessionResponse)
+async def remove_session_member(session_id: str, user_id: str, current_user: dict = Depends(get_current_user)):
+    if user_id == current_user["id"]:
+        raise HTTPException(status_code=400, detail="The session owner cannot be removed")
+    return await set_session_membership(session_id, {"$pull": {"member_ids": user_id}}, current_user, "remove_member", user_id)
+
+async def set_session_membership(session_id: str, update: dict, current_user: dict, operation: str, member_id: str) -> SessionResponse:
+    # Only the owner manages membership; artifacts carry a copy of the list
+    session = await db.sessions.find_one_and_update(
+        {"id": session_id, "owner_id": current_user["id"]},
+        update,
+        projection=SESSION_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not embedded():
+        await asyncio.gather(*(
+            db[collection].update_many({"session_id": session_id}, {"$set": ownership_fields(session)})
+            for collection in ARTIFACT_COLLECTIONS
+        ))
+    if coalescer:
+        coalescer.refresh(session_id, ownership_fields(session))
+    record_activity(current_user, session_id, "sessions", operation, [member_id])
+    return SessionResponse(**session)
+
+@api_router.post("/sessions/{session_id}/clone", response_model=List[SessionResponse])
+async def clone_session(session_id: str, clone: SessionClone, current_user: dict = Depends(get_current_user)):
+    source, artifacts = await asyncio.gather(
+        find_session(session_id, current_user),
+        load_session_artifacts(session_id, current_user)
+    )
+    project_id = clone.project_id or source["project_id"]
+    await find_owned_project(project_id, current_user)
+    if clone.strip_content:
+        artifacts = {c: strip_participant_content(c, content) for c, content in artifacts.items()}
+    sessions = await create_sessions_from(
+        source, artifacts, project_id, copy_names(clone.name or f"{source['name']} (copy)", clone.count), current_user
+    )
+    return [SessionResponse(**s) for s in sessions]
+
+@api_router.post("/sessions/bulk", response_model=List[WorkshopSessionResponse])
+async def create_workshop_sessions(workshop: WorkshopCreate, current_user: dict = Depends(get_current_user)):
+    # One session per breakout group, each with its own copy of the seeded tools
+    await find_owned_project(workshop.project_id, current_user)
+    artifacts = {
+        collection: seed.model_dump()
+        for collection in ARTIFACT_COLLECTIONS
+        if (seed := getattr(workshop, collection)) is not None
+    }
+    sessions = await create_sessions_from(
+        {"description": workshop.description or ""}, artifacts, workshop.project_id,
+        workshop.names or copy_names(workshop.name, workshop.count), current_user
+    )
+    return [WorkshopSessionResponse(**s) for s in sessions]
+
+# ==================== SESSION TEMPLATE ROUTES ====================
+
+@api_router.post("/templates", response_model=SessionTemplateResponse)
+async def create_session_template(template: SessionTemplateCreate, current_user: dict = Depends(get_current_user)):
+    source, artifacts = await asyncio.gather(
+        find_session(template.session_id, current_user),
+        load_session_artifacts(template.session_id, current_user)
+    )
+    if template.strip_content:
+        artifacts = {c: strip_participant_content(c, content) for c, content in artifacts.items()}
+    now = datetime.now(timezone.utc).isoformat()
+    template_doc = {
+        "id": str(uuid.uuid4()),
+        "name": template.name,
+        "description": template.description or source.get("description", ""),
+        "owner_id": current_user["id"],
+        "tools": list(artifacts),
+        "artifacts": artifacts,
+        "created_at": now,
+        "updated_at": now
+    }
+    await db.session_templates.insert_one(template_doc)
+    record_activity(current_user, template.session_id, "templates", "create", [template_doc["id"]])
+    return SessionTemplateResponse(**template_doc)
+
+@api_router.get("/templates", response_model=List[SessionTemplateResponse])
+async def get_session_templates(current_user: dict = Depends(get_current_user)):
+    templates = await db.session_templates.find(
+        {"owner_id": current_user["id"]}, {"_id": 0, "artifacts": 0}
+    ).to_list(100)
+    return [SessionTemplateResponse(**t) for t in templates]
+
+@api_router.delete("/templates/{template_id}")
+async def delete_session_template(template_id: str, current_user: dict = Depends(get_current_user)):
+    result = await db.session_templates.delete_one({"id": template_id, "owner_id": current_user["id"]})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Template not found")
+    record_activity(current_user, None, "templates", "delete", [template_id])
+    return {"message": "Template deleted"}
+
+@api_router.post("/templates/{template_id}/sessions", response_model=List[SessionResponse])
+async def create_sessions_from_template(template_id: str, data: SessionTemplateInstantiate, current_user: dict = Depends(get_current_user)):
+    template, _ = await asyncio.gather(
+        db.session_templates.find_one({"id": template_id, "owner_id": current_user["id"]}, {"_id": 0}),
+        find_owned_project(data.project_id, current_user)
+    )
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    sessions = await create_sessions_from(
+        template, template["artifacts"], data.project_id, copy_names(data.name or template["name"], data.count), current_user
+    )
+    return [SessionResponse(**s) for s in sessions]
+
 # ==================== PROBLEM TREE ROUTES ====================
 
 @api_router.post("/problem-trees", response_model=ProblemTreeResponse)
@@ -422,45 +1635,25 @@ async def create_problem_tree(data: ProblemTreeCreate, current_user: dict = Depe
         "updated_at": now
     }
     
-    await db.problem_trees.insert_one(tree_doc)
+    await insert_artifact("problem_trees", tree_doc, current_user)
     return ProblemTreeResponse(**tree_doc)
 
 @api_router.get("/problem-trees/{session_id}", response_model=ProblemTreeResponse)
-async def get_problem_tree(session_id: str, current_user: dict = Depends(get_current_user)):
-    tree = await db.problem_trees.find_one({"session_id": session_id}, {"_id": 0})
+async def get_problem_tree(session_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    projection = fields_projection(fields, PartialProblemTreeResponse)
+    tree = await load_artifact("problem_trees", session_id, current_user, projection)
     if not tree:
         raise HTTPException(status_code=404, detail="Problem tree not found")
+    if projection:
+        return sparse_response(PartialProblemTreeResponse, tree)
     return ProblemTreeResponse(**tree)
 
 @api_router.put("/problem-trees/{session_id}", response_model=ProblemTreeResponse)
 async def update_problem_tree(session_id: str, data: ProblemTreeCreate, current_user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    tree_id = str(uuid.uuid4())
-    
-    # Check if exists
-    existing = await db.problem_trees.find_one({"session_id": session_id}, {"_id": 0})
-    
-    if existing:
-        await db.problem_trees.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "core_problem": data.core_problem,
-                "items": [item.model_dump() for item in data.items],
-                "updated_at": now
-            }}
-        )
-    else:
-        tree_doc = {
-            "id": tree_id,
-            "session_id": session_id,
-            "core_problem": data.core_problem,
-            "items": [item.model_dump() for item in data.items],
-            "created_at": now,
-            "updated_at": now
-        }
-        await db.problem_trees.insert_one(tree_doc)
-    
-    tree = await db.problem_trees.find_one({"session_id": session_id}, {"_id": 0})
+    tree = await save_artifact("problem_trees", session_id, {
+        "core_problem": data.core_problem,
+        "items": [item.model_dump() for item in data.items]
+    }, current_user)
     return ProblemTreeResponse(**tree)
 
 # ==================== EMPATHY MAP ROUTES ====================
@@ -482,50 +1675,28 @@ async def create_empathy_map(data: EmpathyMapCreate, current_user: dict = Depend
         "updated_at": now
     }
     
-    await db.empathy_maps.insert_one(map_doc)
+    await insert_artifact("empathy_maps", map_doc, current_user)
     return EmpathyMapResponse(**map_doc)
 
 @api_router.get("/empathy-maps/{session_id}", response_model=EmpathyMapResponse)
-async def get_empathy_map(session_id: str, current_user: dict = Depends(get_current_user)):
-    emp_map = await db.empathy_maps.find_one({"session_id": session_id}, {"_id": 0})
+async def get_empathy_map(session_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    projection = fields_projection(fields, PartialEmpathyMapResponse)
+    emp_map = await load_artifact("empathy_maps", session_id, current_user, projection)
     if not emp_map:
         raise HTTPException(status_code=404, detail="Empathy map not found")
+    if projection:
+        return sparse_response(PartialEmpathyMapResponse, emp_map)
     return EmpathyMapResponse(**emp_map)
 
 @api_router.put("/empathy-maps/{session_id}", response_model=EmpathyMapResponse)
 async def update_empathy_map(session_id: str, data: EmpathyMapCreate, current_user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    map_id = str(uuid.uuid4())
-    
-    existing = await db.empathy_maps.find_one({"session_id": session_id}, {"_id": 0})
-    
-    if existing:
-        await db.empathy_maps.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "persona_name": data.persona_name or "User",
-                "says": data.says,
-                "thinks": data.thinks,
-                "does": data.does,
-                "feels": data.feels,
-                "updated_at": now
-            }}
-        )
-    else:
-        map_doc = {
-            "id": map_id,
-            "session_id": session_id,
-            "persona_name": data.persona_name or "User",
-            "says": data.says,
-            "thinks": data.thinks,
-            "does": data.does,
-            "feels": data.feels,
-            "created_at": now,
-            "updated_at": now
-        }
-        await db.empathy_maps.insert_one(map_doc)
-    
-    emp_map = await db.empathy_maps.find_one({"session_id": session_id}, {"_id": 0})
+    emp_map = await save_artifact("empathy_maps", session_id, {
+        "persona_name": data.persona_name or "User",
+        "says": data.says,
+        "thinks": data.thinks,
+        "does": data.does,
+        "feels": data.feels
+    }, current_user)
     return EmpathyMapResponse(**emp_map)
 
 # ==================== STORY MAP ROUTES ====================
@@ -544,44 +1715,36 @@ async def create_story_map(data: StoryMapCreate, current_user: dict = Depends(ge
         "updated_at": now
     }
     
-    await db.story_maps.insert_one(map_doc)
+    await insert_artifact("story_maps", map_doc, current_user)
     return StoryMapResponse(**map_doc)
 
 @api_router.get("/story-maps/{session_id}", response_model=StoryMapResponse)
-async def get_story_map(session_id: str, current_user: dict = Depends(get_current_user)):
-    story_map = await db.story_maps.find_one({"session_id": session_id}, {"_id": 0})
+async def get_story_map(
+    session_id: str,
+    fields: Optional[str] = None,
+    item_type: Optional[str] = Query(None, alias="type"),
+    window: dict = Depends(item_window),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = fields_projection(fields, PartialStoryMapResponse)
+    if windowed(window, item_type):
+        story_map = await load_window("story_maps", session_id, current_user, window, projection)
+        if not story_map:
+            raise HTTPException(status_code=404, detail="Story map not found")
+        return sparse_response(WindowedStoryMapResponse, story_map)
+    story_map = await load_artifact("story_maps", session_id, current_user, projection)
     if not story_map:
         raise HTTPException(status_code=404, detail="Story map not found")
+    if projection:
+        return sparse_response(PartialStoryMapResponse, story_map)
     return StoryMapResponse(**story_map)
 
 @api_router.put("/story-maps/{session_id}", response_model=StoryMapResponse)
 async def update_story_map(session_id: str, data: StoryMapCreate, current_user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    map_id = str(uuid.uuid4())
-    
-    existing = await db.story_maps.find_one({"session_id": session_id}, {"_id": 0})
-    
-    if existing:
-        await db.story_maps.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "title": data.title or "User Journey",
-                "items": [item.model_dump() for item in data.items],
-                "updated_at": now
-            }}
-        )
-    else:
-        map_doc = {
-            "id": map_id,
-            "session_id": session_id,
-            "title": data.title or "User Journey",
-            "items": [item.model_dump() for item in data.items],
-            "created_at": now,
-            "updated_at": now
-        }
-        await db.story_maps.insert_one(map_doc)
-    
-    story_map = await db.story_maps.find_one({"session_id": session_id}, {"_id": 0})
+    story_map = await save_artifact("story_maps", session_id, {
+        "title": data.title or "User Journey",
+        "items": [item.model_dump() for item in data.items]
+    }, current_user)
     return StoryMapResponse(**story_map)
 
 # ==================== IDEAS BOARD ROUTES ====================
@@ -599,42 +1762,48 @@ async def create_ideas_board(data: IdeasBoardCreate, current_user: dict = Depend
         "updated_at": now
     }
     
-    await db.ideas_boards.insert_one(board_doc)
+    await insert_artifact("ideas_boards", board_doc, current_user)
     return IdeasBoardResponse(**board_doc)
 
 @api_router.get("/ideas-boards/{session_id}", response_model=IdeasBoardResponse)
-async def get_ideas_board(session_id: str, current_user: dict = Depends(get_current_user)):
-    board = await db.ideas_boards.find_one({"session_id": session_id}, {"_id": 0})
+async def get_ideas_board(
+    session_id: str,
+    fields: Optional[str] = None,
+    category: Optional[str] = None,
+    window: dict = Depends(item_window),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = fields_projection(fields, PartialIdeasBoardResponse)
+    if windowed(window, category):
+        board = await load_window("ideas_boards", session_id, current_user, window, projection)
+        if not board:
+            raise HTTPException(status_code=404, detail="Ideas board not found")
+        return sparse_response(WindowedIdeasBoardResponse, board)
+    board = await load_artifact("ideas_boards", session_id, current_user, projection)
     if not board:
         raise HTTPException(status_code=404, detail="Ideas board not found")
+    if projection:
+        return sparse_response(PartialIdeasBoardResponse, board)
     return IdeasBoardResponse(**board)
 
+@api_router.get("/ideas-boards/{session_id}/clusters", response_model=ClustersResponse)
+async def get_ideas_board_clusters(
+    session_id: str,
+    threshold: float = Query(0.35, gt=0, le=1),
+    min_size: int = Query(2, ge=1),
+    category: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    clusters = await cluster_cards("ideas_boards", "ideas", session_id, current_user, threshold, min_size, "category", category)
+    if clusters is None:
+        raise HTTPException(status_code=404, detail="Ideas board not found")
+    return clusters
+
 @api_router.put("/ideas-boards/{session_id}", response_model=IdeasBoardResponse)
 async def update_ideas_board(session_id: str, data: IdeasBoardCreate, current_user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    board_id = str(uuid.uuid4())
-    
-    existing = await db.ideas_boards.find_one({"session_id": session_id}, {"_id": 0})
-    
-    if existing:
-        await db.ideas_boards.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "ideas": [idea.model_dump() for idea in data.ideas],
-                "updated_at": now
-            }}
-        )
-    else:
-        board_doc = {
-            "id": board_id,
-            "session_id": session_id,
-            "ideas": [idea.model_dump() for idea in data.ideas],
-            "created_at": now,
-            "updated_at": now
-        }
-        await db.ideas_boards.insert_one(board_doc)
-    
-    board = await db.ideas_boards.find_one({"session_id": session_id}, {"_id": 0})
+    board = await save_artifact("ideas_boards", session_id, {
+        "ideas": [idea.model_dump() for idea in data.ideas]
+    }, current_user)
     return IdeasBoardResponse(**board)
 
 # ==================== FEEDBACK (I LIKE I WISH WHAT IF) ROUTES ====================
@@ -652,42 +1821,48 @@ async def create_feedback(data: FeedbackCreate, current_user: dict = Depends(get
         "updated_at": now
     }
     
-    await db.feedback.insert_one(feedback_doc)
+    await insert_artifact("feedback", feedback_doc, current_user)
     return FeedbackResponse(**feedback_doc)
 
 @api_router.get("/feedback/{session_id}", response_model=FeedbackResponse)
-async def get_feedback(session_id: str, current_user: dict = Depends(get_current_user)):
-    feedback = await db.feedback.find_one({"session_id": session_id}, {"_id": 0})
+async def get_feedback(
+    session_id: str,
+    fields: Optional[str] = None,
+    item_type: Optional[str] = Query(None, alias="type"),
+    window: dict = Depends(item_window),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = fields_projection(fields, PartialFeedbackResponse)
+    if windowed(window, item_type):
+        feedback = await load_window("feedback", session_id, current_user, window, projection)
+        if not feedback:
+            raise HTTPException(status_code=404, detail="Feedback not found")
+        return sparse_response(WindowedFeedbackResponse, feedback)
+    feedback = await load_artifact("feedback", session_id, current_user, projection)
     if not feedback:
         raise HTTPException(status_code=404, detail="Feedback not found")
+    if projection:
+        return sparse_response(PartialFeedbackResponse, feedback)
     return FeedbackResponse(**feedback)
 
+@api_router.get("/feedback/{session_id}/clusters", response_model=ClustersResponse)
+async def get_feedback_clusters(
+    session_id: str,
+    threshold: float = Query(0.35, gt=0, le=1),
+    min_size: int = Query(2, ge=1),
+    item_type: Optional[str] = Query(None, alias="type"),
+    current_user: dict = Depends(get_current_user)
+):
+    clusters = await cluster_cards("feedback", "items", session_id, current_user, threshold, min_size, "type", item_type)
+    if clusters is None:
+        raise HTTPException(status_code=404, detail="Feedback not found")
+    return clusters
+
 @api_router.put("/feedback/{session_id}", response_model=FeedbackResponse)
 async def update_feedback(session_id: str, data: FeedbackCreate, current_user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    feedback_id = str(uuid.uuid4())
-    
-    existing = await db.feedback.find_one({"session_id": session_id}, {"_id": 0})
-    
-    if existing:
-        await db.feedback.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "items": [item.model_dump() for item in data.items],
-                "updated_at": now
-            }}
-        )
-    else:
-        feedback_doc = {
-            "id": feedback_id,
-            "session_id": session_id,
-            "items": [item.model_dump() for item in data.items],
-            "created_at": now,
-            "updated_at": now
-        }
-        await db.feedback.insert_one(feedback_doc)
-    
-    feedback = await db.feedback.find_one({"session_id": session_id}, {"_id": 0})
+    feedback = await save_artifact("feedback", session_id, {
+        "items": [item.model_dump() for item in data.items]
+    }, current_user)
     return FeedbackResponse(**feedback)
 
 # ==================== EXPECTATIONS ROUTES ====================
@@ -705,43 +1880,320 @@ async def create_expectations(data: ExpectationsCreate, current_user: dict = Dep
         "updated_at": now
     }
     
-    await db.expectations.insert_one(exp_doc)
+    await insert_artifact("expectations", exp_doc, current_user)
     return ExpectationsResponse(**exp_doc)
 
 @api_router.get("/expectations/{session_id}", response_model=ExpectationsResponse)
-async def get_expectations(session_id: str, current_user: dict = Depends(get_current_user)):
-    expectations = await db.expectations.find_one({"session_id": session_id}, {"_id": 0})
+async def get_expectations(
+    session_id: str,
+    fields: Optional[str] = None,
+    item_type: Optional[str] = Query(None, alias="type"),
+    window: dict = Depends(item_window),
+    current_user: dict = Depends(get_current_user)
+):
+    projection = fields_projection(fields, PartialExpectationsResponse)
+    if windowed(window, item_type):
+        expectations = await load_window("expectations", session_id, current_user, window, projection)
+        if not expectations:
+            raise HTTPException(status_code=404, detail="Expectations not found")
+        return sparse_response(WindowedExpectationsResponse, expectations)
+    expectations = await load_artifact("expectations", session_id, current_user, projection)
     if not expectations:
         raise HTTPException(status_code=404, detail="Expectations not found")
+    if projection:
+        return sparse_response(PartialExpectationsResponse, expectations)
     return ExpectationsResponse(**expectations)
 
 @api_router.put("/expectations/{session_id}", response_model=ExpectationsResponse)
 async def update_expectations(session_id: str, data: ExpectationsCreate, current_user: dict = Depends(get_current_user)):
-    now = datetime.now(timezone.utc).isoformat()
-    exp_id = str(uuid.uuid4())
-    
-    existing = await db.expectations.find_one({"session_id": session_id}, {"_id": 0})
-    
-    if existing:
-        await db.expectations.update_one(
-            {"session_id": session_id},
-            {"$set": {
-                "items": [item.model_dump() for item in data.items],
-                "updated_at": now
-            }}
+    expectations = await save_artifact("expectations", session_id, {
+        "items": [item.model_dump() for item in data.items]
+    }, current_user)
+    return ExpectationsResponse(**expectations)
+
+# ==================== ATTACHMENT ROUTES ====================
+
+def attachment_response(record: dict) -> AttachmentResponse:
+    url = f"{api_router.prefix}/attachments/{record['id']}"
+    return AttachmentResponse(**record, url=url, thumbnail_url=f"{url}/thumbnail" if record.get("has_thumbnail") else None)
+
+async def find_attachment(attachment_id: str, user: dict) -> dict:
+    record = await attachment_store.get(attachment_id)
+    if record is None or record["file_id"] is None or not await db.sessions.find_one(
+        session_scope(record["session_id"], user), {"_id": 0, "id": 1}
+    ):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return record
+
+async def download_attachment(request: Request, file_id, etag: str, content_type: str, filename: str) -> Response:
+    # Stored content never changes under an id, so clients may cache it for good
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+        "Content-Disposition": 'inline; filename="{}"'.format(filename.encode("ascii", "ignore").decode().replace('"', "")),
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    stream = await attachment_store.open(file_id)
+    start, end, status_code = 0, stream.length - 1, 200
+    byte_range = request.headers.get("range")
+    if byte_range and request.headers.get("if-range", etag) == etag:
+        try:
+            start, end = parse_range(byte_range, stream.length)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stream.length}"})
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{stream.length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(stream_range(stream, start, end), status_code=status_code, media_type=content_type, headers=headers)
+
+@api_router.post("/sessions/{session_id}/attachments", response_model=AttachmentResponse)
+async def upload_attachment(
+    session_id: str,
+    request: Request,
+    filename: str = Query("image", min_length=1, max_length=255),
+    current_user: dict = Depends(get_current_user)
+):
+    # The request body is the raw image, streamed into storage rather than buffered
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in IMAGE_TYPES:
+        raise HTTPException(status_code=415, detail=f"Unsupported attachment type (expected {', '.join(IMAGE_TYPES)})")
+    too_large = HTTPException(status_code=413, detail=f"Attachments are limited to {settings.attachment_max_mb}MB")
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > settings.attachment_max_mb * 1024 * 1024:
+        raise too_large
+    await find_session(session_id, current_user, {"_id": 0, "id": 1})
+    try:
+        record = await attachment_store.save(request.stream(), session_id, filename, content_type, current_user["id"])
+    except AttachmentTooLarge:
+        raise too_large
+    record_activity(current_user, session_id, "attachments", "create", [record["id"]])
+    return attachment_response(record)
+
+@api_router.get("/sessions/{session_id}/attachments", response_model=List[AttachmentResponse])
+async def get_session_attachments(session_id: str, current_user: dict = Depends(get_current_user)):
+    await find_session(session_id, current_user, {"_id": 0, "id": 1})
+    return [attachment_response(r) for r in await attachment_store.for_session(session_id)]
+
+@api_router.get("/attachments/{attachment_id}")
+async def get_attachment(attachment_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    record = await find_attachment(attachment_id, current_user)
+    return await download_attachment(
+        request, record["file_id"], f'"{record["sha256"]}"', record["content_type"], record["filename"]
+    )
+
+@api_router.get("/attachments/{attachment_id}/thumbnail")
+async def get_attachment_thumbnail(attachment_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    record = await find_attachment(attachment_id, current_user)
+    if record["thumbnail_id"] is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not available")
+    return await download_attachment(
+        request, record["thumbnail_id"], f'"{record["sha256"]}-thumbnail"', "image/jpeg", f"thumbnail-{record['filename']}"
+    )
+
+@api_router.delete("/attachments/{attachment_id}")
+async def delete_attachment(attachment_id: str, current_user: dict = Depends(get_current_user)):
+    record = await find_attachment(attachment_id, current_user)
+    if current_user["id"] != record["owner_id"] and not await db.sessions.find_one(
+        {"id": record["session_id"], "owner_id": current_user["id"]}, {"_id": 0, "id": 1}
+    ):
+        raise HTTPException(status_code=403, detail="Only the uploader or the session owner can delete an attachment")
+    await attachment_store.delete(attachment_id)
+    record_activity(current_user, record["session_id"], "attachments", "delete", [attachment_id])
+    return {"message": "Attachment deleted"}
+
+# ==================== BATCH ROUTES ====================
+
+@api_router.post("/batch", response_model=List[BatchResult])
+async def batch(batch_request: BatchRequest, request: Request, current_user: dict = Depends(get_current_user)):
+    operations = [op.model_dump() for op in batch_request.operations]
+    for op in operations:
+        if targets_batch(op["path"]):
+            raise HTTPException(status_code=400, detail="Batches cannot be nested")
+    try:
+        results = await run_batch(
+            request.app, request.scope, api_router.prefix, operations, {"batch_user": current_user}
         )
-    else:
-        exp_doc = {
-            "id": exp_id,
-            "session_id": session_id,
-            "items": [item.model_dump() for item in data.items],
-            "created_at": now,
-            "updated_at": now
+    except BatchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [BatchResult(**r) for r in results]
+
+# ==================== BACKGROUND JOBS ====================
+
+async def export_project_job(job: dict, progress: Progress) -> dict:
+    project_id = job["params"]["project_id"]
+    project = await db.projects.find_one({"id": project_id, "owner_id": job["owner_id"]}, {"_id": 0})
+    if not project:
+        raise ValueError("Project not found")
+    sessions = await db.sessions.find({"project_id": project_id}, {"_id": 0}).to_list(None)
+    for i, session in enumerate(sessions):
+        if session.get("archived_at"):
+            session["tools"] = await session_archive.load(session["id"]) or {}
+        elif embedded():
+            session["tools"] = {c: unembed(session, doc) for c, doc in (session.get("tools") or {}).items()}
+        else:
+            docs = await asyncio.gather(*(
+                db[c].find_one({"session_id": session["id"]}, {"_id": 0}) for c in ARTIFACT_COLLECTIONS
+            ))
+            session["tools"] = {c: doc for c, doc in zip(ARTIFACT_COLLECTIONS, docs) if doc}
+        if i % 10 == 9:
+            await progress((i + 1) / (len(sessions) + 1))
+
+    data = json.dumps({"project": project, "sessions": sessions}).encode("utf-8")
+    filename = f"project-{project_id}.json"
+    file_id = await job_results.upload_from_stream(
+        filename, data, metadata={"job_id": job["id"], "owner_id": job["owner_id"], "content_type": "application/json"}
+    )
+    return {
+        "file_id": str(file_id),
+        "filename": filename,
+        "size": len(data),
+        "location": f"/api/jobs/{job['id']}/result"
+    }
+
+async def no_progress(fraction: float):
+    pass
+
+async def delete_project_data_job(job: dict, progress: Progress) -> dict:
+    project_id = job["params"]["project_id"]
+    total = await db.sessions.count_documents({"project_id": project_id})
+    deleted = 0
+    while True:
+        batch = await db.sessions.find({"project_id": project_id}, {"_id": 0, "id": 1}).to_list(500)
+        if not batch:
+            break
+        session_ids = [s["id"] for s in batch]
+        await asyncio.gather(*(
+            db[c].delete_many({"session_id": {"$in": session_ids}}) for c in ARTIFACT_COLLECTIONS
+        ))
+        await db.sessions.delete_many({"id": {"$in": session_ids}})
+        await change_log.forget(session_ids)
+        await session_archive.forget(session_ids)
+        await attachment_store.forget(session_ids)
+        await activity_log.forget(session_ids)
+        deleted += len(session_ids)
+        await progress(deleted / max(total, 1))
+    return {"sessions_deleted": deleted}
+
+async def archive_sessions_job(job: dict, progress: Progress) -> dict:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=job["params"]["idle_days"])
+    stats = await session_archive.archive_idle(cutoff.isoformat(), settings.archive_batch_size, progress)
+    logger.info(f"Archived {stats['sessions_archived']} sessions: {stats['bytes_before']} bytes moved, "
+                f"{stats['bytes_after']} bytes stored")
+    return stats
+
+JOB_HANDLERS = {
+    "export_project": export_project_job,
+    "delete_project_data": delete_project_data_job,
+    "archive_sessions": archive_sessions_job,
+}
+
+async def submit_job(kind: str, user: dict, params: dict) -> dict:
+    try:
+        return await job_runner.submit(kind, user["id"], params)
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Too many background jobs queued, try again shortly")
+
+# ==================== JOB ROUTES ====================
+
+@api_router.post("/projects/{project_id}/export", response_model=JobResponse, status_code=202)
+async def export_project(project_id: str, current_user: dict = Depends(get_current_user)):
+    await find_owned_project(project_id, current_user)
+    job = await submit_job("export_project", current_user, {"project_id": project_id})
+    return JobResponse(**job)
+
+@api_router.get("/jobs", response_model=List[JobResponse])
+async def get_jobs(current_user: dict = Depends(get_current_user)):
+    jobs = await db.jobs.find({"owner_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1).to_list(50)
+    return [JobResponse(**j) for j in jobs]
+
+@api_router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await job_runner.get(job_id, current_user["id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(**job)
+
+@api_router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+async def cancel_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await job_runner.cancel(job_id, current_user["id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(**job)
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await job_runner.get(job_id, current_user["id"])
+    if not job or job["status"] != "done" or not (job.get("result") or {}).get("file_id"):
+        raise HTTPException(status_code=404, detail="Job result not found")
+    stream = await job_results.open_download_stream(ObjectId(job["result"]["file_id"]))
+
+    async def chunks():
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            yield chunk
+
+    return StreamingResponse(
+        chunks(),
+        media_type=(stream.metadata or {}).get("content_type", "application/octet-stream"),
+        headers={
+            "Content-Length": str(stream.length),
+            "Content-Disposition": f'attachment; filename="{stream.filename}"'
         }
-        await db.expectations.insert_one(exp_doc)
-    
-    expectations = await db.expectations.find_one({"session_id": session_id}, {"_id": 0})
-    return ExpectationsResponse(**expectations)
+    )
+
+# ==================== ADMIN ROUTES ====================
+
+@api_router.post("/admin/profile", response_model=ProfileResponse)
+async def profile_worker(profile: ProfileRequest, format: str = "json", admin: dict = Depends(require_admin)):
+    # Samples this worker's stacks for `seconds`, or until `requests` calls to `route` complete
+    route = None
+    if profile.route is not None:
+        method = profile.method.upper()
+        route = next((r for r in api_router.routes if r.path == profile.route and method in r.methods), None)
+        if route is None:
+            raise HTTPException(status_code=404, detail=f"Route not found: {method} {profile.route}")
+        if not profile.requests:
+            raise HTTPException(status_code=400, detail="requests is required when profiling a route")
+    elif not profile.seconds:
+        raise HTTPException(status_code=400, detail="Either seconds or route and requests are required")
+    try:
+        result = await profiler.run(
+            seconds=profile.seconds,
+            route=route,
+            method=profile.method,
+            requests=profile.requests,
+            interval_ms=profile.interval_ms,
+            include_idle=profile.include_idle
+        )
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+    logger.info(f"Profile taken by {admin['email']}: {result['samples']} samples over {result['elapsed_seconds']}s")
+    if format == "collapsed":
+        # Feed straight to flamegraph.pl / speedscope
+        return Response(
+            content=result["collapsed"] + "\n",
+            media_type="text/plain",
+            headers={"Content-Disposition": 'attachment; filename="profile.folded"'}
+        )
+    return ProfileResponse(**result)
+
+@api_router.get("/admin/load", response_model=LoadResponse)
+async def get_load(admin: dict = Depends(require_admin)):
+    return LoadResponse(**load_monitor.snapshot())
+
+@api_router.post("/admin/archive", response_model=JobResponse, status_code=202)
+async def archive_idle_sessions(archive: ArchiveRequest, admin: dict = Depends(require_admin)):
+    job = await submit_job("archive_sessions", admin, {"idle_days": archive.idle_days or settings.archive_idle_days})
+    return JobResponse(**job)
+
+@api_router.get("/admin/archive", response_model=ArchiveStatsResponse)
+async def get_archive_stats(admin: dict = Depends(require_admin)):
+    return ArchiveStatsResponse(**await session_archive.stats())
 
 # ==================== HEALTH CHECK ====================
 
@@ -749,16 +2201,7 @@ async def update_expectations(session_id: str, data: ExpectationsCreate, current
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
-# Include router and setup middleware
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# ==================== APP FACTORY ====================
 
 # Configure logging
 logging.basicConfig(
@@ -767,6 +2210,179 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+async def warm_up(app: FastAPI):
+    """Build schemas and open pooled connections before the first request arrives."""
+    app.openapi()
+    for route in api_router.routes:
+        if getattr(route, "response_model", None) is not None and hasattr(route.response_model, "model_json_schema"):
+            route.response_model.model_json_schema()
+    try:
+        # Each concurrent ping checks out its own connection, filling the pool up to min size
+        await asyncio.gather(*(db.command("ping") for _ in range(max(1, settings.mongo_min_pool_size))))
+    except Exception as e:
+        logger.warning(f"MongoDB warm-up failed, continuing without it: {e}")
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API with its middleware; the lifespan connects to MongoDB and starts the workers.
+
+    The lifespan installs its clients and stores as this module's globals, which the routes
+    read, so only one app can run per process: starting a second while another is running
+    raises RuntimeError. Apps may be created and run one after another (as the tests do), and
+    launcher.py runs more workers as separate processes.
+    """
+    app_settings = app_settings or Settings.from_env()
+    if app_settings.storage_layout not in LAYOUTS:
+        raise ValueError(f"Unknown storage layout: {app_settings.storage_layout}")
+    if app_settings.storage_layout in EXPERIMENTAL_LAYOUTS:
+        if not app_settings.storage_layout_experimental:
+            raise ValueError(f"Storage layout {app_settings.storage_layout} has not been benchmarked against MongoDB yet "
+                             f"(see bench_layout.py); set STORAGE_LAYOUT_EXPERIMENTAL=true to use it anyway")
+        logger.warning(f"Using experimental storage layout: {app_settings.storage_layout}")
+    if app_settings.storage_encoding not in ENCODINGS:
+        raise ValueError(f"Unknown storage encoding: {app_settings.storage_encoding}")
+    trace_exporter = FileExporter(app_settings.trace_export_path) if app_settings.trace_export_path else None
+    monitor = LoadMonitor(max_in_flight=app_settings.max_in_flight, max_loop_lag_ms=app_settings.max_loop_lag_ms)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        global _running_app
+        if _running_app is not None:
+            raise RuntimeError("Another app is already running in this process; its routes share module state, "
+                               "so run one app per process (launcher.py starts a process per worker)")
+        _running_app = app
+        try:
+            async with serve(app):
+                yield
+        finally:
+            _running_app = None
+
+    @asynccontextmanager
+    async def serve(app: FastAPI):
+        global settings, client, db, coalescer, idempotency_store, job_runner, job_results, change_log, session_archive
+        global load_monitor, attachment_store, card_clusters, activity_log
+        started = time.perf_counter()
+        settings = app_settings
+        load_monitor = monitor
+        client = AsyncIOMotorClient(
+            settings.mongo_url,
+            minPoolSize=settings.mongo_min_pool_size,
+            maxPoolSize=settings.mongo_max_pool_size,
+            waitQueueTimeoutMS=settings.mongo_wait_queue_timeout_ms or None,
+            event_listeners=[MongoCommandListener()]
+        )
+        database = client[settings.db_name]
+        db = encoded_database(database, settings.storage_encoding, ENCODED_COLLECTIONS)
+        idempotency_store = IdempotencyStore(db.idempotency_keys, ttl_seconds=settings.idempotency_ttl_hours * 3600)
+        job_results = AsyncIOMotorGridFSBucket(database, bucket_name="job_results")
+        job_runner = JobRunner(db.jobs, workers=settings.job_workers, queue_size=settings.job_queue_size)
+        for kind, handler in JOB_HANDLERS.items():
+            job_runner.register(kind, handler)
+        change_log = ChangeLog(
+            db,
+            retention_seconds=settings.change_log_retention_hours * 3600,
+            max_entries=settings.change_log_max_entries
+        )
+        session_archive = SessionArchive(db, ARTIFACT_COLLECTIONS, embedded=embedded())
+        attachment_store = AttachmentStore(
+            db,
+            AsyncIOMotorGridFSBucket(database, bucket_name="attachments"),
+            max_bytes=settings.attachment_max_mb * 1024 * 1024,
+            thumbnail_size=settings.thumbnail_size,
+            workers=settings.thumbnail_workers
+        )
+        card_clusters = CardClusters(max_boards=settings.cluster_cache_boards)
+        activity_log = ActivityLog(db, retention_seconds=settings.activity_retention_days * 86400)
+        # Separately, so one failing index (a duplicate key, changed options) does not skip the rest
+        for name, create in [
+            ("core", lambda: ensure_indexes(db)),
+            ("idempotency", idempotency_store.ensure_indexes),
+            ("jobs", job_runner.ensure_indexes),
+            ("change log", change_log.ensure_indexes),
+            ("archive", session_archive.ensure_indexes),
+            ("attachments", attachment_store.ensure_indexes),
+            ("activity", activity_log.ensure_indexes),
+        ]:
+            try:
+                await create()
+            except Exception as e:
+                logger.warning(f"Index creation failed for {name}: {e}")
+        if settings.write_coalesce_window_ms > 0 and settings.web_concurrency > 1 and not settings.sticky_sessions:
+            # Another worker would miss acknowledged saves and compute revisions from stale state
+            logger.warning(f"Write coalescing disabled: {settings.web_concurrency} workers share traffic and "
+                           f"buffered saves are per process; set STICKY_SESSIONS=true behind session-sticky routing")
+        elif settings.write_coalesce_window_ms > 0:
+            if settings.web_concurrency > 1:
+                logger.warning("Write coalescing relies on sticky routing: every request for a session "
+                               "must reach the same worker")
+            coalescer = WriteCoalescer(
+                db,
+                window_ms=settings.write_coalesce_window_ms,
+                durability=settings.write_coalesce_durability,
+                embedded=embedded()
+            )
+            coalescer.start()
+            logger.info(f"Write coalescing enabled ({settings.write_coalesce_window_ms}ms, {settings.write_coalesce_durability})")
+        await warm_up(app)
+        await job_runner.start()
+        change_log.start()
+        activity_log.start()
+        load_monitor.start()
+        logger.info(f"Startup complete in {(time.perf_counter() - started) * 1000:.0f}ms")
+        yield
+        await load_monitor.stop()
+        await change_log.stop()
+        await job_runner.stop()
+        job_runner = None
+        await attachment_store.stop()
+        # Flush buffered autosaves and activity before the connection goes away
+        if coalescer:
+            await coalescer.stop()
+            coalescer = None
+        await activity_log.stop()
+        idempotency_store = None
+        client.close()
+        if trace_exporter:
+            trace_exporter.shutdown()
+
+    app = FastAPI(title="Co-Design Connect API", lifespan=lifespan)
+    app.include_router(api_router)
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+    app.add_middleware(
+        IdempotencyMiddleware,
+        routes=IDEMPOTENT_ROUTES,
+        store=lambda: idempotency_store,
+        user_of=token_subject
+    )
+    app.add_middleware(
+        DeadlineMiddleware,
+        monitor=monitor,
+        default_ms=app_settings.request_timeout_ms,
+        routes=api_router.routes,
+        route_timeouts={**ROUTE_TIMEOUTS_MS, **parse_route_timeouts(app_settings.route_timeouts_ms)}
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=app_settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Request-ID"],
+    )
+    app.add_middleware(
+        TracingMiddleware,
+        sample_rate=app_settings.trace_sample_rate,
+        slow_ms=app_settings.trace_slow_ms,
+        exporter=trace_exporter
+    )
+    return app
+
+_app: Optional[FastAPI] = None
+
+def __getattr__(name: str):
+    # Keeps `uvicorn server:app` working while building the app only on first access
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,297 @@
+import contextvars
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "codesign-api"
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+
+
+def new_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], start_ns: int, attributes: Optional[dict] = None):
+        self.name = name
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start_ns = start_ns
+        self.end_ns = start_ns
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self, trace_id: str, request_id: str, sampled: bool, parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.sampled = sampled
+        self.root = Span("request", parent_id, time.time_ns())
+        self.spans: List[Span] = []
+        self.handler_end_ns: Optional[int] = None
+
+    def add(self, span: Span):
+        # list.append is atomic, so Mongo listener threads can record spans safely
+        self.spans.append(span)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record a child span of the current request; a no-op outside a traced request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = Span(name, _current_span.get() or trace.root.span_id, time.time_ns(), attributes)
+    token = _current_span.set(current.span_id)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        trace.add(current)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Turns driver command events into spans of the request that issued them.
+
+    Motor runs pymongo in executor threads with a copy of the caller's context, so the
+    request's trace is visible from here.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, None)
+
+    def failed(self, event):
+        self._record(event, getattr(event, "failure", {}).get("errmsg", "failed"))
+
+    def _record(self, event, error: Optional[str]):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        end = time.time_ns()
+        attributes = {"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name}
+        command = getattr(event, "command", None) or {}
+        collection = command.get(event.command_name) if isinstance(command, dict) else None
+        if isinstance(collection, str):
+            attributes["db.mongodb.collection"] = collection
+        recorded = Span(f"mongo.{event.command_name}", _current_span.get() or trace.root.span_id,
+                        end - event.duration_micros * 1000, attributes)
+        recorded.end_ns = end
+        recorded.error = error
+        trace.add(recorded)
+
+
+class TracedRoute(APIRoute):
+    """Adds "handler" and "serialize" spans around each endpoint call."""
+
+    def get_route_handler(self):
+        call = self.dependant.call
+
+        async def traced_call(*args, **kwargs):
+            with span("handler", route=self.path_format):
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    trace = _current_trace.get()
+                    if trace is not None:
+                        trace.handler_end_ns = time.time_ns()
+
+        if self.dependant.call is not None and not getattr(call, "_traced", False):
+            traced_call._traced = True
+            self.dependant.call = traced_call
+        handler = super().get_route_handler()
+        path_format = self.path_format
+
+        async def traced_handler(request):
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.root.attributes.setdefault("http.route", path_format)
+            response = await handler(request)
+            if trace is not None and trace.handler_end_ns is not None:
+                serialize = Span("serialize", _current_span.get() or trace.root.span_id, trace.handler_end_ns)
+                serialize.end_ns = time.time_ns()
+                trace.add(serialize)
+            return response
+
+        return traced_handler
+
+
+def to_otlp(trace: Trace) -> dict:
+    """Encode a trace as an OTLP/JSON ExportTraceServiceRequest."""
+    def attrs(values: dict):
+        encoded = []
+        for key, value in values.items():
+            if isinstance(value, bool):
+                encoded.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                encoded.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                encoded.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                encoded.append({"key": key, "value": {"stringValue": str(value)}})
+        return encoded
+
+    def encode(s: Span, kind: int) -> dict:
+        encoded = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": kind,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": attrs(s.attributes),
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 0},
+        }
+        if s.parent_id:
+            encoded["parentSpanId"] = s.parent_id
+        return encoded
+
+    # SPAN_KIND_SERVER for the request, CLIENT for database calls, INTERNAL otherwise
+    spans = [encode(trace.root, 2)] + [
+        encode(s, 3 if s.name.startswith("mongo.") else 1) for s in trace.spans
+    ]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": attrs({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]
+    }
+
+
+def breakdown(trace: Trace) -> Dict[str, float]:
+    totals: Dict[str, float] = {}
+    for s in trace.spans:
+        totals[s.name] = round(totals.get(s.name, 0.0) + s.duration_ms, 3)
+    return totals
+
+
+class FileExporter:
+    """Appends OTLP/JSON lines to a file from a background thread, dropping traces when backed up."""
+
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._write, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        try:
+            self._queue.put_nowait(to_otlp(trace))
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                f.write(json.dumps(item, separators=(",", ":")) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+
+class TracingMiddleware:
+    """Starts a trace per HTTP request, propagates X-Request-ID and W3C traceparent, exports
+    sampled traces and logs a span breakdown for requests slower than `slow_ms`."""
+
+    def __init__(self, app, sample_rate: float = 0.0, slow_ms: float = 500.0, exporter: Optional[FileExporter] = None):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.exporter = exporter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if _current_trace.get() is not None:
+            # In-process sub-request (e.g. a batch operation): trace it as part of the parent
+            with span(f"subrequest {scope['method']} {scope['path']}"):
+                return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:128] or uuid.uuid4().hex
+        parent = TRACEPARENT.match(headers.get(b"traceparent", b"").decode("latin-1"))
+        if parent:
+            trace = Trace(parent.group(1), request_id, bool(int(parent.group(3), 16) & 1), parent.group(2))
+        else:
+            trace = Trace(uuid.uuid4().hex, request_id, random.random() < self.sample_rate)
+        trace.root.attributes.update({
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+            "request.id": request_id,
+        })
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                trace.root.attributes["http.status_code"] = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]}
+            await send(message)
+
+        token = _current_trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        except BaseException as e:
+            trace.root.error = type(e).__name__
+            raise
+        finally:
+            _current_trace.reset(token)
+            trace.root.end_ns = time.time_ns()
+            trace.root.name = f"{scope['method']} {trace.root.attributes.get('http.route', scope['path'])}"
+            self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        duration = trace.root.duration_ms
+        if self.exporter is not None and (trace.sampled or duration >= self.slow_ms):
+            self.exporter.export(trace)
+        if duration >= self.slow_ms:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "request_id": trace.request_id,
+                "trace_id": trace.trace_id,
+                "route": trace.root.name,
+                "status": trace.root.attributes.get("http.status_code"),
+                "duration_ms": round(duration, 3),
+                "spans_ms": breakdown(trace),
+                "mongo_calls": sum(1 for s in trace.spans if s.name.startswith("mongo.")),
+            }))
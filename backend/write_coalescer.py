@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from layouts import SESSION_FIELDS, tool_path, unembed
+
+logger = logging.getLogger(__name__)
+
+# Fields only written when the artifact document is first created. Ownership is
+# maintained directly on stored documents, so a flush must never overwrite it.
+INSERT_ONLY_FIELDS = ("id", "created_at", "owner_id", "member_ids")
+
+DURABILITY_MODES = ("ack", "flush")
+
+
+class PendingWrite:
+    __slots__ = ("doc", "waiters")
+
+    def __init__(self, doc: dict):
+        self.doc = doc
+        self.waiters: List[asyncio.Future] = []
+
+
+class WriteCoalescer:
+    """Buffers tool artifact saves per (collection, session_id) and flushes only the latest state.
+
+    In "ack" mode a save returns as soon as it is buffered; in "flush" mode it waits for
+    the bulk write that persists it. With `embedded`, artifacts are flushed into their
+    session documents (see layouts.py) instead of the per-tool collections.
+    """
+
+    def __init__(self, db, window_ms: int = 250, durability: str = "ack", max_pending: int = 500,
+                 embedded: bool = False):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.db = db
+        self.window = window_ms / 1000
+        self.durability = durability
+        self.max_pending = max_pending
+        self.embedded = embedded
+        self._pending: Dict[Tuple[str, str], PendingWrite] = {}
+        self._flushing: Dict[Tuple[str, str], PendingWrite] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Let the flusher finish the batch it may be writing rather than cancelling it mid-flush
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def peek(self, collection: str, session_id: str) -> Optional[dict]:
+        key = (collection, session_id)
+        pending = self._pending.get(key) or self._flushing.get(key)
+        return dict(pending.doc) if pending else None
+
+    def refresh(self, session_id: str, fields: dict):
+        """Apply a change made directly in Mongo to any buffered copies of a session's artifacts."""
+        for buffer in (self._pending, self._flushing):
+            for (_, buffered_session_id), pending in buffer.items():
+                if buffered_session_id == session_id:
+                    pending.doc.update(fields)
+
+    async def save(self, collection: str, session_id: str, fields: dict, base: Optional[dict] = None) -> dict:
+        """Buffer the latest fields for an artifact.
+
+        `base` is the caller's already-loaded copy of the stored document (or the
+        fields a new document should start with); it is read from Mongo when omitted.
+        """
+        key = (collection, session_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            stored = self.peek(collection, session_id)
+            if stored is None:
+                stored = base if base is not None else await self._load(collection, session_id)
+            # Another save for the same artifact may have been buffered while we were reading
+            pending = self._pending.get(key)
+            if pending is None:
+                doc = dict(stored or {})
+                doc.setdefault("id", str(uuid.uuid4()))
+                doc.setdefault("session_id", session_id)
+                doc.setdefault("created_at", fields["updated_at"])
+                pending = self._pending[key] = PendingWrite(doc)
+
+        pending.doc.update(fields)
+        pending.doc["revision"] = pending.doc.get("revision", 0) + 1
+        doc = dict(pending.doc)
+
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+        if self.durability == "flush":
+            waiter = asyncio.get_running_loop().create_future()
+            pending.waiters.append(waiter)
+            await waiter
+        return doc
+
+    async def _load(self, collection: str, session_id: str) -> Optional[dict]:
+        if not self.embedded:
+            return await self.db[collection].find_one({"session_id": session_id}, {"_id": 0})
+        session = await self.db.sessions.find_one(
+            {"id": session_id}, {"_id": 0, "id": 1, "owner_id": 1, "member_ids": 1, tool_path(collection): 1}
+        )
+        doc = ((session or {}).get("tools") or {}).get(collection)
+        return unembed(session, doc) if doc is not None else None
+
+    def _operation(self, collection: str, session_id: str, doc: dict) -> Tuple[str, UpdateOne]:
+        """Target collection and update persisting a buffered artifact."""
+        if self.embedded:
+            # The session must already exist; its own document carries the membership
+            path = tool_path(collection)
+            return "sessions", UpdateOne(
+                {"id": session_id},
+                {"$set": {f"{path}.{k}": v for k, v in doc.items() if k not in SESSION_FIELDS}},
+            )
+        return collection, UpdateOne(
+            {"session_id": session_id},
+            {
+                "$set": {k: v for k, v in doc.items() if k not in INSERT_ONLY_FIELDS and k != "session_id"},
+                "$setOnInsert": {k: doc[k] for k in INSERT_ONLY_FIELDS if k in doc},
+            },
+            upsert=True,
+        )
+
+    async def flush(self):
+        async with self._flush_lock:
+            # A flush interrupted part-way left its batch unconfirmed; write it again with the new one
+            for key, stale in self._flushing.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = stale
+                else:
+                    newer.waiters.extend(stale.waiters)
+            self._flushing = {}
+            if not self._pending:
+                return
+            self._flushing, self._pending = self._pending, {}
+            batch = self._flushing
+
+            operations: Dict[str, List[UpdateOne]] = {}
+            targets: Dict[Tuple[str, str], str] = {}
+            for key, pending in batch.items():
+                target, operation = self._operation(*key, pending.doc)
+                targets[key] = target
+                operations.setdefault(target, []).append(operation)
+
+            results = await asyncio.gather(
+                *(self.db[collection].bulk_write(ops, ordered=False) for collection, ops in operations.items()),
+                return_exceptions=True,
+            )
+            errors = {
+                collection: result
+                for collection, result in zip(operations, results)
+                if isinstance(result, Exception)
+            }
+
+            for key, pending in batch.items():
+                error = errors.get(targets[key])
+                if error is None:
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                    continue
+                if pending.waiters:
+                    # Callers in "flush" mode were never acknowledged, so report the failure to them
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_exception(error)
+                elif key not in self._pending:
+                    # Already acknowledged: keep the state buffered for the next flush
+                    self._pending[key] = PendingWrite(pending.doc)
+
+            self._flushing = {}
+            for collection, error in errors.items():
+                logger.error("Coalesced flush to %s failed: %s", collection, error)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Coalesced flush failed")
@@ -0,0 +1,142 @@
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import gridfs
+import mongomock.codec_options
+import mongomock.collection
+import mongomock_motor
+import pytest
+from bson import ObjectId
+
+# The backend is a flat set of modules run from its own directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture
+def encoded_codecs(monkeypatch):
+    """Let mongomock_motor collections take encoding.CODEC_OPTIONS, as EncodedCollection needs.
+
+    mongomock stores binary UUIDs as given, and its with_options would return a sync collection.
+    """
+    collection = mongomock_motor.AsyncMongoMockCollection
+    monkeypatch.setattr(mongomock.codec_options, "is_supported", lambda options: options)
+    monkeypatch.setattr(collection, "with_options", lambda self, **options: collection(
+        self.database, self._AsyncMongoMockCollection__collection.with_options(**options)
+    ), raising=False)
+
+
+@pytest.fixture
+def find_and_modify_by_id(monkeypatch):
+    """Make mongomock return the document it updated, as MongoDB does.
+
+    Unless the projection keeps `_id`, mongomock looks the document up again by the original
+    filter, which no longer matches once the update changed a filtered field.
+    """
+    find_and_modify = mongomock.collection.Collection._find_and_modify
+
+    def by_id(self, query, projection=None, update=None, upsert=False, sort=None, *args, **kwargs):
+        matched = self.find_one(query, {"_id": 1}, sort=sort)
+        if matched is not None:
+            query = {"_id": matched["_id"]}
+        return find_and_modify(self, query, projection, update, upsert, sort, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "_find_and_modify", by_id)
+
+
+class MemoryFile:
+    """The parts of Motor's GridFS upload and download streams the API uses."""
+
+    def __init__(self, files: dict, file_id, filename: str, metadata: dict = None):
+        self._files = files
+        self._id = file_id
+        self.filename = filename
+        self.metadata = metadata
+        self.data = b""
+        self.position = 0
+        self.upload_date = datetime.now(timezone.utc)
+
+    @property
+    def length(self) -> int:
+        return len(self.data)
+
+    async def write(self, data: bytes):
+        self.data += data
+
+    async def close(self):
+        self._files[self._id] = self
+
+    async def abort(self):
+        pass
+
+    def seek(self, position: int):
+        self.position = position
+
+    async def read(self, size: int = -1) -> bytes:
+        end = len(self.data) if size < 0 else self.position + size
+        data = self.data[self.position:end]
+        self.position += len(data)
+        return data
+
+    async def readchunk(self) -> bytes:
+        return await self.read(255 * 1024)
+
+
+class MemoryBucket:
+    """In-memory stand-in for AsyncIOMotorGridFSBucket, which mongomock cannot back."""
+
+    def __init__(self, database, bucket_name: str = "fs"):
+        self.files = {}
+
+    def open_upload_stream(self, filename: str, metadata: dict = None, **kwargs) -> MemoryFile:
+        return MemoryFile(self.files, ObjectId(), filename, metadata)
+
+    async def upload_from_stream(self, filename: str, data: bytes, metadata: dict = None, **kwargs):
+        upload = self.open_upload_stream(filename, metadata)
+        await upload.write(data)
+        await upload.close()
+        return upload._id
+
+    async def open_download_stream(self, file_id) -> MemoryFile:
+        if file_id not in self.files:
+            raise gridfs.errors.NoFile(file_id)
+        stored = self.files[file_id]
+        download = MemoryFile(self.files, file_id, stored.filename, stored.metadata)
+        download.data = stored.data
+        return download
+
+    async def delete(self, file_id):
+        if self.files.pop(file_id, None) is None:
+            raise gridfs.errors.NoFile(file_id)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A TestClient for an app running against mongomock, with its lifespan started."""
+    from fastapi.testclient import TestClient
+
+    import server
+
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda url, **options: mongomock_motor.AsyncMongoMockClient())
+    monkeypatch.setattr(server, "AsyncIOMotorGridFSBucket", MemoryBucket)
+    app = server.create_app(server.Settings(mongo_url="mongodb://localhost", db_name="test"))
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def register(api):
+    """Register a user; returns their id, email and Authorization headers."""
+    count = 0
+
+    def register(name: str = "user") -> dict:
+        nonlocal count
+        count += 1
+        response = api.post("/api/auth/register", json={
+            "email": f"{name}{count}@example.com", "password": "secret", "name": name, "role": "facilitator",
+        })
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return {**body["user"], "headers": {"Authorization": f"Bearer {body['access_token']}"}}
+
+    return register
@@ -0,0 +1,78 @@
+import pytest
+
+TOOLS = {
+    "problem-trees": {"core_problem": "Why?"},
+    "empathy-maps": {"persona_name": "Sam"},
+    "story-maps": {"title": "Journey"},
+    "ideas-boards": {"ideas": [{"text": "idea"}]},
+    "feedback": {"items": []},
+    "expectations": {"items": []},
+}
+
+
+def create_session(api, owner: dict, name: str = "Session") -> dict:
+    project = api.post("/api/projects", json={"name": "Project"}, headers=owner["headers"]).json()
+    response = api.post("/api/sessions", json={"project_id": project["id"], "name": name}, headers=owner["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.fixture
+def session(api, register):
+    owner, outsider = register("owner"), register("outsider")
+    session = create_session(api, owner)
+    for tool, content in TOOLS.items():
+        response = api.post(f"/api/{tool}", json={"session_id": session["id"], **content}, headers=owner["headers"])
+        assert response.status_code == 200, response.text
+    return {"session": session, "owner": owner, "outsider": outsider}
+
+
+def test_non_member_gets_404_on_the_session(api, session):
+    session_id, outsider = session["session"]["id"], session["outsider"]
+    assert api.get(f"/api/sessions/{session_id}", headers=outsider["headers"]).status_code == 404
+    assert api.put(f"/api/sessions/{session_id}/step?step=2", headers=outsider["headers"]).status_code == 404
+    owner_view = api.get(f"/api/sessions/{session_id}", headers=session["owner"]["headers"]).json()
+    assert owner_view["current_step"] == 0
+
+
+@pytest.mark.parametrize("tool", TOOLS)
+def test_non_member_gets_404_on_tools(api, session, tool):
+    session_id, outsider = session["session"]["id"], session["outsider"]
+    assert api.get(f"/api/{tool}/{session_id}", headers=outsider["headers"]).status_code == 404
+    response = api.put(f"/api/{tool}/{session_id}", json={"session_id": session_id, **TOOLS[tool]},
+                       headers=outsider["headers"])
+    assert response.status_code == 404
+    # Creating the tool for someone else's session is refused the same way
+    response = api.post(f"/api/{tool}", json={"session_id": session_id, **TOOLS[tool]}, headers=outsider["headers"])
+    assert response.status_code == 404
+    stored = api.get(f"/api/{tool}/{session_id}", headers=session["owner"]["headers"]).json()
+    assert stored["revision"] == 0
+
+
+def test_session_list_only_has_the_callers_sessions(api, session, register):
+    other = create_session(api, session["outsider"], name="Theirs")
+    owner_sessions = api.get("/api/sessions", headers=session["owner"]["headers"]).json()
+    outsider_sessions = api.get("/api/sessions", headers=session["outsider"]["headers"]).json()
+    assert [s["id"] for s in owner_sessions] == [session["session"]["id"]]
+    assert [s["id"] for s in outsider_sessions] == [other["id"]]
+    assert api.get("/api/sessions", headers=register("newcomer")["headers"]).json() == []
+
+
+def test_added_member_gets_access(api, session):
+    session_id, owner, member = session["session"]["id"], session["owner"], session["outsider"]
+    response = api.post(f"/api/sessions/{session_id}/members", json={"email": member["email"]}, headers=owner["headers"])
+    assert response.status_code == 200, response.text
+    assert member["id"] in response.json()["member_ids"]
+
+    assert api.get(f"/api/sessions/{session_id}", headers=member["headers"]).status_code == 200
+    assert session_id in [s["id"] for s in api.get("/api/sessions", headers=member["headers"]).json()]
+    assert api.put(f"/api/sessions/{session_id}/step?step=2", headers=member["headers"]).status_code == 200
+    for tool, content in TOOLS.items():
+        assert api.get(f"/api/{tool}/{session_id}", headers=member["headers"]).status_code == 200
+        response = api.put(f"/api/{tool}/{session_id}", json={"session_id": session_id, **content}, headers=member["headers"])
+        assert response.status_code == 200, (tool, response.text)
+        assert response.json()["revision"] == 1
+
+    # Removing them takes the access away again
+    api.delete(f"/api/sessions/{session_id}/members/{member['id']}", headers=owner["headers"])
+    assert api.get(f"/api/ideas-boards/{session_id}", headers=member["headers"]).status_code == 404
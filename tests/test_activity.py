@@ -0,0 +1,158 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from activity import ActivityLog
+
+USER = {"id": "u", "name": "Ada"}
+
+
+class SlowCollection:
+    """Delays insert_many so a flush is in flight when the log stops."""
+
+    def __init__(self, collection, delay: float):
+        self.collection = collection
+        self.delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def insert_many(self, documents, **kwargs):
+        await asyncio.sleep(self.delay)
+        return await self.collection.insert_many(documents, **kwargs)
+
+
+def activity_log(**kw) -> ActivityLog:
+    kw.setdefault("retention_seconds", 3600)
+    return ActivityLog(AsyncMongoMockClient().db, **kw)
+
+
+def test_events_are_written_in_batches():
+    async def run():
+        log = activity_log(batch_size=2, flush_interval=60)
+        log.start()
+        for index in range(3):
+            log.record(USER, "s", "ideas_boards", "update", [f"i{index}"])
+        await asyncio.sleep(0.05)
+        # A full batch wakes the flusher early; the rest waits for the interval or shutdown
+        assert await log.collection.count_documents({}) == 2
+        await log.stop()
+        assert await log.collection.count_documents({}) == 3
+
+    asyncio.run(run())
+
+
+def test_stop_keeps_a_batch_that_is_being_written():
+    async def run():
+        log = activity_log(batch_size=10, flush_interval=0.01)
+        stored = log.collection
+        log.collection = SlowCollection(stored, delay=0.2)
+        log.start()
+        log.record(USER, "s", "ideas_boards", "create", ["i1"])
+        await asyncio.sleep(0.05)
+        await log.stop()
+        assert await stored.count_documents({}) == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_flush_requeues_its_batch():
+    async def run():
+        log = activity_log()
+        log.collection = SlowCollection(log.collection, delay=1)
+        log.record(USER, "s", "ideas_boards", "create", ["i1"])
+        flush = asyncio.create_task(log.flush())
+        await asyncio.sleep(0.05)
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        assert [event["item_ids"] for event in log._queue] == [["i1"]]
+
+    asyncio.run(run())
+
+
+def test_for_session_merges_queued_and_stored_events():
+    async def run():
+        log = activity_log(flush_interval=60)
+        log.record(USER, "s", "ideas_boards", "create", ["i1"])
+        log.record(USER, "other", "ideas_boards", "create", ["x"])
+        await log.flush()
+        log.record(USER, "s", "story_maps", "update", ["i2"])
+        events = await log.for_session("s", limit=10)
+        assert [event["artifact"] for event in events] == ["story_maps", "ideas_boards"]
+        older = await log.for_session("s", limit=10, before=events[0]["_id"])
+        assert [event["artifact"] for event in older] == ["ideas_boards"]
+
+    asyncio.run(run())
+
+
+def test_forget_drops_queued_and_stored_events():
+    async def run():
+        log = activity_log()
+        log.record(USER, "s", "ideas_boards", "create", ["i1"])
+        await log.flush()
+        log.record(USER, "s", "ideas_boards", "update", ["i1"])
+        log.record(USER, "other", "ideas_boards", "update", ["x"])
+        await log.forget(["s"])
+        assert await log.for_session("s", limit=10) == []
+        assert len(log._queue) == 1
+
+    asyncio.run(run())
+
+
+def test_queue_overflow_drops_the_oldest_events():
+    async def run():
+        log = activity_log(max_queue=2)
+        for index in range(3):
+            log.record(USER, "s", "ideas_boards", "update", [f"i{index}"])
+        assert [event["item_ids"] for event in log._queue] == [["i1"], ["i2"]]
+        await log.flush()
+        assert log._dropped == 0
+
+    asyncio.run(run())
+
+
+def test_events_expire_through_a_ttl_index():
+    async def run():
+        log = activity_log(retention_seconds=86400)
+        await log.ensure_indexes()
+        indexes = await log.collection.index_information()
+        ttl = [index for index in indexes.values() if "expireAfterSeconds" in index]
+        assert [(index["key"], index["expireAfterSeconds"]) for index in ttl] == [([("created_at", 1)], 86400)]
+        log.record(USER, "s", "ideas_boards", "create", [])
+        await log.flush()
+        created = (await log.collection.find_one({}))["created_at"].replace(tzinfo=timezone.utc)
+        assert abs(created - datetime.now(timezone.utc)) < timedelta(seconds=5)
+
+    asyncio.run(run())
+
+
+def test_activity_route_attributes_saves(api, register):
+    owner, member = register("owner"), register("member")
+    project = api.post("/api/projects", json={"name": "P"}, headers=owner["headers"]).json()
+    session = api.post("/api/sessions", json={"project_id": project["id"], "name": "S"}, headers=owner["headers"]).json()
+    api.post(f"/api/sessions/{session['id']}/members", json={"email": member["email"]}, headers=owner["headers"])
+    ideas = [{"id": "i1", "text": "one"}, {"id": "i2", "text": "two"}]
+    api.post("/api/ideas-boards", json={"session_id": session["id"], "ideas": ideas}, headers=owner["headers"])
+    edited = [{"id": "i2", "text": "two, edited"}, {"id": "i3", "text": "three"}]
+    api.put(f"/api/ideas-boards/{session['id']}", json={"session_id": session["id"], "ideas": edited},
+            headers=member["headers"])
+
+    url = f"/api/sessions/{session['id']}/activity"
+    events = api.get(url, headers=owner["headers"]).json()["events"]
+    assert [(e["user_id"], e["artifact"], e["operation"]) for e in events] == [
+        (member["id"], "ideas_boards", "update"),
+        (owner["id"], "ideas_boards", "create"),
+        (owner["id"], "sessions", "add_member"),
+        (owner["id"], "sessions", "create"),
+    ]
+    update = events[0]
+    # One event per save, naming each changed item once
+    assert update["item_ids"] == ["i2", "i3", "i1"] and update["user_name"] == "member"
+
+    page = api.get(url + "?limit=1", headers=owner["headers"]).json()
+    assert [e["id"] for e in page["events"]] == [update["id"]]
+    older = api.get(f"{url}?limit=10&cursor={page['next_cursor']}", headers=owner["headers"]).json()
+    assert [e["id"] for e in older["events"]] == [e["id"] for e in events[1:]]
+    assert api.get(url + "?cursor=nope", headers=owner["headers"]).status_code == 400
+    assert api.get(url, headers=register("outsider")["headers"]).status_code == 404
@@ -0,0 +1,14 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+def test_second_app_cannot_start_while_one_is_running(api, register):
+    other = server.create_app(server.Settings(mongo_url="mongodb://localhost", db_name="other"))
+    with pytest.raises(RuntimeError, match="one app per process"):
+        with TestClient(other):
+            pass
+    # The running app keeps its clients and stores
+    assert server.settings.db_name == "test"
+    assert api.get("/api/sessions", headers=register("owner")["headers"]).status_code == 200
@@ -0,0 +1,87 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from archive import SessionArchive
+from encoding import encoded_database, raw_database
+from server import ARTIFACT_COLLECTIONS, ENCODED_COLLECTIONS
+
+OLD = (datetime.now(timezone.utc) - timedelta(days=200)).isoformat()
+CUTOFF = (datetime.now(timezone.utc) - timedelta(days=90)).isoformat()
+
+
+def database(encoding: str):
+    return encoded_database(AsyncMongoMockClient().db, encoding, ENCODED_COLLECTIONS)
+
+
+async def add_session(db, updated_at: str = OLD, raw: bool = False) -> str:
+    """A session with an ideas board; `raw` stores it with plain strings, as before a migration."""
+    target = raw_database(db) if raw else db
+    session_id, user_id = str(uuid.uuid4()), str(uuid.uuid4())
+    await target.sessions.insert_one({
+        "id": session_id, "project_id": str(uuid.uuid4()), "name": "s", "owner_id": user_id,
+        "member_ids": [user_id], "archived_at": None, "created_at": updated_at, "updated_at": updated_at,
+    })
+    await target.ideas_boards.insert_one({
+        "id": str(uuid.uuid4()), "session_id": session_id, "owner_id": user_id, "member_ids": [user_id],
+        "ideas": [{"id": "i1", "text": "idea"}], "revision": 3, "created_at": updated_at, "updated_at": updated_at,
+    })
+    return session_id
+
+
+@pytest.mark.parametrize("encoding", ["strings", "compact", "dual"])
+def test_archive_idle_archives_every_idle_session(encoding, encoded_codecs):
+    async def run():
+        db = database(encoding)
+        idle = [await add_session(db) for _ in range(3)]
+        if encoding == "dual":
+            idle.append(await add_session(db, raw=True))
+        active = await add_session(db, updated_at=datetime.now(timezone.utc).isoformat())
+        archive = SessionArchive(db, ARTIFACT_COLLECTIONS)
+        stats = await archive.archive_idle(CUTOFF, batch_size=2)
+        assert stats["sessions_scanned"] == len(idle)
+        assert stats["sessions_archived"] == stats["documents_moved"] == len(idle)
+        assert {r["_id"] for r in await db.session_archive.find({}, {"_id": 1}).to_list(None)} == set(idle)
+        assert await db.ideas_boards.count_documents({}) == 1
+        assert (await db.ideas_boards.find_one({}, {"session_id": 1}))["session_id"] == active
+        session = await db.sessions.find_one({"id": idle[0]})
+        assert session["archived_at"] is not None
+
+        assert await archive.restore(idle[0])
+        board = await db.ideas_boards.find_one({"session_id": idle[0]}, {"_id": 0})
+        assert board["ideas"] == [{"id": "i1", "text": "idea"}] and board["revision"] == 3
+        assert (await db.sessions.find_one({"id": idle[0]}))["archived_at"] is None
+
+    asyncio.run(run())
+
+
+def test_embedded_sessions_round_trip_through_the_archive():
+    async def run():
+        db = AsyncMongoMockClient().db
+        user_id = str(uuid.uuid4())
+        board = {"id": "b1", "ideas": [{"id": "i1", "text": "idea"}], "revision": 3, "updated_at": OLD}
+        await db.sessions.insert_many([
+            {"id": session_id, "owner_id": user_id, "member_ids": [user_id], "archived_at": None,
+             "updated_at": OLD, "tools": {"ideas_boards": board}}
+            for session_id in ("s1", "s2")
+        ])
+        archive = SessionArchive(db, ARTIFACT_COLLECTIONS, embedded=True)
+        stats = await archive.archive_idle(CUTOFF, batch_size=1)
+        assert stats["sessions_archived"] == stats["documents_moved"] == 2
+        session = await db.sessions.find_one({"id": "s1"})
+        assert "tools" not in session and session["archived_at"] is not None
+        assert (await archive.load("s1"))["ideas_boards"]["ideas"] == board["ideas"]
+
+        # A tool written while archived is newer than the archived copy and is kept
+        await db.sessions.update_one({"id": "s2"}, {"$set": {"tools.ideas_boards": {**board, "revision": 4}}})
+        assert await archive.restore("s1") and await archive.restore("s2")
+        restored = {s["id"]: s for s in await db.sessions.find({}).to_list(None)}
+        assert restored["s1"]["tools"]["ideas_boards"] == board and restored["s1"]["archived_at"] is None
+        assert restored["s2"]["tools"]["ideas_boards"]["revision"] == 4
+        assert await db.session_archive.count_documents({}) == 0
+        assert not await archive.restore("s1")
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+def archive_everything(api) -> dict:
+    # A cutoff in the future makes the sessions just created count as idle
+    cutoff = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    return api.portal.call(server.session_archive.archive_idle, cutoff)
+
+
+def find(api, collection: str, query: dict, projection: dict = None):
+    return api.portal.call(server.db[collection].find_one, query, projection)
+
+
+@pytest.fixture
+def session(api, register):
+    owner, member = register("owner"), register("member")
+    project = api.post("/api/projects", json={"name": "Project"}, headers=owner["headers"]).json()
+    session = api.post("/api/sessions", json={"project_id": project["id"], "name": "Session"},
+                       headers=owner["headers"]).json()
+    ideas = {"session_id": session["id"], "ideas": [{"text": "first"}]}
+    assert api.post("/api/ideas-boards", json=ideas, headers=owner["headers"]).status_code == 200
+    response = api.put(f"/api/ideas-boards/{session['id']}", json={**ideas, "ideas": [{"text": "second"}]},
+                       headers=owner["headers"])
+    assert response.status_code == 200, response.text
+    return {"id": session["id"], "owner": owner, "member": member}
+
+
+def test_opening_an_archived_session_restores_its_tools(api, session):
+    stats = archive_everything(api)
+    assert stats["sessions_archived"] == 1 and stats["documents_moved"] == 1
+    assert stats["bytes_after"] > 0
+    assert find(api, "sessions", {"id": session["id"]})["archived_at"] is not None
+    assert find(api, "ideas_boards", {"session_id": session["id"]}) is None
+
+    response = api.get(f"/api/ideas-boards/{session['id']}", headers=session["owner"]["headers"])
+    assert response.status_code == 200, response.text
+    board = response.json()
+    assert [idea["text"] for idea in board["ideas"]] == ["second"] and board["revision"] == 1
+    assert find(api, "sessions", {"id": session["id"]})["archived_at"] is None
+    assert find(api, "session_archive", {"_id": session["id"]}) is None
+
+    # Restored sessions are not archived again until they have been idle past a later cutoff
+    response = api.put(f"/api/ideas-boards/{session['id']}", json={**board, "ideas": [{"text": "third"}]},
+                       headers=session["owner"]["headers"])
+    assert response.status_code == 200, response.text
+    assert response.json()["revision"] == 2
+
+
+def test_restore_uses_the_membership_of_the_session(api, session):
+    archive_everything(api)
+    owner, member = session["owner"], session["member"]
+    response = api.post(f"/api/sessions/{session['id']}/members", json={"email": member["email"]}, headers=owner["headers"])
+    assert response.status_code == 200, response.text
+    # Adding the member touched only the session row, so the tools are still archived
+    assert find(api, "session_archive", {"_id": session["id"]}) is not None
+
+    response = api.get(f"/api/ideas-boards/{session['id']}", headers=member["headers"])
+    assert response.status_code == 200, response.text
+    assert [idea["text"] for idea in response.json()["ideas"]] == ["second"]
+
+
+def test_outsider_cannot_restore_an_archived_session(api, session, register):
+    archive_everything(api)
+    outsider = register("outsider")
+    assert api.get(f"/api/ideas-boards/{session['id']}", headers=outsider["headers"]).status_code == 404
+    assert find(api, "session_archive", {"_id": session["id"]}) is not None
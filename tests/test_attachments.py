@@ -0,0 +1,182 @@
+import asyncio
+import io
+import time
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+from PIL import Image
+
+import server
+from attachments import AttachmentStore, parse_range
+
+
+def store() -> AttachmentStore:
+    return AttachmentStore(AsyncMongoMockClient().db, bucket=None, max_bytes=1024, workers=0)
+
+
+async def add_records(attachments: AttachmentStore):
+    await attachments.records.insert_many([
+        {"id": "mine", "session_id": "s", "sha256": "a"},
+        {"id": "theirs", "session_id": "other", "sha256": "b"},
+    ])
+
+
+def test_unknown_lists_ids_missing_from_the_session():
+    async def run():
+        attachments = store()
+        await add_records(attachments)
+        assert await attachments.unknown("s", ["mine"]) == []
+        assert await attachments.unknown("s", ["mine", "theirs", "gone"]) == ["gone", "theirs"]
+
+    asyncio.run(run())
+
+
+def test_check_attachments_rejects_unknown_item_attachments(monkeypatch):
+    async def run():
+        attachments = store()
+        await add_records(attachments)
+        monkeypatch.setattr(server, "attachment_store", attachments)
+        await server.check_attachments("s", {"ideas": [{"id": "1", "attachment_ids": ["mine"]}, {"id": "2"}]})
+        await server.check_attachments("s", {"title": "no items", "items": []})
+        with pytest.raises(HTTPException) as error:
+            await server.check_attachments("s", {"items": [{"id": "1", "attachment_ids": ["mine", "theirs"]}]})
+        assert error.value.status_code == 400
+        assert "theirs" in error.value.detail and "mine" not in error.value.detail
+
+    asyncio.run(run())
+
+
+def test_copied_items_drop_attachments():
+    content = server.with_new_item_ids({"ideas": [{"id": "1", "text": "x", "attachment_ids": ["mine"]}]})
+    assert content["ideas"][0]["attachment_ids"] == []
+    assert content["ideas"][0]["id"] != "1"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=90-200", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=5-6, 20-30", (5, 6)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=9-5", "bytes=-0", "items=0-5", "bytes="])
+def test_parse_range_rejects_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def png(color: str = "red", size=(640, 480)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def session(api, register):
+    owner = register("owner")
+    project = api.post("/api/projects", json={"name": "P"}, headers=owner["headers"]).json()
+    session = api.post("/api/sessions", json={"project_id": project["id"], "name": "S"}, headers=owner["headers"]).json()
+    return {**session, "headers": owner["headers"]}
+
+
+def upload(api, session, data: bytes, content_type: str = "image/png", filename: str = "sketch.png"):
+    return api.post(f"/api/sessions/{session['id']}/attachments?filename={filename}", content=data,
+                    headers={**session["headers"], "Content-Type": content_type})
+
+
+def wait_for_thumbnails():
+    deadline = time.monotonic() + 5
+    while server.attachment_store._tasks and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+def test_download_supports_ranges_and_caching(api, session):
+    data = png()
+    attachment = upload(api, session, data).json()
+    assert attachment["size"] == len(data) and attachment["content_type"] == "image/png"
+
+    full = api.get(attachment["url"], headers=session["headers"])
+    assert full.status_code == 200 and full.content == data
+    assert full.headers["content-type"] == "image/png"
+    assert full.headers["accept-ranges"] == "bytes"
+    assert "immutable" in full.headers["cache-control"]
+    etag = full.headers["etag"]
+
+    assert api.get(attachment["url"], headers={**session["headers"], "If-None-Match": etag}).status_code == 304
+    part = api.get(attachment["url"], headers={**session["headers"], "Range": "bytes=8-15"})
+    assert part.status_code == 206 and part.content == data[8:16]
+    assert part.headers["content-range"] == f"bytes 8-15/{len(data)}"
+    tail = api.get(attachment["url"], headers={**session["headers"], "Range": "bytes=-4"})
+    assert tail.content == data[-4:]
+    # A range against a different version gets the whole file
+    stale = api.get(attachment["url"], headers={**session["headers"], "Range": "bytes=0-3", "If-Range": '"old"'})
+    assert stale.status_code == 200 and stale.content == data
+    unsatisfiable = api.get(attachment["url"], headers={**session["headers"], "Range": f"bytes={len(data)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(data)}"
+
+
+def test_upload_streams_chunked_bodies(api, session):
+    data = png("blue", (1200, 900))
+
+    def chunks():
+        for start in range(0, len(data), 1000):
+            yield data[start:start + 1000]
+
+    attachment = upload(api, session, chunks()).json()
+    assert api.get(attachment["url"], headers=session["headers"]).content == data
+
+
+def test_upload_rejects_other_types_and_large_files(api, session):
+    assert upload(api, session, b"%PDF", content_type="application/pdf").status_code == 415
+    server.attachment_store.max_bytes = 100
+    assert upload(api, session, png()).status_code == 413
+
+    def chunks():
+        yield png()
+
+    # Without a Content-Length the limit is enforced while streaming, and nothing is kept
+    assert upload(api, session, chunks()).status_code == 413
+    assert server.attachment_store.bucket.files == {}
+
+
+def test_thumbnail_is_generated_in_the_background(api, session):
+    attachment = upload(api, session, png(size=(1600, 1200))).json()
+    wait_for_thumbnails()
+    listed = api.get(f"/api/sessions/{session['id']}/attachments", headers=session["headers"]).json()
+    thumbnail = api.get(listed[0]["thumbnail_url"], headers=session["headers"])
+    assert thumbnail.status_code == 200 and thumbnail.headers["content-type"] == "image/jpeg"
+    assert max(Image.open(io.BytesIO(thumbnail.content)).size) == server.settings.thumbnail_size
+    assert thumbnail.headers["etag"] != api.get(attachment["url"], headers=session["headers"]).headers["etag"]
+
+
+def test_identical_uploads_share_storage_until_both_are_deleted(api, session):
+    data = png("green")
+    first, second = upload(api, session, data).json(), upload(api, session, data).json()
+    assert first["id"] != second["id"]
+    store = server.attachment_store
+    wait_for_thumbnails()
+    blobs = api.portal.call(lambda: store.blobs.find({}).to_list(None))
+    assert [blob["refs"] for blob in blobs] == [2]
+    assert len(store.bucket.files) == 2  # the content once, and its thumbnail
+
+    assert api.delete(first["url"], headers=session["headers"]).status_code == 200
+    assert api.get(first["url"], headers=session["headers"]).status_code == 404
+    assert api.get(second["url"], headers=session["headers"]).content == data
+    assert api.delete(second["url"], headers=session["headers"]).status_code == 200
+    assert api.portal.call(lambda: store.blobs.count_documents({})) == 0
+    assert store.bucket.files == {}
+
+
+def test_attachments_are_private_to_session_members(api, session, register):
+    attachment = upload(api, session, png()).json()
+    outsider = register("outsider")["headers"]
+    assert api.get(attachment["url"], headers=outsider).status_code == 404
+    assert api.delete(attachment["url"], headers=outsider).status_code == 404
+    assert upload(api, {**session, "headers": outsider}, png()).status_code == 404
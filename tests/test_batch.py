@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import pytest
+
+from batch import BatchError, plan, references, resolve, run_batch, targets_batch
+
+
+def op(op_id: str, path: str, method: str = "GET", body=None, depends_on=()) -> dict:
+    return {"id": op_id, "method": method, "path": path, "body": body, "depends_on": list(depends_on)}
+
+
+class RecordingApp:
+    """ASGI app answering each path from a table, recording the order requests started."""
+
+    def __init__(self, responses: dict, delay: float = 0.0):
+        self.responses = responses
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, scope, receive, send):
+        request = await receive()
+        self.calls.append((scope["method"], scope["path"], scope["query_string"].decode(), request["body"]))
+        await asyncio.sleep(self.delay)
+        status, body = self.responses.get(scope["path"], (404, {"detail": "Not Found"}))
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": json.dumps(body).encode()})
+
+
+def batch(app, operations):
+    scope = {"type": "http", "headers": [(b"authorization", b"Bearer t")]}
+    return asyncio.run(run_batch(app, scope, "/api", operations, {}))
+
+
+def test_references_are_found_in_paths_and_bodies():
+    assert references("/sessions/{{a.body.id}}/step?step={{ b.body.step }}") == {"a", "b"}
+    assert references({"ids": ["{{c.body.id}}", 1], "name": "plain"}) == {"c"}
+    assert references(None) == set()
+
+
+def test_resolve_keeps_types_of_whole_references():
+    results = {"a": {"status": 200, "body": {"id": "s1", "items": [{"id": "i1"}], "count": 3}}}
+    assert resolve("{{a.body.count}}", results) == 3
+    assert resolve({"ids": ["{{a.body.items.0.id}}"]}, results) == {"ids": ["i1"]}
+    assert resolve("/sessions/{{a.body.id}}?n={{a.body.count}}", results) == "/sessions/s1?n=3"
+    with pytest.raises(BatchError):
+        resolve("{{a.body.items.5.id}}", results)
+    with pytest.raises(BatchError):
+        resolve("{{a.body.missing}}", results)
+
+
+def test_plan_collects_dependencies():
+    deps = plan([
+        op("a", "/sessions", "POST"),
+        op("b", "/sessions/{{a.body.id}}"),
+        op("c", "/health", depends_on=["b"]),
+    ])
+    assert deps == {"a": [], "b": ["a"], "c": ["b"]}
+
+
+@pytest.mark.parametrize("operations, message", [
+    ([op("a", "/x"), op("a", "/y")], "unique"),
+    ([op("a", "/x/{{b.body.id}}")], "unknown operations: b"),
+    ([op("a", "/x", depends_on=["b"]), op("b", "/y/{{a.body.id}}")], "cycle"),
+    ([op("a", "/x", depends_on=["a"])], "cycle"),
+])
+def test_plan_rejects_invalid_batches(operations, message):
+    with pytest.raises(BatchError, match=message):
+        plan(operations)
+
+
+@pytest.mark.parametrize("path, nested", [
+    ("/batch", True), ("/batch/", True), ("//batch?x=1", True), ("/./batch", True),
+    ("/batches", False), ("/sessions/batch", False), ("/batch/1", False),
+])
+def test_targets_batch(path, nested):
+    assert targets_batch(path) is nested
+
+
+def test_dependent_operations_run_after_their_dependencies():
+    app = RecordingApp({
+        "/api/sessions": (200, {"id": "s1"}),
+        "/api/sessions/s1/step": (200, {"message": "Step updated"}),
+        "/api/health": (200, {"status": "healthy"}),
+    }, delay=0.01)
+    results = batch(app, [
+        op("step", "/sessions/{{create.body.id}}/step?step=2", "PUT"),
+        op("create", "/sessions", "POST", body={"name": "S"}),
+        op("health", "/health"),
+    ])
+    assert [r["id"] for r in results] == ["step", "create", "health"]
+    assert all(r["status"] == 200 for r in results)
+    started = [path for _, path, _, _ in app.calls]
+    # Independent operations start right away; the step waits for the session it references
+    assert started.index("/api/sessions/s1/step") > started.index("/api/sessions")
+    assert started.index("/api/health") < started.index("/api/sessions/s1/step")
+    assert ("PUT", "/api/sessions/s1/step", "step=2", b"") in app.calls
+    assert ("POST", "/api/sessions", "", b'{"name": "S"}') in app.calls
+
+
+def test_failed_dependency_fails_its_dependents_with_424():
+    app = RecordingApp({"/api/sessions/nope": (404, {"detail": "Session not found"})})
+    results = {r["id"]: r for r in batch(app, [
+        op("get", "/sessions/nope"),
+        op("step", "/sessions/{{get.body.id}}/step?step=1", "PUT"),
+        op("after", "/health", depends_on=["step"]),
+    ])}
+    assert results["get"]["status"] == 404
+    assert results["step"] == {"id": "step", "status": 424, "body": {"detail": "Dependency failed: get"}}
+    assert results["after"]["status"] == 424
+    assert len(app.calls) == 1
+
+
+def test_reference_cannot_build_a_nested_batch_path():
+    app = RecordingApp({"/api/paths": (200, {"path": "batch"})})
+    results = {r["id"]: r for r in batch(app, [
+        op("paths", "/paths"),
+        op("nested", "/{{paths.body.path}}", "POST", body={"operations": []}),
+    ])}
+    assert results["nested"] == {"id": "nested", "status": 400, "body": {"detail": "Batches cannot be nested"}}
+    assert [path for _, path, _, _ in app.calls] == ["/api/paths"]
+
+
+def test_unresolvable_reference_is_a_400_for_that_operation():
+    app = RecordingApp({"/api/sessions": (200, {"id": "s1"})})
+    results = {r["id"]: r for r in batch(app, [
+        op("create", "/sessions", "POST"),
+        op("get", "/sessions/{{create.body.missing}}"),
+    ])}
+    assert results["create"]["status"] == 200
+    assert results["get"]["status"] == 400
+
+
+class FailingApp(RecordingApp):
+    """Raises for one path, like a handler bug escaping the app."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["path"] == "/api/broken":
+            raise RuntimeError("handler bug")
+        await super().__call__(scope, receive, send)
+
+
+def test_operation_that_raises_is_a_500_for_that_operation():
+    app = FailingApp({"/api/sessions": (200, {"id": "s1"})}, delay=0.05)
+    results = {r["id"]: r for r in batch(app, [
+        op("create", "/sessions", "POST"),
+        op("broken", "/broken", "POST"),
+        op("after", "/sessions/{{broken.body.id}}"),
+    ])}
+    assert results["create"] == {"id": "create", "status": 200, "body": {"id": "s1"}}
+    assert results["broken"] == {"id": "broken", "status": 500, "body": {"detail": "Internal Server Error"}}
+    assert results["after"]["status"] == 424
@@ -0,0 +1,177 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from changelog import ChangeLog, diff_artifact
+
+
+def change_log(**kw) -> ChangeLog:
+    kw.setdefault("retention_seconds", 3600)
+    kw.setdefault("max_entries", 100)
+    return ChangeLog(AsyncMongoMockClient().db, **kw)
+
+
+def card(card_id: str, text: str = "") -> dict:
+    return {"id": card_id, "text": text}
+
+
+def test_diff_sets_plain_fields():
+    assert diff_artifact({"title": "a", "notes": "x"}, {"title": "b", "notes": "x"}) == [
+        {"op": "set", "field": "title", "value": "b"}
+    ]
+    assert diff_artifact(None, {"title": "a"}) == [{"op": "set", "field": "title", "value": "a"}]
+    assert diff_artifact({"title": "a"}, {}) == [{"op": "set", "field": "title", "value": None}]
+
+
+def test_diff_ignores_fields():
+    assert diff_artifact({"updated_at": "1", "revision": 1}, {"updated_at": "2", "revision": 2},
+                         ignore=("updated_at", "revision")) == []
+
+
+def test_diff_upserts_changed_and_new_items():
+    before = {"cards": [card("a", "one"), card("b", "two")]}
+    after = {"cards": [card("a", "one"), card("b", "TWO"), card("c", "three")]}
+    assert diff_artifact(before, after) == [
+        {"op": "upsert", "field": "cards", "index": 1, "item": card("b", "TWO")},
+        {"op": "upsert", "field": "cards", "index": 2, "item": card("c", "three")},
+    ]
+
+
+def test_diff_removes_items_without_reordering():
+    before = {"cards": [card("a"), card("b"), card("c")]}
+    after = {"cards": [card("a"), card("c")]}
+    assert diff_artifact(before, after) == [{"op": "remove", "field": "cards", "id": "b"}]
+
+
+def test_diff_orders_moved_items():
+    before = {"cards": [card("a"), card("b"), card("c")]}
+    after = {"cards": [card("c"), card("a"), card("b")]}
+    assert diff_artifact(before, after) == [{"op": "order", "field": "cards", "ids": ["c", "a", "b"]}]
+
+
+def test_diff_inserting_in_the_middle_is_not_a_reorder():
+    before = {"cards": [card("a"), card("b")]}
+    after = {"cards": [card("a"), card("new"), card("b")]}
+    assert diff_artifact(before, after) == [{"op": "upsert", "field": "cards", "index": 1, "item": card("new")}]
+
+
+def test_diff_new_item_list():
+    assert diff_artifact({}, {"cards": [card("a")]}) == [
+        {"op": "upsert", "field": "cards", "index": 0, "item": card("a")}
+    ]
+
+
+def test_diff_sets_lists_without_ids():
+    assert diff_artifact({"tags": ["a"]}, {"tags": ["a", "b"]}) == [{"op": "set", "field": "tags", "value": ["a", "b"]}]
+    # A list of plain values replaced by items is not diffable item by item
+    assert diff_artifact({"cards": ["a"]}, {"cards": [card("a")]}) == [
+        {"op": "set", "field": "cards", "value": [card("a")]}
+    ]
+
+
+def test_since_returns_changes_in_order():
+    async def run():
+        log = change_log()
+        for text in ("one", "two", "three"):
+            await log.record("s", "ideas_boards", "b", 1, [{"op": "set", "field": "title", "value": text}], "u")
+        result = await log.since("s", 0, limit=2)
+        assert [entry["seq"] for entry in result["changes"]] == [1, 2]
+        assert result["seq"] == 2 and result["more"] and not result["reset"]
+        result = await log.since("s", result["seq"], limit=2)
+        assert [entry["changes"][0]["value"] for entry in result["changes"]] == ["three"]
+        assert result["seq"] == 3 and not result["more"]
+        assert await log.since("s", 3, limit=2) == {"seq": 3, "reset": False, "more": False, "changes": []}
+
+    asyncio.run(run())
+
+
+def test_since_ahead_of_the_log_resets():
+    async def run():
+        log = change_log()
+        assert (await log.since("s", 5, limit=10))["reset"]
+
+    asyncio.run(run())
+
+
+def test_since_waits_for_a_change():
+    async def run():
+        log = change_log(poll_interval=5.0)
+        waiting = asyncio.create_task(log.since("s", 0, limit=10, wait=2.0))
+        await asyncio.sleep(0.05)
+        await log.record("s", "ideas_boards", "b", 1, [{"op": "set", "field": "title", "value": "x"}], "u")
+        result = await asyncio.wait_for(waiting, 1.0)
+        assert [entry["seq"] for entry in result["changes"]] == [1]
+
+    asyncio.run(run())
+
+
+async def insert_entries(log: ChangeLog, seqs, age: timedelta = timedelta()):
+    await log.counters.update_one({"_id": "s"}, {"$max": {"seq": max(seqs)}}, upsert=True)
+    for seq in seqs:
+        await log.entries.insert_one({
+            "session_id": "s", "seq": seq, "collection": "ideas_boards", "artifact_id": "b",
+            "revision": seq, "user_id": "u", "changes": [], "created_at": datetime.now(timezone.utc) - age,
+        })
+
+
+def test_since_stops_before_a_recent_gap():
+    async def run():
+        log = change_log(gap_grace_seconds=10)
+        # seq 2 was allocated but its entry is still being written
+        await insert_entries(log, [1, 3])
+        result = await log.since("s", 0, limit=10)
+        assert [entry["seq"] for entry in result["changes"]] == [1]
+        assert result["seq"] == 1 and not result["reset"]
+        result = await log.since("s", 1, limit=10)
+        assert result == {"seq": 1, "reset": False, "more": False, "changes": []}
+
+    asyncio.run(run())
+
+
+def test_since_resets_past_a_lost_gap():
+    async def run():
+        log = change_log(gap_grace_seconds=10)
+        await insert_entries(log, [1, 3], age=timedelta(minutes=1))
+        result = await log.since("s", 1, limit=10)
+        assert result == {"seq": 3, "reset": True, "more": False, "changes": []}
+
+    asyncio.run(run())
+
+
+def test_compact_keeps_the_newest_entries_and_resets_older_cursors():
+    async def run():
+        log = change_log(max_entries=2)
+        for seq in range(5):
+            await log.record("s", "ideas_boards", "b", seq, [{"op": "set", "field": "title", "value": seq}], "u")
+        assert await log.compact() == 3
+        assert (await log.counters.find_one({"_id": "s"}))["compacted_seq"] == 3
+        assert (await log.since("s", 2, limit=10))["reset"]
+        result = await log.since("s", 3, limit=10)
+        assert [entry["seq"] for entry in result["changes"]] == [4, 5] and not result["reset"]
+        assert await log.compact() == 0
+
+    asyncio.run(run())
+
+
+def test_compact_drops_expired_entries():
+    async def run():
+        log = change_log(retention_seconds=60)
+        await insert_entries(log, [1, 2], age=timedelta(minutes=5))
+        await insert_entries(log, [3])
+        assert await log.compact() == 2
+        assert (await log.since("s", 0, limit=10))["reset"]
+        assert [entry["seq"] for entry in (await log.since("s", 2, limit=10))["changes"]] == [3]
+
+    asyncio.run(run())
+
+
+def test_forget_clears_the_session():
+    async def run():
+        log = change_log()
+        await log.record("s", "ideas_boards", "b", 1, [{"op": "set", "field": "title", "value": "x"}], "u")
+        await log.forget(["s"])
+        assert await log.entries.count_documents({}) == 0
+        assert await log.since("s", 0, limit=10) == {"seq": 0, "reset": False, "more": False, "changes": []}
+
+    asyncio.run(run())
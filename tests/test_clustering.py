@@ -0,0 +1,121 @@
+import random
+import time
+
+import numpy as np
+import pytest
+
+from clustering import CardClusters, leader_clusters, terms
+
+CARDS = [
+    {"id": "dark-1", "text": "Add a dark mode for night use"},
+    {"id": "dark-2", "text": "Dark mode for night use"},
+    {"id": "dark-3", "text": "Please add dark mode, for use at night"},
+    {"id": "pdf-1", "text": "Export the board as a PDF report"},
+    {"id": "pdf-2", "text": "PDF report export of the board"},
+    {"id": "timer", "text": "Workshop timer with sound"},
+]
+
+
+def cluster(items=CARDS, threshold=0.35, min_size=2, only=None):
+    return CardClusters().cluster("ideas_boards", "s", items, threshold, min_size, only)
+
+
+def test_terms_drop_stop_words_and_fold_plurals():
+    assert terms("The reports of the boards") == ["report", "board", "report board"]
+
+
+def test_near_duplicates_cluster_and_unrelated_cards_do_not():
+    clusters, unclustered = cluster()
+    assert sorted(sorted(c["item_ids"]) for c in clusters) == [["dark-1", "dark-2", "dark-3"], ["pdf-1", "pdf-2"]]
+    assert unclustered == ["timer"]
+    dark = next(c for c in clusters if "dark-1" in c["item_ids"])
+    assert dark["size"] == 3 and dark["representative_id"] in dark["item_ids"]
+    # Labelled with terms the cards share
+    texts = [terms(card["text"]) for card in CARDS if card["id"] in dark["item_ids"]]
+    assert dark["terms"] and all(sum(term in t for t in texts) > 1 for term in dark["terms"])
+    assert dark["label"] == ", ".join(dark["terms"])
+
+
+def test_threshold_controls_how_similar_cards_must_be():
+    clusters, unclustered = cluster(threshold=0.99)
+    assert clusters == [] and sorted(unclustered) == sorted(card["id"] for card in CARDS)
+    clusters, _ = cluster(threshold=0.01)
+    assert sum(c["size"] for c in clusters) >= 5
+
+
+def test_min_size_drops_small_clusters():
+    clusters, unclustered = cluster(min_size=3)
+    assert [sorted(c["item_ids"]) for c in clusters] == [["dark-1", "dark-2", "dark-3"]]
+    assert sorted(unclustered) == ["pdf-1", "pdf-2", "timer"]
+
+
+def test_min_size_one_puts_every_card_in_a_cluster():
+    clusters, unclustered = cluster(min_size=1)
+    assert unclustered == []
+    assert ["timer"] in [c["item_ids"] for c in clusters]
+    assert sum(c["size"] for c in clusters) == len(CARDS)
+
+
+def test_only_restricts_the_cards_clustered():
+    clusters, unclustered = cluster(only=["dark-1", "dark-2", "timer", "unknown"])
+    assert [sorted(c["item_ids"]) for c in clusters] == [["dark-1", "dark-2"]]
+    assert unclustered == ["timer"]
+
+
+def test_cached_board_follows_edits_and_removals():
+    clusters = CardClusters()
+    clusters.cluster("ideas_boards", "s", CARDS, 0.35)
+    edited = [{**card, "text": "Export the board as a PDF report"} if card["id"] == "timer" else card
+              for card in CARDS if card["id"] != "dark-3"]
+    found, unclustered = clusters.cluster("ideas_boards", "s", edited, 0.35)
+    assert sorted(sorted(c["item_ids"]) for c in found) == [["dark-1", "dark-2"], ["pdf-1", "pdf-2", "timer"]]
+    assert unclustered == []
+
+
+def test_leader_clusters_take_the_best_connected_card_first():
+    close = np.array([
+        [1, 1, 0, 0],
+        [1, 1, 1, 1],
+        [0, 1, 1, 0],
+        [0, 1, 0, 1],
+    ], dtype=bool)
+    assert [(leader, list(members)) for leader, members in leader_clusters(close)] == [(1, [0, 1, 2, 3])]
+
+
+def test_large_board_clusters_quickly():
+    """Guards the complexity, not the exact numbers from bench_clustering.py (about 0.2s here)."""
+    random.seed(1)
+    topics = ["dark mode night theme", "export pdf report", "offline mobile sync", "invite share link"]
+    words = "customer vote comment template workshop timer print zoom".split()
+    cards = [
+        {"id": str(i), "text": " ".join(random.sample(random.choice(topics).split(), 2) + random.sample(words, 3))}
+        for i in range(3000)
+    ]
+    clusters = CardClusters()
+    clusters.cluster("ideas_boards", "s", cards, 0.35)
+    started = time.perf_counter()
+    found, _ = clusters.cluster("ideas_boards", "s", cards, 0.35)
+    assert time.perf_counter() - started < 3
+    assert sum(c["size"] for c in found) > 2000
+
+
+@pytest.mark.parametrize("min_size", [2, 1])
+def test_clusters_route(api, register, min_size):
+    owner, outsider = register("owner"), register("outsider")
+    project = api.post("/api/projects", json={"name": "P"}, headers=owner["headers"]).json()
+    session = api.post("/api/sessions", json={"project_id": project["id"], "name": "S"}, headers=owner["headers"]).json()
+    ideas = [{**card, "category": "pdf" if card["id"].startswith("pdf") else "general"} for card in CARDS]
+    api.post("/api/ideas-boards", json={"session_id": session["id"], "ideas": ideas}, headers=owner["headers"])
+
+    url = f"/api/ideas-boards/{session['id']}/clusters?min_size={min_size}"
+    response = api.get(url, headers=owner["headers"])
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["threshold"] == 0.35
+    assert ["dark-1", "dark-2", "dark-3"] in [sorted(c["item_ids"]) for c in body["clusters"]]
+    assert body["unclustered_ids"] == ([] if min_size == 1 else ["timer"])
+
+    body = api.get(url + "&category=pdf", headers=owner["headers"]).json()
+    assert [sorted(c["item_ids"]) for c in body["clusters"]] == [["pdf-1", "pdf-2"]]
+    assert api.get(url + "&threshold=0", headers=owner["headers"]).status_code == 422
+    assert api.get(url, headers=outsider["headers"]).status_code == 404
@@ -0,0 +1,110 @@
+import base64
+import json
+import os
+import uuid
+
+import pytest
+
+import server
+
+USER = {"id": "user-1"}
+
+PROJECTS = [
+    {"id": f"project-{n}", "name": f"Project {n}", "description": "", "owner_id": owner,
+     "created_at": f"2026-01-0{n}T00:00:00+00:00", "updated_at": f"2026-01-0{n}T00:00:00+00:00"}
+    for n, owner in [(1, "user-1"), (2, "user-1"), (3, "user-2"), (4, "user-1")]
+]
+
+SESSIONS = [
+    {"id": "s1", "project_id": "project-1", "name": "Kickoff", "member_ids": ["user-1"], "current_step": 2,
+     "archived_at": None, "updated_at": "2026-02-01T00:00:00+00:00"},
+    {"id": "s2", "project_id": "project-1", "name": "Review", "member_ids": ["user-1", "user-2"], "current_step": 5,
+     "archived_at": None, "updated_at": "2026-02-02T00:00:00+00:00"},
+    # Someone else's session in the user's project is neither listed nor counted
+    {"id": "s3", "project_id": "project-1", "name": "Private", "member_ids": ["user-2"], "current_step": 0,
+     "archived_at": None, "updated_at": "2026-03-01T00:00:00+00:00"},
+    {"id": "s4", "project_id": "project-3", "name": "Theirs", "member_ids": ["user-1", "user-2"], "current_step": 1,
+     "archived_at": None, "updated_at": "2026-02-01T00:00:00+00:00"},
+]
+
+# An artifact edit after the session row was last updated
+COUNTERS = [{"_id": "s1", "session_id": "s1", "seq": 4, "updated_at": "2026-02-10T00:00:00+00:00"}]
+
+
+def cursor(position) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+@pytest.fixture
+def strings_encoding(monkeypatch):
+    monkeypatch.setattr(server, "settings", server.Settings(mongo_url="mongodb://localhost", db_name="test"))
+
+
+def test_dashboard_pipeline_pages_on_created_at_and_id(strings_encoding):
+    after = {"created_at": "2026-01-02T00:00:00+00:00", "id": "project-2", "oid": None}
+    pipeline = server.dashboard_pipeline(USER, 2, after)
+    assert pipeline[0]["$match"] == {"owner_id": "user-1", "$or": [
+        {"created_at": {"$lt": after["created_at"]}},
+        {"created_at": after["created_at"], "id": {"$lt": "project-2"}},
+    ]}
+    assert {"$limit": 3} in pipeline
+    lookup = next(stage["$lookup"] for stage in pipeline if "$lookup" in stage)
+    assert lookup["pipeline"][0] == {"$match": {"member_ids": "user-1"}}
+    assert lookup["pipeline"][1]["$lookup"]["foreignField"] == "_id"
+
+
+@pytest.mark.parametrize("value", [
+    "not base64!",
+    cursor(["2026-01-01"]),
+    cursor({"id": "project-1"}),
+    cursor({"created_at": "yesterday", "id": "project-1"}),
+    cursor({"created_at": "2026-01-01T00:00:00+00:00", "id": "project-1", "oid": "nope"}),
+])
+def test_invalid_cursor_is_rejected(api, register, value):
+    user = register("owner")
+    response = api.get("/api/dashboard", params={"cursor": value}, headers=user["headers"])
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.fixture
+def mongo_db(strings_encoding):
+    # The dashboard joins with $lookup sub-pipelines and $first, which mongomock does not implement
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL is not set")
+    from pymongo import MongoClient
+    client = MongoClient(url, serverSelectionTimeoutMS=2000)
+    database = client[f"test_dashboard_{uuid.uuid4().hex[:8]}"]
+    database.projects.insert_many([dict(p) for p in PROJECTS])
+    database.sessions.insert_many([dict(s) for s in SESSIONS])
+    database.session_change_counters.insert_many([dict(c) for c in COUNTERS])
+    yield database
+    client.drop_database(database.name)
+    client.close()
+
+
+def test_dashboard_summarises_the_users_projects(mongo_db):
+    projects = list(mongo_db.projects.aggregate(server.dashboard_pipeline(USER, 10, None)))
+    assert [p["id"] for p in projects] == ["project-4", "project-2", "project-1"]
+    kickoff = {p["id"]: p for p in projects}["project-1"]
+    assert kickoff["session_count"] == 2
+    # Sessions newest activity first, counting artifact edits recorded in the change log
+    assert [(s["id"], s["last_activity_at"]) for s in kickoff["sessions"]] == [
+        ("s1", "2026-02-10T00:00:00+00:00"), ("s2", "2026-02-02T00:00:00+00:00"),
+    ]
+    assert kickoff["last_activity_at"] == "2026-02-10T00:00:00+00:00"
+    empty = {p["id"]: p for p in projects}["project-2"]
+    assert empty["session_count"] == 0 and empty["sessions"] == []
+    assert empty["last_activity_at"] == empty["updated_at"]
+
+
+def test_dashboard_pages_cover_every_project_once(mongo_db):
+    seen, after = [], None
+    while True:
+        page = list(mongo_db.projects.aggregate(server.dashboard_pipeline(USER, 1, after)))
+        seen.append(page[0]["id"])
+        if len(page) == 1:
+            break
+        after = {"created_at": page[0]["created_at"], "id": page[0]["id"], "oid": str(page[0]["oid"])}
+    assert seen == ["project-4", "project-2", "project-1"]
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import time
+
+import pytest
+from pymongo import _csot
+from pymongo.errors import ExecutionTimeout, OperationFailure, WaitQueueTimeoutError
+from starlette.routing import Route
+
+import deadlines
+from deadlines import DeadlineMiddleware, LoadMonitor, parse_route_timeouts
+
+
+class App:
+    """ASGI app that sleeps, optionally raises, and records what it saw of the deadline."""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.seen = []
+        self.cancelled = False
+
+    async def __call__(self, scope, receive, send):
+        self.seen.append((deadlines.remaining(), _csot.get_timeout()))
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def middleware(app, monitor: LoadMonitor = None, default_ms: float = 200, route_timeouts=None) -> DeadlineMiddleware:
+    routes = [Route("/api/jobs/{job_id}/result", lambda request: None)]
+    return DeadlineMiddleware(app, monitor or LoadMonitor(), default_ms, routes, route_timeouts)
+
+
+async def call(asgi, path: str = "/api/sessions", disconnect_after: float = None) -> dict:
+    response = {"status": None, "headers": {}, "body": b""}
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = dict(message["headers"])
+        else:
+            response["body"] += message.get("body", b"")
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [], "query_string": b""}
+    await asyncio.wait_for(asyncio.create_task(asgi(scope, receive, send)), 5)
+    return response
+
+
+def test_parse_route_timeouts():
+    assert parse_route_timeouts("get /api/jobs/{job_id}/result=300000, POST /api/batch=20000,") == {
+        ("GET", "/api/jobs/{job_id}/result"): 300000.0,
+        ("POST", "/api/batch"): 20000.0,
+    }
+    assert parse_route_timeouts("") == {}
+
+
+def test_handler_sees_the_deadline_as_remaining_time_and_mongo_timeout():
+    app = App()
+    response = asyncio.run(call(middleware(app, default_ms=200)))
+    assert response["status"] == 200
+    remaining, mongo_timeout = app.seen[0]
+    assert 0.1 < remaining <= 0.2 and mongo_timeout == 0.2
+    assert deadlines.remaining() is None
+
+
+def test_slow_handler_is_cancelled_with_504():
+    app, monitor = App(delay=1.0), LoadMonitor()
+    started = time.monotonic()
+    response = asyncio.run(call(middleware(app, monitor, default_ms=100)))
+    assert time.monotonic() - started < 0.5
+    assert response["status"] == 504
+    assert json.loads(response["body"]) == {"detail": "Request deadline exceeded"}
+    assert app.cancelled and monitor.counters["deadline_exceeded"] == 1 and monitor.in_flight == 0
+
+
+def test_route_timeout_overrides_the_default():
+    app = App(delay=0.2)
+    asgi = middleware(app, default_ms=100, route_timeouts={("GET", "/api/jobs/{job_id}/result"): 1000})
+    assert asyncio.run(call(asgi, "/api/jobs/j1/result"))["status"] == 200
+    assert app.seen[0][1] == 1.0
+    assert asyncio.run(call(asgi, "/api/jobs/j1"))["status"] == 504
+
+
+def test_nested_requests_keep_the_outer_deadline():
+    inner = App()
+    outer_app = middleware(inner, default_ms=1000)
+
+    async def run():
+        token = deadlines._deadline.set(time.monotonic() + 0.05)
+        try:
+            return await call(outer_app)
+        finally:
+            deadlines._deadline.reset(token)
+
+    assert asyncio.run(run())["status"] == 200
+    assert inner.seen[0][0] <= 0.05
+
+
+def test_client_disconnect_cancels_the_handler_without_a_response():
+    app, monitor = App(delay=1.0), LoadMonitor()
+    response = asyncio.run(call(middleware(app, monitor, default_ms=2000), disconnect_after=0.05))
+    assert response["status"] is None
+    assert app.cancelled and monitor.counters["cancelled_disconnect"] == 1
+
+
+@pytest.mark.parametrize("error, status, counter", [
+    (ExecutionTimeout("operation exceeded time limit", 50), 504, "mongo_timeout"),
+    (WaitQueueTimeoutError("timed out waiting for a connection"), 503, "shed_mongo_pool"),
+])
+def test_mongo_timeouts_become_error_responses(error, status, counter):
+    monitor = LoadMonitor()
+    response = asyncio.run(call(middleware(App(error=error), monitor)))
+    assert response["status"] == status and monitor.counters[counter] == 1
+    assert (b"retry-after" in response["headers"]) is (status == 503)
+
+
+def test_other_mongo_errors_are_raised():
+    with pytest.raises(OperationFailure):
+        asyncio.run(call(middleware(App(error=OperationFailure("bad query", 2)))))
+
+
+@pytest.mark.parametrize("settings, reason", [
+    ({"in_flight": 2, "max_in_flight": 2}, "in_flight"),
+    ({"loop_lag_ms": 80.0, "max_loop_lag_ms": 50}, "loop_lag"),
+])
+def test_overloaded_worker_sheds_requests_with_503(settings, reason):
+    app, monitor = App(), LoadMonitor()
+    for name, value in settings.items():
+        setattr(monitor, name, value)
+    response = asyncio.run(call(middleware(app, monitor)))
+    assert response["status"] == 503 and response["headers"][b"retry-after"] == b"1"
+    assert app.seen == [] and monitor.counters[f"shed_{reason}"] == 1
+
+
+def test_loop_lag_is_measured_from_a_blocked_loop():
+    async def run():
+        monitor = LoadMonitor(max_loop_lag_ms=50, sample_interval=0.01)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            assert monitor.shed_reason() is None
+            time.sleep(0.5)  # a handler blocking the event loop
+            await asyncio.sleep(0.02)
+            assert monitor.loop_lag_ms > 50 and monitor.shed_reason() == "loop_lag"
+        finally:
+            await monitor.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,141 @@
+import uuid
+from datetime import datetime, timezone
+
+import bson
+import mongomock
+import pytest
+from bson.binary import Binary
+
+import server
+from encoding import CODEC_OPTIONS, decode, encode_date, encode_document, encode_filter, encode_id, encode_pipeline, encode_update
+
+ID = str(uuid.uuid4())
+OTHER = str(uuid.uuid4())
+CREATED = "2026-03-01T09:30:15.123000+00:00"
+
+SESSION = {
+    "id": ID,
+    "project_id": OTHER,
+    "name": "Workshop",
+    "owner_id": OTHER,
+    "member_ids": [OTHER, ID],
+    "current_step": 2,
+    "created_at": CREATED,
+    "updated_at": CREATED,
+    "archived_at": None,
+    "tools": {
+        "feedback": {"id": OTHER, "items": [{"id": ID, "text": "kept as written", "type": "like"}], "created_at": CREATED},
+    },
+}
+
+
+def test_ids_are_stored_as_binary_uuids():
+    assert encode_id(ID) == Binary.from_uuid(uuid.UUID(ID))
+    # Only canonical uuid strings: anything else would not decode back to what was sent
+    for value in (ID.upper(), "not-a-uuid", ID.replace("-", ""), "", None, 7):
+        assert encode_id(value) == value
+
+
+def test_only_utc_timestamps_become_dates():
+    assert encode_date(CREATED) == datetime(2026, 3, 1, 9, 30, 15, 123000, tzinfo=timezone.utc)
+    assert encode_date("2026-03-01T09:30:15.123456+00:00").microsecond == 123000
+    for value in ("2026-03-01T09:30:15+02:00", "2026-03-01T09:30:15", "yesterday", None):
+        assert encode_date(value) == value
+
+
+def test_document_round_trip_through_bson():
+    stored = encode_document(SESSION)
+    assert isinstance(stored["id"], Binary) and isinstance(stored["member_ids"][1], Binary)
+    assert isinstance(stored["tools"]["feedback"]["created_at"], datetime)
+    # Items inside artifacts keep their ids as strings
+    assert stored["tools"]["feedback"]["items"][0]["id"] == ID
+    read = bson.decode(bson.encode(stored), codec_options=CODEC_OPTIONS)
+    assert decode(read) == SESSION
+    assert len(bson.encode(stored)) < len(bson.encode(SESSION))
+
+
+def test_filters_are_encoded():
+    assert encode_filter({"id": ID, "member_ids": OTHER, "name": "x"}) == {
+        "id": encode_id(ID), "member_ids": encode_id(OTHER), "name": "x"
+    }
+    assert encode_filter({"$or": [{"session_id": {"$in": [ID, "legacy"]}}, {"created_at": {"$lt": CREATED}}]}) == {
+        "$or": [{"session_id": {"$in": [encode_id(ID), "legacy"]}}, {"created_at": {"$lt": encode_date(CREATED)}}]
+    }
+    assert encode_filter({"owner_id": {"$exists": False}}) == {"owner_id": {"$exists": False}}
+
+
+def test_dual_filters_match_either_encoding():
+    assert encode_filter({"id": ID}, dual=True) == {"$and": [{"id": {"$in": [encode_id(ID), ID]}}]}
+    assert encode_filter({"id": {"$ne": ID}}, dual=True) == {"$and": [{"id": {"$nin": [encode_id(ID), ID]}}]}
+    assert encode_filter({"created_at": {"$lt": CREATED}}, dual=True) == {"$and": [{"$or": [
+        {"created_at": {"$lt": encode_date(CREATED)}}, {"created_at": {"$lt": CREATED}},
+    ]}]}
+    # Fields without encoded values are left alone
+    assert encode_filter({"name": "x", "current_step": {"$gte": 1}}, dual=True) == {"name": "x", "current_step": {"$gte": 1}}
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({"id": ID}, {"strings", "compact"}),
+    ({"member_ids": OTHER}, {"strings", "compact"}),
+    ({"member_ids": {"$in": [OTHER, str(uuid.uuid4())]}}, {"strings", "compact"}),
+    ({"id": {"$ne": ID}}, {"other"}),
+    ({"created_at": {"$lte": CREATED}}, {"strings", "compact"}),
+    ({"created_at": {"$gt": CREATED}}, {"other"}),
+    ({"id": {"$not": {"$in": [ID]}}}, {"other"}),
+    ({"$or": [{"id": ID}, {"name": "other"}]}, {"strings", "compact", "other"}),
+])
+def test_dual_filters_against_mixed_documents(query, expected):
+    collection = mongomock.MongoClient().db.sessions
+    collection.insert_many([
+        {**SESSION, "name": "strings"},
+        {**encode_document(SESSION), "name": "compact"},
+        {**SESSION, "id": str(uuid.uuid4()), "member_ids": [], "name": "other", "created_at": "2026-03-02T00:00:00+00:00"},
+    ])
+    assert {doc["name"] for doc in collection.find(encode_filter(query, dual=True))} == expected
+
+
+def test_updates_are_encoded():
+    assert encode_update({"$set": {"updated_at": CREATED, "tools.feedback.id": ID, "name": "x"}}) == {
+        "$set": {"updated_at": encode_date(CREATED), "tools.feedback.id": encode_id(ID), "name": "x"}
+    }
+    assert encode_update({"$addToSet": {"member_ids": {"$each": [ID]}}, "$pull": {"member_ids": OTHER}}) == {
+        "$addToSet": {"member_ids": {"$each": [encode_id(ID)]}}, "$pull": {"member_ids": encode_id(OTHER)}
+    }
+    assert encode_update({"$inc": {"seq": 1}}) == {"$inc": {"seq": 1}}
+
+
+def test_dual_upserts_store_their_filter_fields_encoded():
+    update = encode_update({"$set": {"items": []}}, dual=True, upsert_filter={"session_id": ID, "name": "x"})
+    assert update == {"$set": {"items": []}, "$setOnInsert": {"session_id": encode_id(ID)}}
+    # Fields the update sets itself are not duplicated
+    update = encode_update({"$set": {"session_id": ID}}, dual=True, upsert_filter={"session_id": ID})
+    assert "$setOnInsert" not in update
+
+
+def test_pipelines_encode_match_stages():
+    pipeline = encode_pipeline([
+        {"$match": {"owner_id": ID}},
+        {"$lookup": {"from": "sessions", "localField": "id", "foreignField": "project_id", "as": "s",
+                     "pipeline": [{"$match": {"member_ids": ID}}]}},
+        {"$project": {"_id": 0}},
+    ])
+    assert pipeline[0] == {"$match": {"owner_id": encode_id(ID)}}
+    assert pipeline[1]["$lookup"]["pipeline"] == [{"$match": {"member_ids": encode_id(ID)}}]
+    assert pipeline[2] == {"$project": {"_id": 0}}
+
+
+@pytest.mark.parametrize("encoding", ["strings", "dual"])
+def test_dashboard_pages_on_dates_while_migrating(monkeypatch, encoding):
+    monkeypatch.setattr(server, "settings", server.Settings(mongo_url="mongodb://localhost", db_name="test", storage_encoding=encoding))
+    after = {"created_at": "2026-03-01T09:30:15.123456+00:00", "id": ID, "oid": "65e1a0b7f1d2c3a4b5c6d7e8"}
+    pipeline = server.dashboard_pipeline({"id": OTHER}, 20, after)
+    sort = next(stage["$sort"] for stage in pipeline if "$sort" in stage)
+    if encoding == "strings":
+        assert sort == {"created_at": -1, "id": -1}
+        return
+    # Strings and dates would otherwise sort as two separate groups
+    assert pipeline[1] == {"$set": {"_created": {"$toDate": "$created_at"}}}
+    assert sort == {"_created": -1, "_id": -1}
+    position = pipeline[2]["$match"]["$or"]
+    assert position[0] == {"_created": {"$lt": datetime(2026, 3, 1, 9, 30, 15, 123000, tzinfo=timezone.utc)}}
+    assert position[1]["_id"] == {"$lt": bson.ObjectId(after["oid"])}
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+import deadlines
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+
+
+def store(**kw) -> IdempotencyStore:
+    return IdempotencyStore(AsyncMongoMockClient().db.idempotency_keys, ttl_seconds=3600, wait_seconds=0.2, **kw)
+
+
+def test_claim_waits_for_a_live_claim():
+    async def run():
+        keys = store()
+        assert await keys.claim("k", "hash") is None
+        record = await keys.claim("k", "hash")
+        assert record == {"state": "pending", "request_hash": "hash"}
+
+    asyncio.run(run())
+
+
+def test_claim_takes_over_an_expired_lease():
+    async def run():
+        keys = store()
+        # Left behind by a worker that died mid-request
+        await keys.collection.insert_one({
+            "_id": "k", "state": "pending", "request_hash": "old",
+            "created_at": datetime.now(timezone.utc) - timedelta(minutes=5),
+            "locked_until": datetime.now(timezone.utc) - timedelta(seconds=1),
+        })
+        assert await keys.claim("k", "hash") is None
+        record = await keys.collection.find_one({"_id": "k"})
+        assert record["request_hash"] == "hash"
+        assert record["locked_until"].replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+
+    asyncio.run(run())
+
+
+def test_renewed_lease_is_not_taken_over():
+    async def run():
+        keys = store(lease_seconds=0.15)
+        assert await keys.claim("k", "hash") is None
+        renewal = asyncio.create_task(keys.renew("k"))
+        try:
+            await asyncio.sleep(0.3)
+            assert await keys.claim("k", "hash") == {"state": "pending", "request_hash": "hash"}
+        finally:
+            renewal.cancel()
+
+    asyncio.run(run())
+
+
+def test_done_record_is_returned():
+    async def run():
+        keys = store()
+        assert await keys.claim("k", "hash") is None
+        await keys.complete("k", {"state": "done", "request_hash": "hash", "status": 201, "headers": [], "body": "{}"})
+        keys._cache.clear()
+        record = await keys.claim("k", "hash")
+        assert record["state"] == "done" and record["status"] == 201
+
+    asyncio.run(run())
+
+
+class SlowApp:
+    """Answers after `delay` seconds with the next of `statuses`."""
+
+    def __init__(self, *statuses: int, delay: float = 0.1):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        await asyncio.sleep(self.delay)
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": json.dumps({"call": self.calls}).encode()})
+
+
+def middleware(app, keys: IdempotencyStore) -> IdempotencyMiddleware:
+    return IdempotencyMiddleware(app, routes=[("POST", "/api/things")], store=lambda: keys, user_of=lambda auth: "u")
+
+
+async def post(asgi, deadline: float = None) -> dict:
+    scope = {"type": "http", "method": "POST", "path": "/api/things",
+             "headers": [(b"idempotency-key", b"k"), (b"authorization", b"Bearer t")]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    if deadline is not None:
+        deadlines._deadline.set(time.monotonic() + deadline)
+    await asgi(scope, receive, send)
+    body = b"".join(m.get("body", b"") for m in sent if m["type"] == "http.response.body")
+    return {"status": sent[0]["status"], "body": json.loads(body)}
+
+
+def test_duplicate_replays_the_first_response():
+    async def run():
+        app = SlowApp(201)
+        asgi = middleware(app, store())
+        first, second = await asyncio.gather(post(asgi), post(asgi))
+        assert first == second == {"status": 201, "body": {"call": 1}}
+        assert app.calls == 1
+
+    asyncio.run(run())
+
+
+def test_duplicate_reruns_a_request_that_failed():
+    async def run():
+        app = SlowApp(500, 201)
+        asgi = middleware(app, store())
+        first, second = await asyncio.gather(post(asgi), post(asgi))
+        assert first["status"] == 500
+        assert second == {"status": 201, "body": {"call": 2}}
+
+    asyncio.run(run())
+
+
+def test_duplicate_of_a_cancelled_request_is_told_to_retry():
+    async def run():
+        asgi = middleware(SlowApp(201, delay=5), store())
+        first = asyncio.create_task(post(asgi))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(post(asgi))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        assert (await asyncio.wait_for(second, 1))["status"] == 409
+
+    asyncio.run(run())
+
+
+def test_duplicate_waits_no_longer_than_its_deadline():
+    async def run():
+        asgi = middleware(SlowApp(201, delay=5), store())
+        first = asyncio.create_task(post(asgi))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        assert (await post(asgi, deadline=0.2))["status"] == 409
+        assert time.monotonic() - started < 1
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+
+    asyncio.run(run())
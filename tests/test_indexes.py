@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import OperationFailure
+
+from indexes import INDEX_OPTIONS_CONFLICT, ensure_ttl_index
+
+
+class ConflictingCollection:
+    """A collection whose TTL index already exists with another lifetime, as MongoDB reports it."""
+
+    name = "session_activity"
+
+    def __init__(self, code=INDEX_OPTIONS_CONFLICT):
+        self.code = code
+        self.commands = []
+        self.database = self
+
+    async def create_index(self, *args, **kwargs):
+        raise OperationFailure("Index with name: created_at_1 already exists with different options", code=self.code)
+
+    async def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+
+def test_ttl_index_is_created():
+    async def run():
+        collection = AsyncMongoMockClient().db.events
+        await ensure_ttl_index(collection, "created_at", 60)
+        info = await collection.index_information()
+        assert info["created_at_1"]["expireAfterSeconds"] == 60
+
+    asyncio.run(run())
+
+
+def test_changed_lifetime_is_applied_with_coll_mod():
+    async def run():
+        collection = ConflictingCollection()
+        await ensure_ttl_index(collection, "created_at", 86400)
+        assert collection.commands == [(
+            ("collMod", "session_activity"),
+            {"index": {"keyPattern": {"created_at": 1}, "expireAfterSeconds": 86400}},
+        )]
+
+    asyncio.run(run())
+
+
+def test_other_index_errors_are_raised():
+    async def run():
+        collection = ConflictingCollection(code=86)
+        with pytest.raises(OperationFailure):
+            await ensure_ttl_index(collection, "created_at", 60)
+        assert collection.commands == []
+
+    asyncio.run(run())
@@ -0,0 +1,179 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from jobs import JobRunner, utcnow
+
+# JobRunner claims jobs by updating the status it filters on
+pytestmark = pytest.mark.usefixtures("find_and_modify_by_id")
+
+
+def runner(db, **kw) -> JobRunner:
+    kw.setdefault("workers", 1)
+    return JobRunner(db.jobs, **kw)
+
+
+def ago(seconds: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+
+def job(job_id: str, status: str, worker_id: str, heartbeat_at) -> dict:
+    return {"id": job_id, "kind": "echo", "owner_id": "u1", "params": {"value": job_id}, "status": status,
+            "progress": 0.0, "result": None, "error": None, "attempts": 1, "worker_id": worker_id,
+            "heartbeat_at": heartbeat_at, "created_at": ago(600), "updated_at": ago(600)}
+
+
+async def echo(job: dict, progress) -> dict:
+    await progress(0.5)
+    return {"value": job["params"]["value"]}
+
+
+async def finished(db, job_id: str, timeout: float = 2.0) -> dict:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        stored = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+        if stored["status"] in ("done", "failed", "cancelled") or asyncio.get_running_loop().time() > deadline:
+            return stored
+        await asyncio.sleep(0.01)
+
+
+def test_submitted_job_runs_to_completion():
+    async def run():
+        db = AsyncMongoMockClient().db
+        jobs = runner(db)
+        jobs.register("echo", echo)
+
+        async def broken(job, progress):
+            raise ValueError("bad input")
+
+        jobs.register("broken", broken)
+        await jobs.start()
+        try:
+            done = await finished(db, (await jobs.submit("echo", "u1", {"value": 1}))["id"])
+            failed = await finished(db, (await jobs.submit("broken", "u1", {}))["id"])
+        finally:
+            await jobs.stop()
+        assert done["status"] == "done" and done["result"] == {"value": 1} and done["progress"] == 1.0
+        assert done["attempts"] == 1 and done["heartbeat_at"] is None
+        assert failed["status"] == "failed" and failed["error"] == "bad input"
+
+    asyncio.run(run())
+
+
+def test_start_takes_over_jobs_whose_owner_stopped_heartbeating():
+    async def run():
+        db = AsyncMongoMockClient().db
+        await db.jobs.insert_many([
+            job("crashed-running", "running", "gone:1", ago(120)),
+            job("crashed-queued", "queued", "gone:1", ago(120)),
+            job("released", "queued", None, None),
+            job("alive", "running", "other:2", utcnow()),
+            job("finished", "done", "gone:1", ago(120)),
+        ])
+        jobs = runner(db, lease_seconds=60)
+        jobs.register("echo", echo)
+        await jobs.start()
+        try:
+            results = {job_id: await finished(db, job_id) for job_id in ("crashed-running", "crashed-queued", "released")}
+        finally:
+            await jobs.stop()
+        for job_id, stored in results.items():
+            assert stored["status"] == "done", job_id
+            assert stored["result"] == {"value": job_id} and stored["worker_id"] == jobs.worker_id
+        assert results["crashed-running"]["attempts"] == 2
+        alive = await db.jobs.find_one({"id": "alive"})
+        assert alive["status"] == "running" and alive["worker_id"] == "other:2"
+        assert (await db.jobs.find_one({"id": "finished"}))["result"] is None
+
+    asyncio.run(run())
+
+
+def test_heartbeat_keeps_a_long_job_from_being_taken_over():
+    async def run():
+        db = AsyncMongoMockClient().db
+        release = asyncio.Event()
+
+        async def slow(job, progress):
+            await release.wait()
+            return {}
+
+        first, second = runner(db, lease_seconds=0.3), runner(db, lease_seconds=0.3)
+        for jobs in (first, second):
+            jobs.register("slow", slow)
+        await first.start()
+        await second.start()
+        try:
+            submitted = await first.submit("slow", "u1", {})
+            # Several leases pass; the second runner keeps looking for stale jobs meanwhile
+            await asyncio.sleep(1.0)
+            running = await db.jobs.find_one({"id": submitted["id"]})
+            assert running["status"] == "running" and running["worker_id"] == first.worker_id
+            assert running["heartbeat_at"] > ago(0.3)
+            release.set()
+            done = await finished(db, submitted["id"])
+        finally:
+            await first.stop()
+            await second.stop()
+        assert done["status"] == "done" and done["attempts"] == 1
+
+    asyncio.run(run())
+
+
+def test_stop_hands_unfinished_jobs_to_the_next_runner():
+    async def run():
+        db = AsyncMongoMockClient().db
+        started = asyncio.Event()
+
+        async def slow(job, progress):
+            started.set()
+            await asyncio.sleep(60)
+
+        first = runner(db)
+        first.register("echo", slow)
+        await first.start()
+        submitted = await first.submit("echo", "u1", {"value": "again"})
+        await started.wait()
+        await first.stop()
+        requeued = await db.jobs.find_one({"id": submitted["id"]})
+        assert requeued["status"] == "queued" and requeued["worker_id"] is None
+
+        # No need to wait out the lease of the runner that stopped
+        second = runner(db, lease_seconds=3600)
+        second.register("echo", echo)
+        await second.start()
+        try:
+            done = await finished(db, submitted["id"])
+        finally:
+            await second.stop()
+        assert done["status"] == "done" and done["result"] == {"value": "again"} and done["attempts"] == 2
+
+    asyncio.run(run())
+
+
+def test_cancel_stops_queued_and_running_jobs():
+    async def run():
+        db = AsyncMongoMockClient().db
+        started = asyncio.Event()
+
+        async def slow(job, progress):
+            started.set()
+            await asyncio.sleep(60)
+
+        jobs = runner(db)
+        jobs.register("slow", slow)
+        await jobs.start()
+        try:
+            running = await jobs.submit("slow", "u1", {})
+            queued = await jobs.submit("slow", "u1", {})
+            await started.wait()
+            assert (await jobs.cancel(queued["id"], "u1"))["status"] == "cancelled"
+            assert (await jobs.cancel(running["id"], "u1"))["cancel_requested"]
+            assert (await finished(db, running["id"]))["status"] == "cancelled"
+            assert await jobs.cancel(running["id"], "someone-else") is None
+        finally:
+            await jobs.stop()
+        assert (await db.jobs.find_one({"id": queued["id"]}))["attempts"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+import os
+import uuid
+
+import pytest
+
+import server
+
+USER = {"id": "user-1"}
+SESSION_ID = "session-1"
+
+IDEAS = [
+    {"id": f"idea-{n}", "text": f"idea {n}", "category": category, "votes": votes}
+    for n, (category, votes) in enumerate([
+        ("general", 3), ("ux", 0), ("general", 5), ("ux", 3), ("perf", None), ("general", 1), ("ux", 5), ("perf", 2),
+    ])
+]
+
+WINDOWS = [
+    {},
+    {"limit": 3},
+    {"offset": 2, "limit": 3},
+    {"offset": 7},
+    {"offset": 20},
+    {"match": "ux"},
+    {"match": "missing"},
+    {"order": "votes"},
+    {"order": "votes", "limit": 4},
+    {"order": "votes", "match": "general", "limit": 2},
+    {"after": "idea-3", "offset": 3, "limit": 2},
+    {"after": "gone", "offset": 4, "limit": 2},
+    {"order": "votes", "after": "idea-6", "offset": 1, "limit": 3},
+]
+
+
+def window(**values) -> dict:
+    return {"offset": 0, "limit": None, "after": None, "order": None, "match": None, **values}
+
+
+@pytest.fixture
+def separate_layout(monkeypatch):
+    monkeypatch.setattr(server, "settings", server.Settings(mongo_url="mongodb://localhost", db_name="test"))
+
+
+@pytest.mark.parametrize("projection", [None, {"_id": 0, "id": 1, "ideas": 1}, {"_id": 0, "id": 1, "ideas_count": {"$size": "$ideas"}}])
+def test_window_pipeline_does_not_return_the_full_list(separate_layout, projection):
+    pipeline = server.window_pipeline("ideas_boards", SESSION_ID, USER, window(limit=2), projection)
+    final = pipeline[-2]["$project"]
+    if projection:
+        assert "ideas" not in final
+        assert final["_window"] == 1
+    else:
+        assert final == {"_id": 0, "ideas": 0}
+
+
+def test_window_in_memory_orders_and_pages():
+    doc = {"ideas": IDEAS}
+    first = server.window_in_memory("ideas_boards", doc, window(order="votes", limit=3))
+    assert [item["id"] for item in first["items"]] == ["idea-2", "idea-6", "idea-0"]
+    assert first["total"] == 8
+    rest = server.window_in_memory("ideas_boards", doc, window(order="votes", after="idea-0", offset=3))
+    assert [item["id"] for item in rest["items"]] == ["idea-3", "idea-7", "idea-5", "idea-1", "idea-4"]
+
+
+@pytest.fixture
+def mongo_collection(separate_layout):
+    # The window pipeline needs MongoDB 5.2+ ($sortArray), which mongomock does not implement
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL is not set")
+    from pymongo import MongoClient
+    client = MongoClient(url, serverSelectionTimeoutMS=2000)
+    collection = client[f"test_windows_{uuid.uuid4().hex[:8]}"].ideas_boards
+    collection.insert_one({"id": "board-1", "session_id": SESSION_ID, "member_ids": [USER["id"]], "ideas": IDEAS})
+    yield collection
+    client.drop_database(collection.database.name)
+    client.close()
+
+
+@pytest.mark.parametrize("values", WINDOWS)
+def test_window_pipeline_matches_window_in_memory(mongo_collection, values):
+    pipeline = server.window_pipeline("ideas_boards", SESSION_ID, USER, window(**values), None)
+    stored = mongo_collection.aggregate(pipeline).next()
+    assert "ideas" not in stored
+    expected = server.window_in_memory("ideas_boards", {"ideas": IDEAS}, window(**values))
+    assert stored["_window"] == expected
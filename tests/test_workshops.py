@@ -0,0 +1,76 @@
+import pytest
+
+
+@pytest.fixture
+def owner(api, register):
+    owner = register("facilitator")
+    owner["project_id"] = api.post("/api/projects", json={"name": "Workshop"}, headers=owner["headers"]).json()["id"]
+    return owner
+
+
+def bulk(api, owner: dict, **workshop):
+    return api.post("/api/sessions/bulk", json={"project_id": owner["project_id"], **workshop}, headers=owner["headers"])
+
+
+def test_sessions_are_numbered_with_their_own_copy_of_the_seeded_tools(api, owner):
+    response = bulk(
+        api, owner, name="Table", count=3, description="Breakout",
+        problem_trees={"core_problem": "Onboarding is slow", "items": [
+            {"id": "root", "text": "Too many forms", "type": "cause"},
+            {"id": "leaf", "text": "Paper forms", "type": "cause", "parent_id": "root"},
+        ]},
+        ideas_boards={"ideas": [{"id": "seed", "text": "Self-service signup"}]},
+    )
+    assert response.status_code == 200, response.text
+    sessions = response.json()
+    assert [s["name"] for s in sessions] == ["Table 1", "Table 2", "Table 3"]
+    assert all(s["description"] == "Breakout" and s["member_ids"] == [owner["id"]] for s in sessions)
+    assert all(set(s["artifact_ids"]) == {"problem_trees", "ideas_boards"} for s in sessions)
+
+    trees = [api.get(f"/api/problem-trees/{s['id']}", headers=owner["headers"]).json() for s in sessions]
+    assert [tree["id"] for tree in trees] == [s["artifact_ids"]["problem_trees"] for s in sessions]
+    assert all(tree["core_problem"] == "Onboarding is slow" and tree["revision"] == 0 for tree in trees)
+    # Items get fresh ids per session, with parent links following them
+    root, leaf = trees[0]["items"]
+    assert leaf["parent_id"] == root["id"] != "root"
+    assert len({tree["items"][0]["id"] for tree in trees}) == 3
+
+    listed = api.get("/api/sessions", headers=owner["headers"]).json()
+    assert {s["id"] for s in listed} == {s["id"] for s in sessions}
+
+
+def test_copies_are_independent(api, owner):
+    first, second = bulk(api, owner, names=["Red", "Blue"], ideas_boards={"ideas": [{"text": "idea"}]}).json()
+    assert [first["name"], second["name"]] == ["Red", "Blue"]
+    board = api.get(f"/api/ideas-boards/{first['id']}", headers=owner["headers"]).json()
+    response = api.put(f"/api/ideas-boards/{first['id']}", json={**board, "ideas": []}, headers=owner["headers"])
+    assert response.status_code == 200, response.text
+    other = api.get(f"/api/ideas-boards/{second['id']}", headers=owner["headers"]).json()
+    assert [idea["text"] for idea in other["ideas"]] == ["idea"]
+
+
+def test_unseeded_tools_are_not_created(api, owner):
+    session = bulk(api, owner).json()[0]
+    assert session["name"] == "Group" and session["artifact_ids"] == {}
+    assert api.get(f"/api/ideas-boards/{session['id']}", headers=owner["headers"]).status_code == 404
+
+
+def test_only_the_project_owner_can_provision(api, owner, register):
+    outsider = register("outsider")
+    response = api.post("/api/sessions/bulk", json={"project_id": owner["project_id"], "count": 2},
+                        headers=outsider["headers"])
+    assert response.status_code == 404
+    assert api.get("/api/sessions", headers=owner["headers"]).json() == []
+
+
+@pytest.mark.parametrize("workshop", [
+    {"count": 0},
+    {"count": 101},
+    {"names": []},
+    {"names": [f"Group {n}" for n in range(101)]},
+    {"problem_trees": {"items": []}},
+    {"problem_trees": {"core_problem": "x", "items": [{"text": "t", "type": "symptom"}]}},
+])
+def test_invalid_workshops_are_rejected(api, owner, workshop):
+    assert bulk(api, owner, **workshop).status_code == 422
+    assert api.get("/api/sessions", headers=owner["headers"]).json() == []
@@ -0,0 +1,66 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from write_coalescer import WriteCoalescer
+
+
+class SlowDatabase:
+    """Delays bulk writes so shutdown can arrive while a flush is in flight."""
+
+    def __init__(self, db, delay: float):
+        self.db = db
+        self.delay = delay
+
+    def __getitem__(self, name):
+        collection = self.db[name]
+        delay = self.delay
+
+        class Slow:
+            def __getattr__(self, attr):
+                return getattr(collection, attr)
+
+            async def bulk_write(self, ops, **kw):
+                await asyncio.sleep(delay)
+                return await collection.bulk_write(ops, **kw)
+
+        return Slow()
+
+
+def fields(text: str) -> dict:
+    return {"items": [{"id": "i1", "text": text}], "updated_at": "2026-01-01T00:00:00+00:00"}
+
+
+def test_stop_waits_for_an_in_flight_flush_and_writes_the_rest():
+    async def run():
+        db = AsyncMongoMockClient().db
+        coalescer = WriteCoalescer(SlowDatabase(db, 0.2), window_ms=10, durability="flush")
+        coalescer.start()
+        first = asyncio.create_task(coalescer.save("feedback", "s1", fields("first")))
+        await asyncio.sleep(0.05)
+        # The first flush is now writing; this save waits for the next one
+        second = asyncio.create_task(coalescer.save("feedback", "s2", fields("second")))
+        await asyncio.sleep(0)
+        await coalescer.stop()
+        # Both callers were told their write is stored
+        await asyncio.wait_for(asyncio.gather(first, second), 1)
+        stored = {doc["session_id"]: doc["items"][0]["text"] async for doc in db.feedback.find({})}
+        assert stored == {"s1": "first", "s2": "second"}
+
+    asyncio.run(run())
+
+
+def test_flush_retries_a_batch_left_by_an_interrupted_flush():
+    async def run():
+        db = AsyncMongoMockClient().db
+        coalescer = WriteCoalescer(SlowDatabase(db, 0.2), window_ms=1000, durability="ack")
+        await coalescer.save("feedback", "s1", fields("first"))
+        interrupted = asyncio.create_task(coalescer.flush())
+        await asyncio.sleep(0.05)
+        interrupted.cancel()
+        await asyncio.gather(interrupted, return_exceptions=True)
+        assert await db.feedback.count_documents({}) == 0
+        await coalescer.flush()
+        assert (await db.feedback.find_one({"session_id": "s1"}))["items"][0]["text"] == "first"
+
+    asyncio.run(run())